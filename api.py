@@ -0,0 +1,73 @@
+# Helpers for the JSON API (/api/v1, the views are in main.py).
+#
+# Every response is compact JSON with an ETag; a client that sends the ETag
+# back in If-None-Match gets an empty 304 when nothing changed. Lists are
+# keyset pages (see pagination.py): {"data": [...], "cursor": <last id>} and
+# ?since=<cursor> on the next sync returns only the rows added after it.
+# ?fields=id,course_name picks the fields of each item.
+import json
+
+from flask import abort, make_response, request
+
+from pagination import cursor_args
+
+VERSION = 'v1'
+
+
+def json_body():
+    # the request's JSON object, {} without a body, 400 for a list or a scalar
+    data = request.get_json(silent=True)
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        abort(400, 'the body must be a JSON object')
+    return data
+
+
+def selected_fields(allowed):
+    # the requested fields in the requested order, 400 for unknown ones
+    fields = request.args.get('fields')
+    if not fields:
+        return tuple(allowed)
+    fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        abort(400, f'unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def pick(item, fields):
+    if isinstance(item, dict):
+        return {field: item[field] for field in fields}
+    return {field: getattr(item, field) for field in fields}
+
+
+def collection(page, fields):
+    # an empty page keeps the cursor the client sent, so it can ask again later
+    cursor = pick(page.items[-1], ('id',))['id'] if page.items else cursor_args()[0]
+    return {
+        'data': [pick(item, fields) for item in page.items],
+        'cursor': cursor,
+        'more': page.next_cursor is not None,
+    }
+
+
+def respond(payload, status=200, etag=None):
+    body = json.dumps(payload, separators=(',', ':'), default=str)
+    response = make_response(body, status)
+    response.mimetype = 'application/json'
+    if etag:
+        response.set_etag(etag)
+    else:
+        response.add_etag()
+    # the answer depends on who is logged in, so only the client may keep it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    if status == 200:
+        response.make_conditional(request)
+    return response
+
+
+def error(exc):
+    # HTTP errors as JSON instead of the HTML error pages
+    return respond({'error': exc.description}, exc.code)
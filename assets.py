@@ -0,0 +1,320 @@
+# Static asset pipeline.
+#
+# `flask build-assets` copies static/ into static/dist with a content hash in
+# every file name (css/style.css -> css/style.1a2b3c4d.css), concatenates the
+# BUNDLES, minifies CSS and JS, writes .gz (and .br when brotli is
+# installed) next to every text file, and with Pillow installed adds WebP
+# copies of the images at a few widths. dist/manifest.json maps the original
+# names to the built ones.
+#
+# A build runs next to the app: the new files are added beside the old ones
+# (a name only ever holds one content), the manifest is swapped in last, and
+# only files that neither this build nor the previous one use are removed.
+# Running workers notice the new manifest within ASSETS_RELOAD_INTERVAL
+# seconds, until then the files of their manifest are still there.
+#
+# Templates link files with asset_url('css/style.css'). With a manifest that
+# is /assets/css/style.1a2b3c4d.css, served with the best precompressed
+# encoding the browser accepts and cached for a year as immutable, since a
+# changed file gets a new name. Without a build it is the plain /static url,
+# so nothing has to be built during development.
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import time
+from importlib.util import find_spec
+
+from flask import request, send_file, url_for
+from markupsafe import Markup, escape
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# bundle name -> files it is made of, a bundle lives in the same directory as
+# its parts so relative url()s in the CSS keep working; static/ has a file
+# under the bundle's name that @imports the parts for use without a build
+BUNDLES = {
+    'css/dashboard.css': ['css/nucleo-icons.css', 'css/nucleo-svg.css', 'css/soft-ui-dashboard.css'],
+}
+TEXT_TYPES = ('.css', '.js', '.svg', '.json', '.txt')
+IMAGE_TYPES = ('.jpg', '.jpeg', '.png')
+# WebP variants are made at these widths, never wider than the original
+IMAGE_WIDTHS = (480, 960, 1600)
+SKIP_DIRS = ('dist', 'uploads')
+MAX_AGE = 365 * 24 * 3600
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s+')
+CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+
+
+def minify_css(css):
+    if find_spec('rcssmin'):
+        import rcssmin
+        return rcssmin.cssmin(css)
+    # keeps strings as they are, the CSS here has no comment markers inside them
+    css = CSS_COMMENT.sub('', css)
+    css = CSS_SPACE.sub(' ', css)
+    css = CSS_PUNCTUATION.sub(r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+def minify_js(js):
+    # safe JS minification needs a real tokenizer, without rjsmin the file is
+    # only compressed
+    if find_spec('rjsmin'):
+        import rjsmin
+        return rjsmin.jsmin(js)
+    return js
+
+
+def fingerprint(name, data):
+    base, ext = posixpath.splitext(name)
+    return f'{base}.{hashlib.sha256(data).hexdigest()[:8]}{ext}'
+
+
+def rewrite_css_urls(css, name, files):
+    # point url(../img/x.png) at the fingerprinted copy of x.png
+    folder = posixpath.dirname(name)
+
+    def replace(match):
+        url = match.group(2).strip()
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path, hash_sep, fragment = url.split('?')[0].partition('#')
+        target = posixpath.normpath(posixpath.join(folder, path))
+        if target not in files:
+            return match.group(0)
+        built = posixpath.relpath(files[target], folder)
+        return f'url("{built}{hash_sep}{fragment}")'
+
+    return CSS_URL.sub(replace, css)
+
+
+def source_files(static_folder):
+    for root, dirs, names in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if not (root == static_folder and d in SKIP_DIRS))
+        for filename in sorted(names):
+            path = os.path.join(root, filename)
+            yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+
+def replace_file(path, data):
+    # a worker may be sending the file right now, never let it see half of it
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+def write(dist, name, data):
+    path = os.path.join(dist, *name.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    replace_file(path, data)
+    return path
+
+
+def compress(path, data):
+    # keep a compressed copy only when it is actually smaller
+    written = 0
+    packed = gzip.compress(data, 9, mtime=0)
+    if len(packed) < len(data):
+        replace_file(path + '.gz', packed)
+        written += 1
+    if find_spec('brotli'):
+        import brotli
+        packed = brotli.compress(data, quality=11)
+        if len(packed) < len(data):
+            replace_file(path + '.br', packed)
+            written += 1
+    return written
+
+
+def image_variants(dist, built, path):
+    if not find_spec('PIL'):
+        return []
+    from PIL import Image
+    variants = []
+    with Image.open(path) as image:
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        widths = [w for w in IMAGE_WIDTHS if w < image.width] + [image.width]
+        base = posixpath.splitext(built)[0]
+        for width in widths:
+            height = round(image.height * width / image.width)
+            resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+            variant = f'{base}.w{width}.webp'
+            data = io.BytesIO()
+            resized.save(data, 'WEBP', quality=80, method=4)
+            write(dist, variant, data.getvalue())
+            variants.append([width, variant])
+    return variants
+
+
+def read_manifest(dist):
+    try:
+        with open(os.path.join(dist, 'manifest.json'), 'rb') as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def outputs(manifest):
+    # every file a manifest can send, precompressed copies included
+    built = set(manifest.get('files', {}).values())
+    built.update(variant for found in manifest.get('variants', {}).values() for width, variant in found)
+    return built | {name + suffix for name in built for suffix in ('.gz', '.br')}
+
+
+def prune(dist, keep):
+    for root, dirs, names in os.walk(dist, topdown=False):
+        for filename in names:
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, dist).replace(os.sep, '/')
+            if name != 'manifest.json' and name not in keep:
+                os.remove(path)
+        if root != dist and not os.listdir(root):
+            os.rmdir(root)
+
+
+def build(static_folder, dist):
+    # returns the manifest, {'files': {name: built name}, 'variants': {name: [[width, built name]]}}
+    os.makedirs(dist, exist_ok=True)
+    previous = read_manifest(dist)
+    sources = dict(source_files(static_folder))
+    files = {}
+    variants = {}
+
+    def emit(name, data):
+        built = fingerprint(name, data)
+        path = write(dist, built, data)
+        if name.endswith(TEXT_TYPES):
+            compress(path, data)
+        files[name] = built
+        return built, path
+
+    # everything but CSS first, so the CSS can point at the built names
+    for name, path in sources.items():
+        if name.endswith('.css'):
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        if name.endswith('.js') and not name.endswith('.min.js'):
+            data = minify_js(data.decode('utf-8')).encode('utf-8')
+        built, _ = emit(name, data)
+        if name.lower().endswith(IMAGE_TYPES):
+            found = image_variants(dist, built, path)
+            if found:
+                variants[name] = found
+
+    def css(name):
+        with open(sources[name], encoding='utf-8', errors='replace') as f:
+            text = rewrite_css_urls(f.read(), name, files)
+        return text if name.endswith('.min.css') else minify_css(text)
+
+    for name in sources:
+        if name.endswith('.css') and name not in BUNDLES:
+            emit(name, css(name).encode('utf-8'))
+    for bundle, parts in BUNDLES.items():
+        emit(bundle, '\n'.join(css(part) for part in parts if part in sources).encode('utf-8'))
+
+    manifest = {'files': files, 'variants': variants}
+    replace_file(os.path.join(dist, 'manifest.json'), json.dumps(manifest, indent=1, sort_keys=True).encode())
+    prune(dist, outputs(manifest) | outputs(previous))
+    return manifest
+
+
+class Assets:
+    def __init__(self):
+        self.app = None
+        self.dist = None
+        self.files = {}
+        self.variants = {}
+        # changes with every build, part of the template fragment cache keys
+        self.version = ''
+        self.mtime = None
+        self.checked = 0.0
+        self.reload_interval = 1.0
+
+    def init_app(self, app):
+        self.app = app
+        self.dist = app.config.get('ASSETS_DIST') or os.path.join(app.static_folder, 'dist')
+        self.reload_interval = app.config.get('ASSETS_RELOAD_INTERVAL', 1.0)
+        self.load()
+        app.before_request(self.reload)
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.send_asset)
+        app.jinja_env.globals['asset_url'] = self.url
+        app.jinja_env.globals['asset_picture'] = self.picture
+        app.extensions['assets'] = self
+
+    def manifest_mtime(self):
+        # a build replaces the file, so the inode changes even within one tick
+        try:
+            stat = os.stat(os.path.join(self.dist, 'manifest.json'))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def load(self):
+        self.mtime = self.manifest_mtime()
+        self.checked = time.monotonic()
+        try:
+            with open(os.path.join(self.dist, 'manifest.json'), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = b'{}'
+        manifest = json.loads(data)
+        self.version = hashlib.sha256(data).hexdigest()[:8] if manifest else ''
+        self.files = manifest.get('files', {})
+        self.variants = manifest.get('variants', {})
+        self.app.jinja_env.fragment_cache_version = self.version
+
+    def reload(self):
+        # picks up a build made while the app was running
+        if time.monotonic() - self.checked < self.reload_interval:
+            return
+        self.checked = time.monotonic()
+        if self.manifest_mtime() != self.mtime:
+            self.load()
+
+    def url(self, name):
+        built = self.files.get(name)
+        if built is None:
+            return url_for('static', filename=name)
+        return url_for('assets', filename=built)
+
+    def picture(self, name, alt='', **attrs):
+        # <picture> with the WebP variants and the original as the fallback
+        extra = ''.join(f' {key.rstrip("_")}="{escape(value)}"' for key, value in attrs.items())
+        img = f'<img src="{escape(self.url(name))}" alt="{escape(alt)}"{extra}>'
+        variants = self.variants.get(name)
+        if not variants:
+            return Markup(img)
+        srcset = ', '.join(f'{url_for("assets", filename=built)} {width}w' for width, built in variants)
+        return Markup(f'<picture><source type="image/webp" srcset="{escape(srcset)}">{img}</picture>')
+
+    def send_asset(self, filename):
+        path = safe_join(self.dist, filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if name in request.accept_encodings and os.path.isfile(path + suffix):
+                path += suffix
+                encoding = name
+                break
+
+        response = send_file(path, mimetype=mimetype, conditional=True, max_age=MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,683 @@
+# Performance suite: fills a separate database with synthetic data and drives
+# the Flask test client through the main user flows, then prints throughput
+# and latency percentiles per route.
+#
+#   python benchmark.py --scale 1000                     # 1k users, fresh data
+#   python benchmark.py --scale 100000 --requests 500 --threads 4
+#   python benchmark.py --save-baseline                  # store the results
+#   python benchmark.py --compare                        # fail on regressions
+#   python benchmark.py --render                         # template render times
+#   python benchmark.py --leaderboard 1000000            # rank lookups, no database
+#   python benchmark.py --media 64 --requests 50         # 64 clients seeking in a video
+#   python benchmark.py --scale 1000 --videos 100000     # a 100k video catalog
+#   python benchmark.py --search 1000000                 # typeahead over 1M videos
+#   python benchmark.py --import 10000 --requests 20     # 10k question CSV uploads
+#
+# --scale is the number of parent accounts, everything else grows with it:
+# as many students, a teacher per 100 parents, a course per 20, 10 videos and
+# 10 questions per course, 2 purchases per parent and a quiz result for half
+# of the students. --videos sets the size of the catalog on its own. The data
+# is kept in instance/benchmark.db and reused while --scale and --videos stay
+# the same.
+import argparse
+import atexit
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from flask import render_template
+from sqlalchemy import create_engine, insert, text
+from werkzeug.security import generate_password_hash
+
+import main
+import search
+from leaderboard import Leaderboards
+from main import (db, User, Students, Teacher, Courses, Videos, Paid_courses, Question, Answer,
+                  QuizResult, user_student_association)
+
+PASSWORD = 'benchmark'
+BATCH = 10000
+ROUTES = ('login', 'course', 'detail', 'detail_deep', 'quiz_get', 'quiz_post', 'children_score', 'leaderboard',
+          'my_courses', 'my_students')
+
+
+class Scale:
+    def __init__(self, parents, videos=None):
+        self.parents = parents
+        self.students = parents
+        self.teachers = max(1, parents // 100)
+        self.courses = max(1, parents // 20)
+        # the catalog can grow on its own: video i belongs to course i % courses + 1
+        self.videos = videos or self.courses * 10
+        self.questions_per_course = 10
+        self.purchases_per_parent = min(2, self.courses)
+
+    def parent_id(self, i):
+        return i
+
+    def student_user_id(self, i):
+        return self.parents + i
+
+    def teacher_user_id(self, i):
+        return self.parents + self.students + i
+
+    def video_id(self, course, k):
+        # id of the k-th video of a course, 0-based
+        return k * self.courses + course
+
+    def key(self):
+        # the data prepare_database() keeps between runs
+        return f'{self.parents}:{self.videos}'
+
+
+def batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_insert(table, rows):
+    for batch in batches(rows):
+        db.session.execute(insert(table), batch)
+    db.session.commit()
+
+
+def generate(scale, seed=1):
+    rng = random.Random(seed)
+    # hashing a million passwords would take hours, every account shares one
+    password = generate_password_hash(PASSWORD)
+    s = scale
+
+    bulk_insert(User, (
+        {'id': s.parent_id(i), 'name': f'parent{i}', 'phone': f'p{i}', 'password': password, 'role': 'user'}
+        for i in range(1, s.parents + 1)))
+    bulk_insert(User, (
+        {'id': s.student_user_id(i), 'name': f'student{i}', 'phone': f's{i}', 'password': password, 'role': 'student'}
+        for i in range(1, s.students + 1)))
+    bulk_insert(User, (
+        {'id': s.teacher_user_id(i), 'name': f'teacher{i}', 'phone': f't{i}', 'password': password, 'role': 'teacher'}
+        for i in range(1, s.teachers + 1)))
+
+    bulk_insert(Students, (
+        {'id': i, 'name': f'student{i}', 'parent_name': f'parent{i}', 'parent_phone': f'p{i}'}
+        for i in range(1, s.students + 1)))
+    bulk_insert(user_student_association, (
+        {'user_id': s.parent_id(i), 'student_id': i} for i in range(1, s.students + 1)))
+    bulk_insert(user_student_association, (
+        {'user_id': s.student_user_id(i), 'student_id': i} for i in range(1, s.students + 1)))
+
+    bulk_insert(Teacher, (
+        {'id': i, 'name': f'teacher{i}', 'phone': f't{i}', 'teacher_sample': '', 'status': 'approved'}
+        for i in range(1, s.teachers + 1)))
+
+    def course_teacher(c):
+        return c % s.teachers + 1
+
+    bulk_insert(Courses, (
+        {'id': c, 'course_name': f'course{c}', 'teacher_name': f'teacher{course_teacher(c)}',
+         'teacher_phone': f't{course_teacher(c)}', 'teacher_id': course_teacher(c), 'course_price': rng.randint(10, 500),
+         'status': 'pending' if c % 10 == 0 else 'approved'}
+        for c in range(1, s.courses + 1)))
+    def video(i):
+        c, v = i % s.courses + 1, i // s.courses
+        return {'id': i + 1, 'name': f'video{c}-{v}', 'description': 'lecture', 'teacher_name': f'teacher{course_teacher(c)}',
+                'teacher_phone': f't{course_teacher(c)}', 'course_name': f'course{c}', 'course_id': c,
+                'teacher_id': course_teacher(c), 'video_url': f'https://example.com/{c}/{v}', 'video_status': 'paid'}
+    bulk_insert(Videos, (video(i) for i in range(s.videos)))
+
+    def purchases():
+        for i in range(1, s.parents + 1):
+            for c in rng.sample(range(1, s.courses + 1), s.purchases_per_parent):
+                t = course_teacher(c)
+                yield {'user_id': s.parent_id(i), 'course_id': c, 'course_name': f'course{c}',
+                       'teacher_name': f'teacher{t}', 'teacher_phone': f't{t}',
+                       'user_name': f'parent{i}', 'user_phone': f'p{i}'}
+    bulk_insert(Paid_courses, purchases())
+
+    question_count = s.courses * s.questions_per_course
+    bulk_insert(Question, (
+        {'id': q, 'course_name': f'course{(q - 1) // s.questions_per_course + 1}', 'question_text': f'question {q}?'}
+        for q in range(1, question_count + 1)))
+    bulk_insert(Answer, (
+        {'question_id': q, 'answer_text': f'answer {a}', 'is_correct': a == q % 4}
+        for q in range(1, question_count + 1) for a in range(4)))
+
+    # only the first half of the students have a result, the other half can still take quizzes
+    bulk_insert(QuizResult, (
+        {'user_id': s.student_user_id(i), 'name': f'student{i}', 'course_name': f'course{rng.randint(1, s.courses)}',
+         'parent_name': f'parent{i}', 'score': rng.randint(0, s.questions_per_course)}
+        for i in range(1, s.students // 2 + 1)))
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Runner:
+    def __init__(self, app, scale, seed=1):
+        self.app = app
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.timings = {route: [] for route in ROUTES}
+        # each quiz can only be submitted once per student
+        self.fresh_students = list(range(scale.students // 2 + 1, scale.students + 1))
+        self.rng.shuffle(self.fresh_students)
+
+    def client(self, user_id=None, name=None, phone=None, role=None):
+        client = self.app.test_client()
+        if user_id:
+            with client.session_transaction() as session:
+                session.update(user_id=user_id, user_name=name, user_phone=phone, user_role=role)
+        return client
+
+    def parent_client(self, i):
+        return self.client(self.scale.parent_id(i), f'parent{i}', f'p{i}', 'user')
+
+    def student_client(self, i):
+        return self.client(self.scale.student_user_id(i), f'student{i}', f's{i}', 'student')
+
+    def teacher_client(self, i):
+        return self.client(self.scale.teacher_user_id(i), f'teacher{i}', f't{i}', 'teacher')
+
+    def timed(self, route, call):
+        started = time.perf_counter()
+        response = call()
+        elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            raise RuntimeError(f'{route} returned {response.status_code}')
+        with self.lock:
+            self.timings[route].append(elapsed)
+
+    def purchased_course(self, i):
+        with self.app.app_context():
+            return db.session.query(Paid_courses.course_id).filter_by(user_id=self.scale.parent_id(i)).limit(1).scalar()
+
+    def quiz_answers(self, course_name):
+        with self.app.app_context():
+            return main.answer_key(course_name)
+
+    def one_round(self):
+        s = self.scale
+        with self.lock:
+            parent = self.rng.randint(1, s.parents)
+            course = self.rng.randint(1, s.courses)
+            student = self.fresh_students.pop() if self.fresh_students else None
+            teacher = self.rng.randint(1, s.teachers)
+
+        self.timed('login', lambda: self.client().post('/login', data={'your_phone': f'p{parent}', 'your_pass': PASSWORD}))
+        self.timed('course', lambda: self.parent_client(parent).get('/course'))
+        course_id = self.purchased_course(parent)
+        self.timed('detail', lambda: self.parent_client(parent).get(f'/detail/{course_id}'))
+        # a page from anywhere in the course's videos
+        with self.lock:
+            after = s.video_id(course_id, self.rng.randrange(max(1, s.videos // s.courses)))
+        self.timed('detail_deep', lambda: self.parent_client(parent).get(f'/detail/{course_id}?after={after}'))
+        self.timed('children_score', lambda: self.parent_client(parent).get('/children_score'))
+        self.timed('leaderboard', lambda: self.parent_client(parent).get(f'/leaderboard/course{course}?format=json'))
+        self.timed('my_courses', lambda: self.teacher_client(teacher).get('/my_courses'))
+        self.timed('my_students', lambda: self.teacher_client(teacher).get('/my_students'))
+        if student is not None:
+            client = self.student_client(student)
+            self.timed('quiz_get', lambda: client.get(f'/quiz/course{course}'))
+            answers = self.quiz_answers(f'course{course}')
+            self.timed('quiz_post', lambda: client.post(f'/quiz/course{course}', data=answers))
+
+    def run(self, requests, threads):
+        per_thread = [requests // threads + (1 if t < requests % threads else 0) for t in range(threads)]
+
+        def work(count):
+            for _ in range(count):
+                self.one_round()
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=work, args=(count,)) for count in per_thread]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wall = time.perf_counter() - started
+
+        results = {}
+        for route, values in self.timings.items():
+            values.sort()
+            total = sum(values)
+            results[route] = {
+                'requests': len(values),
+                # requests per second of time spent in that route
+                'throughput': len(values) / total if total else 0.0,
+                'p50_ms': percentile(values, 0.50) * 1000,
+                'p95_ms': percentile(values, 0.95) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+            }
+        return results, wall
+
+
+def render_cases():
+    # (route, template, context) with the context each view passes
+    user = dict(user_id=1, user_name='parent1', user_phone='p1')
+    courses = main.approved_courses()
+    return [
+        ('index', 'index.html', dict(courses=courses, teachers=Teacher.query.limit(courses.per_page).all())),
+        ('course', 'course.html', dict(user, all_courses=courses)),
+        ('profile', 'profile.html', dict(user, my_children=Students.query.limit(3).all())),
+        ('teacher_profile', 'teacher_profile.html', dict(user, stats={'enrollments': 10, 'revenue': 500})),
+        ('child_pro', 'child_profile.html', dict(user)),
+    ]
+
+
+def time_renders(template, context, rounds):
+    values = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        render_template(template, **context)
+        values.append(time.perf_counter() - started)
+    values.sort()
+    return percentile(values, 0.50) * 1000
+
+
+def time_load(env, template):
+    # a cold worker: nothing compiled in memory yet
+    env.cache.clear()
+    started = time.perf_counter()
+    env.get_template(template)
+    return (time.perf_counter() - started) * 1000
+
+
+def render_benchmark(app, rounds):
+    # render time per route with and without the fragment cache, and template
+    # load time for a cold worker with and without the bytecode cache
+    env = app.jinja_env
+    print(f'{"route":<16}{"plain ms":>10}{"fragments ms":>14}{"parse ms":>10}{"bytecode ms":>13}')
+    with app.test_request_context('/'):
+        for route, template, context in render_cases():
+            env.fragment_cache = None
+            plain = time_renders(template, context, rounds)
+            env.fragment_cache = main.cache
+            render_template(template, **context)
+            cached = time_renders(template, context, rounds)
+
+            bytecode_cache = env.bytecode_cache
+            env.bytecode_cache = None
+            parse = time_load(env, template)
+            env.bytecode_cache = bytecode_cache
+            time_load(env, template)
+            load = time_load(env, template)
+            print(f'{route:<16}{plain:>10.3f}{cached:>14.3f}{parse:>10.2f}{load:>13.2f}')
+
+
+def leaderboard_benchmark(count, rounds, courses=100, questions=10, seed=1):
+    # seeding, rank lookups and inserts on `count` results held in memory,
+    # against sorting a course's scores for every lookup
+    rng = random.Random(seed)
+    rows = [(i, f'course{rng.randrange(courses)}', i, f'student{i}', rng.randint(0, questions))
+            for i in range(1, count + 1)]
+    boards = Leaderboards()
+    boards.load = lambda after_id: rows[after_id:]
+
+    started = time.perf_counter()
+    boards.refresh()
+    print(f'seeded {count} results in {courses} courses in {time.perf_counter() - started:.2f} s')
+
+    scores = {}
+    for _, course, _, _, score in rows:
+        scores.setdefault(course, []).append(score)
+    lookups = [(f'course{rng.randrange(courses)}', rng.randint(0, questions)) for _ in range(rounds)]
+
+    def timed(call):
+        values = []
+        for course, score in lookups:
+            started = time.perf_counter()
+            call(course, score)
+            values.append(time.perf_counter() - started)
+        values.sort()
+        return percentile(values, 0.50) * 1000, percentile(values, 0.99) * 1000
+
+    def sorted_rank(course, score):
+        ranked = sorted(scores[course], reverse=True)
+        return ranked.index(score) + 1 if score in ranked else None
+
+    def insert(course, score):
+        rows.append((len(rows) + 1, course, len(rows) + 1, 'new', score))
+        boards.refresh()
+
+    print(f'{"operation":<16}{"p50 ms":>10}{"p99 ms":>10}')
+    for name, call in (('rank', boards.standing), ('top 10', lambda course, score: boards.leaders(course, 10)),
+                       ('insert', insert), ('sort per call', sorted_rank)):
+        p50, p99 = timed(call)
+        print(f'{name:<16}{p50:>10.4f}{p99:>10.4f}')
+
+
+# words for the search benchmark's video names, common enough that a two
+# letter prefix matches tens of thousands of videos
+TOPICS = ('algebra', 'geometry', 'calculus', 'fractions', 'decimals', 'equations', 'grammar', 'reading',
+          'writing', 'spelling', 'physics', 'chemistry', 'biology', 'history', 'geography', 'economics',
+          'programming', 'statistics', 'probability', 'trigonometry', 'vocabulary', 'poetry', 'astronomy',
+          'ecology', 'genetics', 'mechanics', 'optics', 'electricity', 'magnetism', 'literature')
+LEVELS = ('intro', 'basics', 'practice', 'review', 'advanced', 'exam', 'revision', 'workshop')
+SEARCH_TARGET_MS = 20
+
+
+def search_database(path, count, seed=1):
+    # a videos table with the indexed columns and its FTS index, rebuilt only
+    # when the count changed
+    marker = path + '.count'
+    engine = create_engine(f'sqlite:///{path}')
+    if os.path.exists(path) and os.path.exists(marker) and open(marker).read() == str(count):
+        return engine
+    engine.dispose()
+    for stale in (path, marker):
+        if os.path.exists(stale):
+            os.remove(stale)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    engine = create_engine(f'sqlite:///{path}')
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE videos (id INTEGER PRIMARY KEY, name TEXT, description TEXT, '
+                          'course_name TEXT, teacher_name TEXT)'))
+        conn.execute(text(search.create_sql('video_search')))
+        for batch in batches(
+                {'id': i, 'name': f'{rng.choice(TOPICS)} {rng.choice(LEVELS)} part {i % 50 + 1}',
+                 'description': f'{rng.choice(LEVELS)} lesson on {rng.choice(TOPICS)}',
+                 'course_name': f'{rng.choice(TOPICS)} {i % 1000}', 'teacher_name': f'teacher{i % 500}'}
+                for i in range(1, count + 1)):
+            conn.execute(text('INSERT INTO videos VALUES (:id, :name, :description, :course_name, :teacher_name)'),
+                         batch)
+        search.rebuild(conn, 'video_search')
+    with open(marker, 'w') as f:
+        f.write(str(count))
+    print(f'indexed {count} videos in {time.perf_counter() - started:.1f} s')
+    return engine
+
+
+def search_benchmark(count, rounds, seed=1):
+    # ranked typeahead on `count` videos, the way search_view() asks for a
+    # page of them: a prefix as it is typed, a whole word, and a second word
+    engine = search_database(os.path.abspath(os.path.join('instance', 'benchmark_search.db')), count)
+    rng = random.Random(seed)
+    cases = {
+        'prefix 2': lambda: rng.choice(TOPICS)[:2],
+        'prefix 4': lambda: rng.choice(TOPICS)[:4],
+        'word': lambda: rng.choice(TOPICS),
+        'two words': lambda: f'{rng.choice(TOPICS)} {rng.choice(LEVELS)[:3]}',
+        'no match': lambda: f'zz{rng.randrange(1000)}',
+    }
+    print(f'{"query":<16}{"p50 ms":>10}{"p99 ms":>10}')
+    slowest = 0
+    with engine.connect() as conn:
+        for name, query in cases.items():
+            queries = [query() for _ in range(rounds)]
+            values = []
+            for q in queries:
+                started = time.perf_counter()
+                search.search(conn, 'video_search', q, 20)
+                values.append(time.perf_counter() - started)
+            values.sort()
+            p50, p99 = percentile(values, 0.50) * 1000, percentile(values, 0.99) * 1000
+            slowest = max(slowest, p99)
+            print(f'{name:<16}{p50:>10.2f}{p99:>10.2f}')
+    engine.dispose()
+    print(f'slowest p99 {slowest:.2f} ms, target {SEARCH_TARGET_MS} ms')
+    return slowest <= SEARCH_TARGET_MS
+
+
+def quiz_csv(count, answers=4):
+    lines = ['course_name,question,' + ','.join(f'answer_{j}' for j in range(1, answers + 1)) + ',correct']
+    for q in range(1, count + 1):
+        lines.append(f'course{q % 50},question {q}?,' + ','.join(f'answer {j}' for j in range(1, answers + 1))
+                     + f',{q % answers + 1}')
+    return '\n'.join(lines) + '\n'
+
+
+def import_benchmark(count, rounds):
+    # a teacher uploading a quiz of `count` questions as CSV, `rounds` times:
+    # the whole request, and the parsing and checking on their own
+    folder = tempfile.mkdtemp(prefix='benchmark-import-')
+    atexit.register(shutil.rmtree, folder, ignore_errors=True)
+    app = create_app(os.path.join(folder, 'import.db'))
+    with app.app_context():
+        db.session.add(User(id=1, name='teacher1', phone='t1', password='', role='teacher'))
+        db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=1, user_name='teacher1', user_phone='t1', user_role='teacher')
+    body = quiz_csv(count).encode()
+
+    uploads = []
+    checks = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        response = client.post('/add_question', data={'quiz_file': (io.BytesIO(body), 'quiz.csv')},
+                               content_type='multipart/form-data')
+        uploads.append(time.perf_counter() - started)
+        if response.status_code != 302:
+            raise RuntimeError(f'import returned {response.status_code}')
+        started = time.perf_counter()
+        main.validate_questions(main.questions_from_csv(body.decode()))
+        checks.append(time.perf_counter() - started)
+
+    with app.app_context():
+        imported = db.session.query(Question).count()
+    if imported != count * rounds:
+        raise RuntimeError(f'imported {imported} questions, expected {count * rounds}')
+    print(f'{rounds} imports of {count} questions ({len(body) >> 10} KiB)')
+    print(f'{"step":<16}{"q/s":>10}{"p50 ms":>10}{"p99 ms":>10}')
+    for name, values in (('upload', uploads), ('parse+check', checks)):
+        values.sort()
+        p50 = percentile(values, 0.50)
+        print(f'{name:<16}{count / p50:>10.0f}{p50 * 1000:>10.2f}{percentile(values, 0.99) * 1000:>10.2f}')
+
+
+def media_file(folder, size):
+    # a stand-in video of `size` bytes, written once
+    path = os.path.join(folder, 'lesson.mp4')
+    if not os.path.exists(path) or os.path.getsize(path) != size:
+        os.makedirs(folder, exist_ok=True)
+        with open(path, 'wb') as f:
+            for _ in range(size // (1 << 20)):
+                f.write(os.urandom(1 << 20))
+    return path
+
+
+def media_benchmark(clients, rounds, size_mb=64):
+    # every client asks for `rounds` random 1 MiB ranges, alternating ranges
+    # with an end (read from a memory map) and ranges to the end of the file
+    # (sent through the file wrapper), the way a player seeks
+    folder = os.path.join('instance', 'benchmark_media')
+    size = size_mb << 20
+    media_file(folder, size)
+    app = main.create_app({
+        'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+        'QUIZ_SPOOL_DIR': spool_dir(),
+        'MEDIA_FOLDER': os.path.abspath(folder),
+        'START_BACKGROUND_WORKERS': False,
+        'TESTING': True,
+        'SLOW_REQUEST_SECONDS': 60,
+    })
+    chunk = 1 << 20
+    lock = threading.Lock()
+    timings = []
+    statuses = {}
+    sent = [0]
+
+    def work(seed):
+        rng = random.Random(seed)
+        client = app.test_client()
+        for i in range(rounds):
+            if i % 2:
+                header = f'bytes=-{chunk}'
+            else:
+                start = rng.randrange(0, size - chunk)
+                header = f'bytes={start}-{start + chunk - 1}'
+            started = time.perf_counter()
+            response = client.get('/media/lesson.mp4', headers={'Range': header})
+            length = len(response.get_data())
+            response.close()
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 206:
+                    timings.append(elapsed)
+                    sent[0] += length
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=work, args=(seed,)) for seed in range(clients)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    wall = time.perf_counter() - started
+    timings.sort()
+    print(f'{clients} clients, {clients * rounds} range requests on a {size_mb} MiB file in {wall:.2f} s')
+    print(f'{sent[0] / wall / (1 << 20):.1f} MiB/s, p50 {percentile(timings, 0.50) * 1000:.2f} ms, '
+          f'p99 {percentile(timings, 0.99) * 1000:.2f} ms, statuses {statuses}')
+
+
+def prepare_database(path, scale):
+    # rebuild the data only when the scale changed
+    marker = path + '.scale'
+    if os.path.exists(path) and os.path.exists(marker) and open(marker).read() == scale.key():
+        return create_app(path), False
+    for stale in (path, path + '-wal', path + '-shm', marker):
+        if os.path.exists(stale):
+            os.remove(stale)
+    app = create_app(path)
+    with app.app_context():
+        generate(scale)
+    with open(marker, 'w') as f:
+        f.write(scale.key())
+    return app, True
+
+
+def spool_dir():
+    # quiz submissions made while measuring must never reach the real spool
+    path = tempfile.mkdtemp(prefix='benchmark-quiz-spool-')
+    atexit.register(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+def create_app(path):
+    return main.create_app({
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'QUIZ_SPOOL_DIR': spool_dir(),
+        'WTF_CSRF_ENABLED': False,
+        'TESTING': True,
+        # keep the slow request log quiet while measuring
+        'SLOW_REQUEST_SECONDS': 60,
+    })
+
+
+def print_results(results, wall, baseline=None):
+    print(f'{"route":<16}{"requests":>9}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}')
+    for route, r in results.items():
+        line = f'{route:<16}{r["requests"]:>9}{r["throughput"]:>10.1f}{r["p50_ms"]:>10.2f}{r["p95_ms"]:>10.2f}{r["p99_ms"]:>10.2f}'
+        if baseline and route in baseline:
+            line += f'   (baseline p50 {baseline[route]["p50_ms"]:.2f}, p99 {baseline[route]["p99_ms"]:.2f})'
+        print(line)
+    print(f'wall time {wall:.2f} s')
+
+
+def regressions(results, baseline, tolerance):
+    found = []
+    for route, r in results.items():
+        old = baseline.get(route)
+        if not old or not r['requests']:
+            continue
+        for field in ('p50_ms', 'p99_ms'):
+            if old[field] and r[field] > old[field] * (1 + tolerance):
+                found.append(f'{route} {field}: {old[field]:.2f} -> {r[field]:.2f}')
+    return found
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the main user flows on synthetic data.')
+    parser.add_argument('--scale', type=int, default=1000, help='number of parent accounts (default 1000)')
+    parser.add_argument('--videos', type=int, help='videos in the catalog, spread over the courses '
+                                                   '(default 10 per course)')
+    parser.add_argument('--requests', type=int, default=200, help='rounds through every flow (default 200)')
+    parser.add_argument('--threads', type=int, default=1, help='concurrent clients (default 1)')
+    parser.add_argument('--database', default=os.path.join('instance', 'benchmark.db'))
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline')
+    parser.add_argument('--compare', action='store_true', help='exit 1 if a route got slower than --baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown for --compare (default 0.2)')
+    parser.add_argument('--output', help='also write the results as JSON here')
+    parser.add_argument('--render', action='store_true', help='only time template rendering, --requests times each')
+    parser.add_argument('--media', type=int, metavar='CLIENTS',
+                        help='only time range requests for a local video from this many clients, --requests each')
+    parser.add_argument('--leaderboard', type=int, metavar='RESULTS',
+                        help='only time leaderboard lookups on this many in-memory results, --requests of each')
+    parser.add_argument('--search', type=int, metavar='VIDEOS',
+                        help=f'only time typeahead search on this many videos, --requests of each query, '
+                             f'exit 1 above {SEARCH_TARGET_MS} ms p99')
+    parser.add_argument('--import', type=int, metavar='QUESTIONS', dest='import_questions',
+                        help='only time CSV quiz uploads of this many questions, --requests of them')
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    if args.leaderboard:
+        leaderboard_benchmark(args.leaderboard, args.requests)
+        return 0
+    if args.media:
+        media_benchmark(args.media, args.requests)
+        return 0
+    if args.import_questions:
+        import_benchmark(args.import_questions, args.requests)
+        return 0
+    if args.search:
+        return 0 if search_benchmark(args.search, args.requests) else 1
+    scale = Scale(args.scale, args.videos)
+    os.makedirs(os.path.dirname(os.path.abspath(args.database)), exist_ok=True)
+
+    started = time.perf_counter()
+    app, generated = prepare_database(os.path.abspath(args.database), scale)
+    if generated:
+        print(f'generated data for scale {args.scale} in {time.perf_counter() - started:.1f} s')
+
+    if args.render:
+        render_benchmark(app, args.requests)
+        return 0
+
+    results, wall = Runner(app, scale).run(args.requests, args.threads)
+
+    baseline = None
+    if args.compare and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['routes']
+    print_results(results, wall, baseline)
+
+    report = {'scale': args.scale, 'videos': scale.videos, 'requests': args.requests, 'threads': args.threads, 'routes': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'baseline saved to {args.baseline}')
+
+    if baseline is not None:
+        found = regressions(results, baseline, args.tolerance)
+        for line in found:
+            print(f'REGRESSION {line}')
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
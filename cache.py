@@ -0,0 +1,172 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUBackend:
+    # in-process cache, every worker keeps its own copy
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # counters live outside the LRU so they can never be evicted
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self.entries[key] = (time.time() + ttl if ttl else None, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def counter(self, key):
+        return self.counters.get(key, 0)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class LocalClient:
+    # stand-in for a redis client so the shared backend can run without a server
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires and expires < time.time():
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        with self.lock:
+            self.data[key] = (time.time() + ex if ex else None, value)
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            expires, value = self.data.get(key, (None, 0))
+            self.data[key] = (expires, int(value) + 1)
+            return int(value) + 1
+
+    def flushdb(self):
+        with self.lock:
+            self.data.clear()
+
+
+class SharedBackend:
+    # cache shared by every worker, values are pickled so any client that
+    # stores bytes (redis or LocalClient) works
+    def __init__(self, client, prefix='argon:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return None if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def counter(self, key):
+        return int(self.client.get(self.prefix + key) or 0)
+
+    def clear(self):
+        self.client.flushdb()
+
+
+class Cache:
+    # settings are read from <config_prefix>_URL, _MAX_ENTRIES and _TTL
+    def __init__(self, backend=None, ttl=None, config_prefix='CACHE'):
+        self.backend = backend or LRUBackend()
+        self.ttl = ttl
+        self.config_prefix = config_prefix
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        self.backend = make_backend(app.config.get(f'{prefix}_URL'), app.config.get(f'{prefix}_MAX_ENTRIES', 512))
+        self.ttl = app.config.get(f'{prefix}_TTL')
+        app.extensions[prefix.lower()] = self
+
+    def count(self, namespace, field):
+        with self.lock:
+            counters = self.stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'invalidations': 0})
+            counters[field] += 1
+
+    def generation(self, namespace):
+        # invalidating a namespace bumps its generation, old keys are never
+        # read again and age out of the backend on their own
+        return self.backend.counter(f'gen:{namespace}')
+
+    def get_or_set(self, namespace, name, build):
+        key = f'{namespace}:{self.generation(namespace)}:{name}'
+        value = self.backend.get(key)
+        if value is not None:
+            self.count(namespace, 'hits')
+            return value
+        self.count(namespace, 'misses')
+        value = build()
+        self.backend.set(key, value, self.ttl)
+        return value
+
+    def delete(self, namespace, name):
+        self.backend.delete(f'{namespace}:{self.generation(namespace)}:{name}')
+
+    def invalidate(self, namespace):
+        self.backend.incr(f'gen:{namespace}')
+        self.count(namespace, 'invalidations')
+
+    def clear(self):
+        self.backend.clear()
+
+
+def make_backend(url='memory://', max_entries=512):
+    # memory:// - per-process LRU
+    # local://  - shared backend on the in-process LocalClient stand-in
+    # redis://  - shared backend on a real redis server (needs the redis package)
+    url = url or 'memory://'
+    if url.startswith('redis://'):
+        import redis
+        return SharedBackend(redis.Redis.from_url(url))
+    if url.startswith('local://'):
+        return SharedBackend(LocalClient())
+    return LRUBackend(max_entries)
@@ -0,0 +1,81 @@
+import os
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# SQLite is tuned for one node: WAL lets readers run next to the single
+# writer and the busy timeout makes writers queue instead of failing with
+# "database is locked". A postgresql:// url gets a connection pool sized
+# from the config. Other databases are refused at startup: the stats
+# upserts, the migrations and search only speak these two dialects.
+ENGINE_DEFAULTS = {
+    'SQLITE_BUSY_TIMEOUT': 30,          # seconds a writer waits for the lock
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',     # safe with WAL, one fsync per checkpoint
+    'SQLITE_CACHE_SIZE': -20000,        # negative means KiB, so ~20 MB per connection
+    'DB_POOL_SIZE': 10,
+    'DB_MAX_OVERFLOW': 20,
+    'DB_POOL_TIMEOUT': 30,
+    'DB_POOL_RECYCLE': 1800,
+    'DB_POOL_PRE_PING': True,
+}
+
+DEFAULT_URL = 'sqlite:///users.db'
+SUPPORTED_BACKENDS = ('sqlite', 'postgresql')
+
+
+def database_url(config):
+    # SQLALCHEMY_DATABASE_URI set in the config or as FLASK_SQLALCHEMY_DATABASE_URI
+    # wins, then DATABASE_URL, which is what most hosts hand out; old ones
+    # still say postgres://
+    url = config.get('SQLALCHEMY_DATABASE_URI') or os.environ.get('DATABASE_URL') or DEFAULT_URL
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    backend = make_url(url).get_backend_name()
+    if backend not in SUPPORTED_BACKENDS:
+        raise ValueError(f'{backend} databases are not supported, use one of {", ".join(SUPPORTED_BACKENDS)}')
+    return url
+
+
+def is_sqlite(url):
+    return make_url(url).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    if is_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        return {
+            'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT'], 'check_same_thread': False},
+        }
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def configure_database(app):
+    # call before db.init_app(), fills in the url and the engine options
+    for key, value in ENGINE_DEFAULTS.items():
+        app.config.setdefault(key, value)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url(app.config)
+    options = engine_options(app.config)
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def tune_sqlite(engine, config):
+    # call after db.init_app(), runs the pragmas on every new connection
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'] * 1000)}")
+        cursor.execute(f"PRAGMA cache_size={int(config['SQLITE_CACHE_SIZE'])}")
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.close()
@@ -0,0 +1,174 @@
+# Per-course leaderboards kept in memory.
+#
+# Each course keeps a Fenwick tree of how many results have each score, so
+# "how many did better than 7" is O(log max score) and rank and percentile
+# need no scan, plus the top LEADERBOARD_SIZE results in order. Results are
+# only ever added, so both are maintained incrementally: the boards are
+# seeded from QuizResult at startup and then pick up every row with a
+# higher id than the last one seen, right after this process records quiz
+# results and at most every LEADERBOARD_REFRESH seconds for rows written by
+# other workers.
+#
+# Ids are handed out when a row is inserted, not when it commits, so on
+# PostgreSQL a result can become visible after one with a higher id was
+# already read. Every id skipped over is remembered as a gap and read again
+# on the following refreshes, until its row shows up or LEADERBOARD_LATE_SECONDS
+# passed (the transaction was rolled back or the id was never used).
+import bisect
+import threading
+import time
+
+
+class Fenwick:
+    # counts per score, prefix sums in O(log n)
+    def __init__(self, size=16):
+        self.tree = [0] * (size + 1)
+
+    @property
+    def size(self):
+        return len(self.tree) - 1
+
+    def grow(self, size):
+        counts = [self.count(i) for i in range(self.size)]
+        self.tree = [0] * (size + 1)
+        for i, count in enumerate(counts):
+            if count:
+                self.add(i, count)
+
+    def add(self, index, delta=1):
+        if index >= self.size:
+            self.grow(max(index + 1, self.size * 2))
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, index):
+        # sum of the counts of 0..index
+        total = 0
+        i = min(index, self.size - 1) + 1
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    def count(self, index):
+        return self.prefix(index) - (self.prefix(index - 1) if index > 0 else 0)
+
+
+class CourseBoard:
+    def __init__(self, top_size):
+        self.scores = Fenwick()
+        self.total = 0
+        self.top_size = top_size
+        # (-score, result id, user id, name), best first, ties go to the earlier result
+        self.top = []
+
+    def add(self, result_id, user_id, name, score):
+        score = max(0, score)
+        self.scores.add(score)
+        self.total += 1
+        entry = (-score, result_id, user_id, name)
+        if len(self.top) < self.top_size or entry < self.top[-1]:
+            bisect.insort(self.top, entry)
+            del self.top[self.top_size:]
+
+    def rank(self, score):
+        # 1 + how many scored higher, so equal scores share a rank
+        return 1 + self.total - self.scores.prefix(score)
+
+    def percentile(self, score):
+        # share of results at or below this score
+        if not self.total:
+            return None
+        return round(100.0 * self.scores.prefix(score) / self.total, 1)
+
+    def leaders(self, limit):
+        return [{'rank': self.rank(-score), 'user_id': user_id, 'name': name, 'score': -score}
+                for score, result_id, user_id, name in self.top[:limit]]
+
+
+class Leaderboards:
+    def __init__(self):
+        self.app = None
+        self.load = None
+        self.boards = {}
+        self.last_id = 0
+        self.refreshed = 0.0
+        self.seeded = False
+        self.lock = threading.RLock()
+        self.top_size = 100
+        self.interval = 1.0
+        # id -> when it was skipped, for the ids below last_id not seen yet
+        self.gaps = {}
+        self.late_seconds = 60.0
+
+    def init_app(self, app, load):
+        # load(after_id) yields (id, course_name, user_id, name, score) ordered by id
+        self.app = app
+        self.load = load
+        self.top_size = app.config.get('LEADERBOARD_SIZE', 100)
+        self.interval = app.config.get('LEADERBOARD_REFRESH', 1.0)
+        self.late_seconds = app.config.get('LEADERBOARD_LATE_SECONDS', 60.0)
+        # a new app can mean a different database, start over
+        self.boards = {}
+        self.last_id = 0
+        self.gaps = {}
+        self.seeded = False
+        app.extensions['leaderboards'] = self
+
+    def add(self, result_id, course_name, user_id, name, score):
+        board = self.boards.get(course_name)
+        if board is None:
+            board = self.boards[course_name] = CourseBoard(self.top_size)
+        board.add(result_id, user_id, name, score)
+        self.last_id = max(self.last_id, result_id)
+
+    def refresh(self):
+        # needs an app context, picks up every result newer than the last one
+        # seen and the ones that committed late into a gap
+        with self.lock:
+            now = time.monotonic()
+            self.gaps = {id: skipped for id, skipped in self.gaps.items() if now - skipped < self.late_seconds}
+            last_id = self.last_id
+            for row in self.load(min(self.gaps) - 1 if self.gaps else last_id):
+                result_id = row[0]
+                if result_id <= last_id:
+                    # read again for the gaps, the rest was counted already
+                    if self.gaps.pop(result_id, None) is not None:
+                        self.add(*row)
+                    continue
+                if self.seeded:
+                    # the holes of the table at startup are old rollbacks and deletes
+                    for missing in range(self.last_id + 1, result_id):
+                        self.gaps[missing] = now
+                self.add(*row)
+            self.refreshed = now
+            self.seeded = True
+
+    def seed(self):
+        with self.app.app_context():
+            self.refresh()
+
+    def start(self):
+        # seed in the background so a large table doesn't hold up startup,
+        # lookups wait on the lock until it is done
+        threading.Thread(target=self.seed, name='leaderboard-seed', daemon=True).start()
+
+    def board(self, course_name):
+        if not self.seeded or time.monotonic() - self.refreshed > self.interval:
+            self.refresh()
+        return self.boards.get(course_name)
+
+    def leaders(self, course_name, limit=10):
+        with self.lock:
+            board = self.board(course_name)
+            return board.leaders(min(limit, self.top_size)) if board else []
+
+    def standing(self, course_name, score):
+        # (rank, results in the course, percentile) of a score
+        with self.lock:
+            board = self.board(course_name)
+            if board is None or not board.total:
+                return None, 0, None
+            return board.rank(score), board.total, board.percentile(score)
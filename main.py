@@ -1,136 +1,411 @@
 
-from flask import Flask, render_template, request, redirect, session,url_for,flash
+from flask import Flask, Blueprint, render_template, request, redirect, session,url_for,flash, g, current_app, make_response, abort
 import requests
 import datetime
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+import random
+from collections import namedtuple
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField
 from wtforms.validators import DataRequired, Length
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin, LoginManager, login_required, logout_user, current_user
-from sqlalchemy.exc import NoResultFound
+from sqlalchemy.exc import IntegrityError, NoResultFound
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import HTTPException
 from flask_admin import Admin
 from flask_admin.contrib.sqla import ModelView
 from functools import wraps
-
-app = Flask(__name__)
-# load the extension
-login_manager = LoginManager(app)
-
-
-app.config['SECRET_KEY'] = 'any-secret-key-you-choose'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
-with app.app_context():
-    user_student_association = db.Table(
-        'user_student_association',
-        db.Column('user_id', db.Integer, db.ForeignKey('user.id')),
-        db.Column('student_id', db.Integer, db.ForeignKey('students.id'))
+from sqlalchemy import DDL, delete, event, func, insert, select, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, selectinload
+from assets import Assets, build as build_assets
+from cache import Cache
+from templating import configure_templates
+from database import configure_database, tune_sqlite
+from leaderboard import Leaderboards
+from media import Media, PREFIX as MEDIA_PREFIX
+from uploads import Uploads, new_id as new_upload_id
+from metrics import Metrics
+from quiz_queue import QuizQueue
+from pagination import Page, keyset_page, cursor_args, page_size, wants_json, page_json
+import api
+import migrations
+import search
+
+# defaults for every setting, each one can be overridden from the environment
+# with a FLASK_ prefix, e.g. FLASK_SQLALCHEMY_DATABASE_URI=... or FLASK_CACHE_TTL=60
+# (DATABASE_URL works too). Pool and SQLite pragma settings are in database.py.
+DEFAULT_CONFIG = {
+    # signs the session cookie, has to come from FLASK_SECRET_KEY outside of
+    # debug and testing, see create_app()
+    'SECRET_KEY': None,
+    # None means DATABASE_URL, or sqlite:///users.db without it
+    'SQLALCHEMY_DATABASE_URI': None,
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    'CACHE_URL': 'memory://',
+    'CACHE_MAX_ENTRIES': 512,
+    'CACHE_TTL': 300,
+    # logged in users, see load_identity()
+    'IDENTITY_CACHE_URL': 'memory://',
+    'IDENTITY_CACHE_MAX_ENTRIES': 10000,
+    'IDENTITY_CACHE_TTL': 60,
+    # give every student their own stable question and answer order
+    'QUIZ_SHUFFLE': False,
+    # grade submissions in the background and store them in batches, see quiz_queue.py
+    'QUIZ_QUEUE': True,
+    'QUIZ_QUEUE_BATCH': 100,
+    'QUIZ_QUEUE_INTERVAL': 0.5,
+    # a submission that fails this many times is moved to the spool's dead/ directory
+    'QUIZ_QUEUE_MAX_ATTEMPTS': 3,
+    # serve.py turns this off in the parent process that only migrates the database
+    'START_BACKGROUND_WORKERS': True,
+    # every course keeps its best LEADERBOARD_SIZE results in memory and picks up
+    # results stored by other workers at most this many seconds late, see leaderboard.py
+    'LEADERBOARD_SIZE': 100,
+    'LEADERBOARD_REFRESH': 1.0,
+    # how long a result id skipped over is still expected to commit
+    'LEADERBOARD_LATE_SECONDS': 60.0,
+    # compiled templates are kept here, None means instance/jinja_cache
+    'TEMPLATE_CACHE_DIR': None,
+    # cache the {% cache %} blocks of the templates, see templating.py
+    'TEMPLATE_FRAGMENT_CACHE': True,
+    # locally stored videos, None means instance/media; at most MEDIA_MAX_STREAMS
+    # downloads at once per worker, see media.py
+    'MEDIA_FOLDER': None,
+    'MEDIA_MAX_STREAMS': 32,
+    'MEDIA_MAX_AGE': 3600,
+    # resumable uploads, see uploads.py; None means instance/uploads
+    'UPLOAD_FOLDER': None,
+    'UPLOAD_CHUNK_SIZE': 8 * 1024 * 1024,
+    'UPLOAD_MAX_SIZE': 4 * 1024 ** 3,
+    'UPLOAD_WORKERS': 2,
+    # requests slower than this are logged with their SQL, see metrics.py
+    'SLOW_REQUEST_SECONDS': 0.5,
+    # serve.py upgrades the schema once before forking and turns this off in the workers
+    'UPGRADE_DB_ON_START': True,
+}
+
+db = SQLAlchemy()
+login_manager = LoginManager()
+cache = Cache()
+identities = Cache(config_prefix='IDENTITY_CACHE')
+metrics = Metrics()
+quiz_queue = QuizQueue()
+leaderboards = Leaderboards()
+assets = Assets()
+media = Media()
+uploads = Uploads()
+bp = Blueprint('main', __name__, cli_group=None)
+api_bp = Blueprint('api', __name__, url_prefix=f'/api/{api.VERSION}')
+api_bp.register_error_handler(HTTPException, api.error)
+
+# family links: a parent account is linked to each of its children's
+# Students rows, and a student account to its own Students row
+user_student_association = db.Table(
+    'user_student_association',
+    db.Column('user_id', db.Integer, db.ForeignKey('user.id'), index=True),
+    db.Column('student_id', db.Integer, db.ForeignKey('students.id'), index=True),
+    db.Index('uq_user_student', 'user_id', 'student_id', unique=True),
+)
+
+
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    phone = db.Column(db.String(100), unique=True, index=True)
+    password = db.Column(db.String(255))
+    name = db.Column(db.String(1000))
+    role = db.Column(db.String(1000), default="user")
+    students = db.relationship('Students', secondary=user_student_association, back_populates='users')
+
+
+class Students(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(1000), index=True)
+    parent_name = db.Column(db.String(1000), index=True)
+    parent_phone = db.Column(db.String(1000))
+    users = db.relationship('User', secondary=user_student_association, back_populates='students')
+
+
+class Teacher(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(1000))
+    phone = db.Column(db.String(100), unique=True)
+    teacher_sample = db.Column(db.String(100))
+    # set when the sample was uploaded, see uploads.py
+    sample_hash = db.Column(db.String(64), index=True)
+    sample_poster = db.Column(db.String(100))
+    status = db.Column(db.String(100), index=True)
+    videos = db.relationship('Videos', back_populates='teacher')
+    courses = db.relationship('Courses', back_populates='teacher')
+
+
+    def __repr__(self):
+        return f"<Teacher {self.name}>"
+
+
+class Courses(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    course_name = db.Column(db.String(1000))
+    teacher_name = db.Column(db.String(100))
+    teacher_phone = db.Column(db.String(100), index=True)
+    course_price = db.Column(db.Integer)
+    rate = db.Column(db.String(100))
+    course_sample = db.Column(db.String(100))
+    status = db.Column(db.String(100), index=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), index=True)
+    teacher = db.relationship('Teacher', back_populates='courses')
+    videos = db.relationship('Videos', back_populates='course', order_by='Videos.id')
+
+
+
+class Videos(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(1000))
+    description = db.Column(db.String(100))
+    grade = db.Column(db.Integer)
+    teacher_name = db.Column(db.String(100))
+    teacher_phone = db.Column(db.String(100))
+    course_name = db.Column(db.String(100))
+    video_url = db.Column(db.String(200))  # New column for video URL
+    video_status = db.Column(db.String(100))
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), index=True)
+    teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # set when the file was uploaded, see uploads.py
+    content_hash = db.Column(db.String(64), index=True)
+    poster = db.Column(db.String(200))
+    teacher = db.relationship('Teacher', back_populates='videos')
+    course = db.relationship('Courses', back_populates='videos')
+
+    def __repr__(self):
+        return f"<Video {self.name}>"
+
+
+class Paid_courses(db.Model):
+    # one row per (user, course) enrollment, the name/phone columns are
+    # copies kept for display only
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'course_id', name='uq_paid_courses_user_course'),
     )
-
-
-    class User(UserMixin, db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        phone = db.Column(db.String(100))
-        password = db.Column(db.String(100))
-        name = db.Column(db.String(1000))
-        role = db.Column(db.String(1000), default="user")
-        students = db.relationship('Students', secondary=user_student_association, back_populates='users')
-
-
-    class Students(UserMixin, db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        name = db.Column(db.String(1000))
-        parent_name = db.Column(db.String(1000))
-        parent_phone = db.Column(db.String(1000))
-        users = db.relationship('User', secondary=user_student_association, back_populates='students')
-
-
-    class Teacher(UserMixin, db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        name = db.Column(db.String(1000))
-        phone = db.Column(db.String(100), unique=True)
-        teacher_sample = db.Column(db.String(100))
-        status = db.Column(db.String(100))
-        videos = db.relationship('Videos', back_populates='teacher')
-
-
-        def __repr__(self):
-            return f"<Teacher {self.name}>"
-
-
-    class Courses(db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        course_name = db.Column(db.String(1000))
-        teacher_name = db.Column(db.String(100))
-        teacher_phone = db.Column(db.String(100))
-        course_price = db.Column(db.Integer)
-        rate = db.Column(db.String(100))
-        course_sample = db.Column(db.String(100))
-        status = db.Column(db.String(100))
-
-
-
-    class Videos(UserMixin, db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        name = db.Column(db.String(1000))
-        description = db.Column(db.String(100))
-        grade = db.Column(db.Integer)
-        teacher_name = db.Column(db.String(100))
-        teacher_phone = db.Column(db.String(100))
-        course_name = db.Column(db.String(100))
-        video_url = db.Column(db.String(200))  # New column for video URL
-        video_status = db.Column(db.String(100))
-        teacher_id = db.Column(db.Integer, db.ForeignKey('teacher.id'))
-        teacher = db.relationship('Teacher', back_populates='videos')
-
-        def __repr__(self):
-            return f"<Video {self.name}>"
-
-
-    class Paid_courses(db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        course_name = db.Column(db.String(1000))
-        teacher_name = db.Column(db.String(100))
-        teacher_phone = db.Column(db.String(100))
-        user_name = db.Column(db.String(100))
-        user_phone = db.Column(db.String(100))
-        user_id = db.Column(db.String(100))
-        course_id = db.Column(db.String(100))
-
-
-    class Question(db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        question_text = db.Column(db.String(255), nullable=False)
-        course_name = db.Column(db.String(255))
-        answers = db.relationship('Answer', backref='question', lazy=True)
-
-
-
-    class Answer(db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        answer_text = db.Column(db.String(255), nullable=False)
-        is_correct = db.Column(db.Boolean, default=False)
-        question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False)
-
-
-    class QuizResult(db.Model):
-        id = db.Column(db.Integer, primary_key=True)
-        user_id = db.Column(db.Integer, nullable=False)
-        name=db.Column(db.Integer, nullable=False)
-        course_name = db.Column(db.String(255), nullable=False)
-        parent_name=db.Column(db.String(255), nullable=False)
-        score = db.Column(db.Integer, nullable=False)
-
-    db.create_all()
-
+    id = db.Column(db.Integer, primary_key=True)
+    course_name = db.Column(db.String(1000))
+    teacher_name = db.Column(db.String(100))
+    teacher_phone = db.Column(db.String(100))
+    user_name = db.Column(db.String(100))
+    user_phone = db.Column(db.String(100))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), index=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    user = db.relationship('User')
+    course = db.relationship('Courses')
+
+
+class Question(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    question_text = db.Column(db.String(255), nullable=False)
+    course_name = db.Column(db.String(255), index=True)
+    answers = db.relationship('Answer', backref='question', lazy=True)
+
+
+
+class Answer(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    answer_text = db.Column(db.String(255), nullable=False)
+    is_correct = db.Column(db.Boolean, default=False)
+    question_id = db.Column(db.Integer, db.ForeignKey('question.id'), nullable=False, index=True)
+
+
+class Upload(db.Model):
+    # a resumable upload, the bytes received so far are in UPLOAD_FOLDER/<id>.part;
+    # status is uploading, processing, done or failed
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    filename = db.Column(db.String(255))
+    size = db.Column(db.BigInteger, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='uploading')
+    content_hash = db.Column(db.String(64))
+    path = db.Column(db.String(200))
+    poster = db.Column(db.String(200))
+    # the Videos / Teacher / Courses row the file belongs to, once its form is sent
+    target_id = db.Column(db.Integer)
+
+
+class QuizResult(db.Model):
+    __table_args__ = (
+        db.Index('uq_quiz_result_user_course', 'user_id', 'course_name', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    name=db.Column(db.String(1000), nullable=False)
+    course_name = db.Column(db.String(255), nullable=False, index=True)
+    parent_name=db.Column(db.String(255), nullable=False, index=True)
+    score = db.Column(db.Integer, nullable=False)
+
+
+# Summary tables for the dashboards, one row per course / teacher / quiz.
+# buy_course and record_quiz_results bump them in the same transaction as
+# the row they insert, `flask rebuild-stats` recomputes them from scratch.
+class CourseStats(db.Model):
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), primary_key=True)
+    enrollments = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+
+class TeacherStats(db.Model):
+    teacher_phone = db.Column(db.String(100), primary_key=True)
+    enrollments = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+
+class QuizStats(db.Model):
+    course_name = db.Column(db.String(255), primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    total_score = db.Column(db.Integer, nullable=False, default=0)
+
+    @property
+    def average_score(self):
+        return round(self.total_score / self.attempts, 2) if self.attempts else None
+
+
+
+def upgrade_database():
+    applied = migrations.upgrade(db.engine, db.metadata)
+    if applied:
+        current_app.logger.info('applied schema migrations %s', applied)
+
+
+# cached data is grouped in namespaces, a commit that wrote one of these
+# models drops everything cached under its namespace
+CACHE_NAMESPACES = {
+    Courses: 'catalog',   # public catalog pages
+    Teacher: 'catalog',
+    Question: 'quiz',     # compiled answer keys
+    Answer: 'quiz',
+}
+
+
+@event.listens_for(Session, 'after_flush')
+def track_cache_changes(session, flush_context):
+    changed = list(session.new) + list(session.dirty) + list(session.deleted)
+    namespaces = session.info.setdefault('changed_namespaces', set())
+    users = session.info.setdefault('changed_users', set())
+    for obj in changed:
+        if type(obj) in CACHE_NAMESPACES:
+            namespaces.add(CACHE_NAMESPACES[type(obj)])
+        if isinstance(obj, User):
+            users.add(obj.id)
+
+
+# models with a full-text index, see search.py
+SEARCH_INDEXES = {
+    Courses: 'course_search',
+    Videos: 'video_search',
+}
+
+for model, index in SEARCH_INDEXES.items():
+    # new databases get the index with create_all, existing ones from migration 7
+    event.listen(model.__table__, 'after_create', DDL(search.create_sql(index)).execute_if(dialect='sqlite'))
+
+
+@event.listens_for(Session, 'after_flush')
+def update_search_index(session, flush_context):
+    # runs on the flush's connection, so the index commits or rolls back with the rows
+    changed = {}
+    removed = {}
+    for obj in list(session.new) + list(session.dirty):
+        if type(obj) in SEARCH_INDEXES:
+            changed.setdefault(SEARCH_INDEXES[type(obj)], []).append(obj)
+    for obj in session.deleted:
+        if type(obj) in SEARCH_INDEXES:
+            removed.setdefault(SEARCH_INDEXES[type(obj)], []).append(obj.id)
+    if not changed and not removed:
+        return
+    conn = session.connection()
+    if not search.available(conn):
+        return
+    for index, objs in changed.items():
+        columns = search.INDEXES[index][1]
+        search.index_rows(conn, index, [(obj.id, *(getattr(obj, column) for column in columns)) for obj in objs])
+    for index, ids in removed.items():
+        search.remove(conn, index, ids)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_cache(session):
+    for namespace in session.info.pop('changed_namespaces', ()):
+        cache.invalidate(namespace)
+    for user_id in session.info.pop('changed_users', ()):
+        identities.delete('identity', str(user_id))
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_cache_changes(session):
+    session.info.pop('changed_namespaces', None)
+    session.info.pop('changed_users', None)
+
+
+class Identity(UserMixin):
+    # the parts of a User the views check on every request, small enough to
+    # cache and safe to keep after the database session is gone
+    def __init__(self, id, name, phone, role, student_ids, child_user_ids, teacher_id=None):
+        self.id = id
+        self.name = name
+        self.phone = phone
+        self.role = role
+        # the Teacher row of a teacher account, courses and videos point at it
+        self.teacher_id = teacher_id
+        # Students rows of a parent's children, or a student's own row
+        self.student_ids = student_ids
+        # the children's student accounts, QuizResult.user_id points at these
+        self.child_user_ids = child_user_ids
+
+
+def load_identity(user_id):
+    # memoized for the request in g, and across requests in the identities
+    # cache until the TTL runs out or the user row is written
+    if not user_id:
+        return None
+    memo = g.setdefault('identities', {})
+    if user_id not in memo:
+        def build():
+            user = db.session.get(User, user_id, options=[selectinload(User.students).selectinload(Students.users)])
+            if user is None:
+                return None
+            child_user_ids = {
+                account.id for student in user.students for account in student.users
+                if account.role == 'student' and account.id != user.id
+            }
+            teacher_id = None
+            if user.role == 'teacher':
+                teacher_id = db.session.query(Teacher.id).filter_by(phone=user.phone).scalar()
+            return Identity(user.id, user.name, user.phone, user.role,
+                            tuple(s.id for s in user.students), tuple(sorted(child_user_ids)), teacher_id)
+        memo[user_id] = identities.get_or_set('identity', str(user_id), build)
+    return memo[user_id]
+
+
+def current_identity():
+    return load_identity(session.get('user_id'))
+
+
+def current_role():
+    # the stored role wins over the one saved in the session at login, so an
+    # approved teacher doesn't have to log in again
+    identity = current_identity()
+    return identity.role if identity else session.get('user_role')
 
 
 class MyModelView(ModelView):
     def is_accessible(self):
         # Check if the user is logged in and has the 'admin' role
-        if 'user_role' in session and session['user_role'] == 'admin':
+        if current_role() == 'admin':
             return True
         return False
 
@@ -139,37 +414,88 @@ class MyModelView(ModelView):
 
 
 
-admin = Admin(app)
-admin.add_view(MyModelView(User, db.session))
-admin.add_view(MyModelView(Students, db.session))
-admin.add_view(MyModelView(Teacher, db.session))
-admin.add_view(MyModelView(Courses, db.session))
-admin.add_view(MyModelView(Videos, db.session))
-admin.add_view(MyModelView(Paid_courses, db.session))
-admin.add_view(MyModelView(Question, db.session))
-admin.add_view(MyModelView(Answer, db.session))
-admin.add_view(MyModelView(QuizResult, db.session))
+def init_admin(app):
+    admin = Admin(app)
+    for model in (User, Students, Teacher, Courses, Videos, Paid_courses, Question, Answer, QuizResult):
+        admin.add_view(MyModelView(model, db.session))
+    return admin
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return load_identity(int(user_id))
 
-@app.route("/")
+@bp.route("/")
 def index():
-    courses = Courses.query.all()
-    teachers = Teacher.query.all()
-    return render_template("index.html",courses=courses,teachers=teachers)
+    # the home page has no per-user content, cache the whole rendered page
+    if wants_json():
+        page = cache.get_or_set('catalog', f'courses:{cursor_args()}', lambda: keyset_page(Courses.query, Courses.id, course_dict))
+        return page_json(page, COURSE_FIELDS)
+
+    def render_index():
+        courses = keyset_page(Courses.query, Courses.id)
+        teachers = Teacher.query.order_by(Teacher.id).limit(courses.per_page).all()
+        return render_template("index.html",courses=courses,teachers=teachers)
+    return cache.get_or_set('catalog', f'index.html:{cursor_args()}', render_index)
+
+
+COURSE_FIELDS = ('id', 'course_name', 'teacher_name', 'course_price')
+
 
+def course_dict(course):
+    # plain dicts so the cached pages don't hold on to session-bound objects
+    return {field: getattr(course, field) for field in COURSE_FIELDS}
 
-@app.route("/about")
+
+def approved_courses():
+    return keyset_page(Courses.query.filter_by(status='approved'), Courses.id, course_dict)
+
+
+@bp.route("/search")
+def search_view():
+    # ranked full-text search over approved courses and their videos, the
+    # last word matches as a prefix so it works for typeahead
+    query = request.args.get('q', '').strip()
+    limit = page_size()
+    courses = []
+    videos = []
+    if query:
+        conn = db.session.connection()
+        ids = search.search(conn, 'course_search', query, limit)
+        found = {course.id: course for course in
+                 Courses.query.filter(Courses.id.in_(ids), Courses.status == 'approved')}
+        courses = [found[id] for id in ids if id in found]
+
+        ids = search.search(conn, 'video_search', query, limit)
+        found = {video.id: video for video in
+                 Videos.query.join(Courses, Videos.course_id == Courses.id)
+                 .filter(Videos.id.in_(ids), Courses.status == 'approved')}
+        videos = [found[id] for id in ids if id in found]
+
+    if wants_json():
+        return {
+            'courses': [course_dict(course) for course in courses],
+            'videos': [{'id': video.id, 'name': video.name, 'course_id': video.course_id,
+                        'course_name': video.course_name} for video in videos],
+        }
+    return render_template("search.html", query=query, courses=courses, videos=videos)
+
+
+@bp.route("/cache_stats")
+def cache_stats():
+    if current_role() != 'admin':
+        return ('YOU ARE NOT AN ADMIN')
+    return {**cache.stats, **identities.stats}
+
+
+@bp.route("/about")
 def about():
     return render_template("about.html")
 
-@app.route("/feature")
+@bp.route("/feature")
 def feature():
     return render_template("feature.html")
-# @app.route("/redirecting")
+# @bp.route("/redirecting")
 # def redirecting():
 #     user_name = session.get('user_name')
 #     students = Students.query.all()
@@ -183,79 +509,81 @@ def feature():
 
 
 
-@app.route("/register", methods=["POST","GET"])
+@bp.route("/register", methods=["POST","GET"])
 def register():
     if request.method == "POST":
         phone = request.form.get("phone")
         name = request.form.get("name")
         password = request.form.get("password")
+        if User.query.filter_by(phone=phone).first():
+            return redirect("/login")
         new_user = User(
             name=name,
             phone=phone,
-            password=password
+            password=generate_password_hash(password)
         )
         db.session.add(new_user)
         db.session.commit()
         return redirect("/login")
     return render_template("register.html")
 
-@app.route("/login", methods=["GET","POST"])
+# where each role lands after logging in
+ROLE_HOME = {
+    "user": "/profile",
+    "teacher": "/teacher_profile",
+    "student": "/child_pro",
+    "admin": "/admin_dashboard",
+}
+
+
+def is_password_hash(value):
+    # werkzeug hashes look like "method:params$salt$hash"
+    return bool(value) and value.startswith(("scrypt:", "pbkdf2:")) and value.count("$") == 2
+
+
+def authenticate(phone, password):
+    if not phone or not password:
+        return None
+    user = User.query.filter_by(phone=phone).first()
+    if not user or not user.password:
+        return None
+
+    if is_password_hash(user.password):
+        return user if check_password_hash(user.password, password) else None
+
+    # old accounts still have the plain password stored, upgrade them on their
+    # next login; compared in constant time like check_password_hash does
+    if hmac.compare_digest(user.password.encode(), password.encode()):
+        user.password = generate_password_hash(password)
+        db.session.commit()
+        return user
+    return None
+
+
+@bp.route("/login", methods=["GET","POST"])
 def login():
     if request.method == "POST":
         phone = request.form.get("your_phone")
         password = request.form.get("your_pass")
-        role_user = "user"
-        role_teacher = "teacher"
-        role_admin = "admin"
-        role_student='student'
-
-        users = User.query.all()
-        for user in users:
-            if phone == user.phone and password == user.password and role_user==user.role:
-                # Assuming 'id', 'name', and 'phone' are attributes of your User model
-                session['user_id'] = user.id
-                session['user_name'] = user.name
-                session['user_phone'] = user.phone
-                session['user_role'] = user.role
-                return redirect("/profile")
-
-            if phone == user.phone and password == user.password and role_teacher==user.role:
-                # Assuming 'id', 'name', and 'phone' are attributes of your User model
-                session['user_id'] = user.id
-                session['user_name'] = user.name
-                session['user_phone'] = user.phone
-                session['user_role'] = user.role
-                return redirect("/teacher_profile")
-
-            if phone == user.phone and password == user.password and role_student==user.role:
-                # Assuming 'id', 'name', and 'phone' are attributes of your User model
-                session['user_id'] = user.id
-                session['user_name'] = user.name
-                session['user_phone'] = user.phone
-                session['user_role'] = user.role
-                return redirect("/child_pro")
-
-            if phone == user.phone and password == user.password and role_admin==user.role:
-                # Assuming 'id', 'name', and 'phone' are attributes of your User model
+        user = authenticate(phone, password)
+        if user:
+            if user.role in ROLE_HOME:
                 session['user_id'] = user.id
                 session['user_name'] = user.name
                 session['user_phone'] = user.phone
                 session['user_role'] = user.role
-                return redirect("/admin_dashboard")
-
-            if phone == user.phone and password == user.password :
-                # Assuming 'id', 'name', and 'phone' are attributes of your User model
-                session['user_id'] = user.id
-                session['user_name'] = user.name
+                return redirect(ROLE_HOME[user.role])
 
-                return redirect("/redirecting")
+            session['user_id'] = user.id
+            session['user_name'] = user.name
+            return redirect("/redirecting")
 
         return redirect("/register")
     return render_template("login.html")
-@app.route("/child_pro")
+@bp.route("/child_pro")
 def child_pro():
     # Retrieve user information from the session
-    user_role = session.get('user_role')
+    user_role = current_role()
     user_id = session.get('user_id')
     user_name = session.get('user_name')
     user_phone = session.get('user_phone')
@@ -265,39 +593,41 @@ def child_pro():
     else:
         return ('YOU ARE NOT A REGULAR USER')
 
-@app.route("/profile")
+@bp.route("/profile")
 def profile():
     # Retrieve user information from the session
-    user_role = session.get('user_role')
+    user_role = current_role()
     user_id = session.get('user_id')
     user_name = session.get('user_name')
     user_phone = session.get('user_phone')
-    students = Students.query.all()
     my_children = []
-    for student in students:
-        if student.parent_name == user_name:
-            my_children.append(student)
+    identity = current_identity()
+    if identity and identity.student_ids:
+        my_children = Students.query.filter(Students.id.in_(identity.student_ids)).order_by(Students.id).all()
     if user_role == "user":
         # Use the user information in your template
         return render_template("profile.html", user_id=user_id, user_name=user_name, user_phone=user_phone, my_children=my_children)
     else:
         return ('YOU ARE NOT A REGULAR USER')
-@app.route("/teacher_profile")
+@bp.route("/teacher_profile")
 def teacher_profile():
     # Retrieve user information from the session
-    user_role = session.get('user_role')
+    user_role = current_role()
     user_name = session.get('user_name')
     user_phone = session.get('user_phone')
     user_id = session.get("user_id")
     if user_role == "teacher":
+        stats = teacher_stats(user_phone)
+        if wants_json():
+            return stats
         # Use the user information in your template
-        return render_template("teacher_profile.html", user_id=user_id, user_name=user_name, user_phone=user_phone)
+        return render_template("teacher_profile.html", user_id=user_id, user_name=user_name, user_phone=user_phone, stats=stats)
     else:
         return ('YOU ARE NOT A TEACHER')
 
-@app.route("/admin")
+@bp.route("/admin")
 def admin():
-    user_role = session.get('user_role')
+    user_role = current_role()
     user_name = session.get('user_name')
     user_phone = session.get('user_phone')
     user_id = session.get("user_id")
@@ -307,62 +637,55 @@ def admin():
          return ('YOU ARE NOT AN ADMIN')
 
 
-@app.route("/paid_courses")
+@bp.route("/paid_courses")
 def paid():
     # Retrieve user information from the session
     user_id = session.get('user_id')
     user_name = session.get('user_name')
     user_phone = session.get('user_phone')
-    paid_courses=Paid_courses.query.all()
-    my_courses=[]
-    for course in paid_courses:
-        if   user_name == course.user_name and user_phone==course.user_phone :
-            my_courses.append(course)
-            print (course)
+    my_courses = keyset_page(Paid_courses.query.filter_by(user_id=user_id), Paid_courses.id)
+    if wants_json():
+        return page_json(my_courses, ('id', 'course_id', 'course_name', 'teacher_name'))
 
     # Use the user information in your template
     return render_template("paid_courses.html", user_id=user_id, user_name=user_name, user_phone=user_phone,paid_courses=my_courses)
 
-@app.route("/course")
+@bp.route("/course")
 def course():
     # Retrieve user information from the session
     user_id = session.get('user_id')
     user_name = session.get('user_name')
     user_phone = session.get('user_phone')
 
-    all_courses=Courses.query.filter_by(status='approved')
+    all_courses = cache.get_or_set('catalog', f'approved_courses:{cursor_args()}', approved_courses)
+    if wants_json():
+        return page_json(all_courses, COURSE_FIELDS)
 
     # Pass user information and courses to the template
     return render_template("course.html", user_id=user_id, user_name=user_name, user_phone=user_phone, all_courses=all_courses)
 
-@app.route('/detail/<int:id>')
+@bp.route('/detail/<int:id>')
 def detail(id):
     course = Courses.query.filter_by(id=id).first()
-    course_id = course.id
-    course_name = course.course_name
+    if not course:
+        return render_template('error.html', message='Course not found.')
+
     user_id = session.get('user_id')
     user_name = session.get('user_name')
     user_phone = session.get('user_phone')
-    paid_courses = Paid_courses.query.all()
-    all_videos = Videos.query.all()
-    videos = []
+    videos = Page([])
 
-    if course:
-        course_name = course.course_name
-        teacher_name = course.teacher_name
-        teacher_phone = course.teacher_phone
-        price = course.course_price
-        for c in paid_courses:
-            if c.course_name == course_name and c.teacher_name==teacher_name and c.teacher_phone==teacher_phone and c.user_phone==user_phone:
-                for video in all_videos:
-                    if video.course_name == course_name and video.teacher_name == teacher_name:
-                            videos.append(video)
+    # only students who bought the course get to see its videos, a page at a
+    # time so a course with thousands of lessons costs the same as a small one
+    purchased = user_id and Paid_courses.query.filter_by(user_id=user_id, course_id=course.id).first()
+    if purchased:
+        videos = keyset_page(Videos.query.filter_by(course_id=course.id), Videos.id)
 
     return render_template("detail.html", videos=videos, current_name=course.course_name, user_id=user_id, user_name=user_name, user_phone=user_phone, course=course)
 
 
 
-@app.route('/video/<int:id>')
+@bp.route('/video/<int:id>')
 def video_detail(id):
     videos = Videos.query.filter_by(id=id)
     for video in videos:
@@ -370,7 +693,7 @@ def video_detail(id):
         description=video.description
         video_file=video.video_url
 
-    return render_template("video_detail.html", videos=video, name=name,description=description,video_file=video_file)
+    return render_template("video_detail.html", videos=video, name=name,description=description,video_file=video_file, poster=video.poster)
 
 
 class PurchaseForm(FlaskForm):
@@ -378,73 +701,77 @@ class PurchaseForm(FlaskForm):
     user_phone = StringField('Your Phone Number', validators=[DataRequired()])
     submit = SubmitField('Purchase')
 
-@app.route("/buy_course/<int:id>", methods=["GET", "POST"])
+@bp.route("/buy_course/<int:id>", methods=["GET", "POST"])
 def buy_course(id):
     form = PurchaseForm()
 
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect("/login")
+
     if request.method == "POST" and form.validate_on_submit():
         course = Courses.query.filter_by(id=id).first()
 
         if course:
-            user_id = session.get('user_id')
-            course_name = course.course_name
-            teacher_name = course.teacher_name
-            teacher_phone = course.teacher_phone
-            course_id = course.id
-
-            user_name = form.user_name.data
-            user_phone = form.user_phone.data
-
-            try:
-                existing_purchase = Paid_courses.query.filter_by(
-                    user_phone=user_phone,
-                    course_name=course_name,
-                    user_name=user_name,
-                    course_id=course_id
-                ).one()
-
+            if enroll(user_id, course, form.user_name.data, form.user_phone.data) is None:
                 return 'already purchased'
-
-            except NoResultFound:
-                buy = Paid_courses(
-                    course_name=course_name,
-                    teacher_name=teacher_name,
-                    teacher_phone=teacher_phone,
-                    course_id=id,
-                    user_id=user_id,
-                    user_name=user_name,
-                    user_phone=user_phone,
-                )
-                db.session.add(buy)
-                db.session.commit()
-
-                return render_template("payment_success.html")
+            return render_template("payment_success.html")
 
     return render_template("purchase_course.html", form=form)
+
+
+def enroll(user_id, course, user_name, user_phone):
+    # returns the new Paid_courses row, or None when the user already has the course
+    try:
+        Paid_courses.query.filter_by(user_id=user_id, course_id=course.id).one()
+        return None
+    except NoResultFound:
+        buy = Paid_courses(
+            course_name=course.course_name,
+            teacher_name=course.teacher_name,
+            teacher_phone=course.teacher_phone,
+            course_id=course.id,
+            user_id=user_id,
+            user_name=user_name,
+            user_phone=user_phone,
+        )
+        db.session.add(buy)
+        try:
+            # insert first, a double click or a second device that got past
+            # the check above stops here on uq_paid_courses_user_course
+            db.session.flush()
+            count_enrollment(course)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            if Paid_courses.query.filter_by(user_id=user_id, course_id=course.id).first():
+                return None
+            raise
+        return buy
 # Additional note: Make sure to handle errors and edge cases appropriately in your actual implementation.
 
 
 
 
-@app.route("/maketeacher", methods=["GET", "POST"])
+@bp.route("/maketeacher", methods=["GET", "POST"])
 def maketeacher():
     if request.method == "POST":
-        phone = session.get('user_phone')
-        all_users = User.query.filter_by(phone=phone).all()
+        user = current_identity()
         teacher_sample= request.form.get("teacher_sample")
-        for user in all_users:
-            if phone == user.phone:
-                new_teacher = Teacher(
-                    name=user.name,
-                    phone=user.phone,
-                    teacher_sample= teacher_sample,
-                    status='pending'
+        if user:
+            new_teacher = Teacher(
+                name=user.name,
+                phone=user.phone,
+                teacher_sample= teacher_sample,
+                status='pending'
 
-                )
-                db.session.add(new_teacher)
-                db.session.commit()
+            )
+            db.session.add(new_teacher)
+            db.session.commit()
+            if request.form.get("upload_id"):
+                attach_upload(request.form["upload_id"], 'teacher_sample', new_teacher.id)
 
-                return render_template("pending_accounts.html", user=user)
+            return render_template("pending_accounts.html", user=user)
 
         return 'User not found'
 
@@ -452,7 +779,7 @@ def maketeacher():
 
 
 
-@app.route("/approve_teacher_request/<int:request_id>")
+@bp.route("/approve_teacher_request/<int:request_id>")
 def approve_teacher_request(request_id):
     # Retrieve the specific teacher request
     teacher_request = Teacher.query.get(request_id)
@@ -471,7 +798,7 @@ def approve_teacher_request(request_id):
 
         return redirect("/admin_dashboard")
 
-@app.route("/view_teacher_sample/<int:request_id>")
+@bp.route("/view_teacher_sample/<int:request_id>")
 def view_teacher_sample(request_id):
     teacher = Teacher.query.filter_by(id=request_id).first()
 
@@ -479,16 +806,16 @@ def view_teacher_sample(request_id):
         name = teacher.name
         phone = teacher.phone
         video_file = teacher.teacher_sample
-        return render_template("view_teacher_sample.html", name=name, phone=phone, video_file=video_file)
+        return render_template("view_teacher_sample.html", name=name, phone=phone, video_file=video_file, poster=teacher.sample_poster)
     else:
         return "No teacher found with this ID."
 
 
-@app.route("/createcourse", methods=["GET", "POST"])
+@bp.route("/createcourse", methods=["GET", "POST"])
 def createcourse():
     # Check if the user is logged in and has the role 'teacher'
     user_id = session.get('user_id')
-    user_role = session.get('user_role')
+    user_role = current_role()
 
     # Assuming 'teacher' is the role for teachers
     if user_id and user_role == 'teacher':
@@ -502,12 +829,15 @@ def createcourse():
                 course_name=course_name,
                 teacher_name=teacher_name,
                 teacher_phone=teacher_phone,
+                teacher_id=current_identity().teacher_id,
                 course_price=course_price,
                 course_sample=course_sample,
                 status='pending'
             )
             db.session.add(new_course)
             db.session.commit()
+            if request.form.get("upload_id"):
+                attach_upload(request.form["upload_id"], 'course_sample', new_course.id)
             return redirect("teacher_profile")
         return render_template("create_course.html")
 
@@ -515,7 +845,7 @@ def createcourse():
     return "Unauthorized access"
 
 
-@app.route("/approve_course_request/<int:course_id>")
+@bp.route("/approve_course_request/<int:course_id>")
 def approve_course_request(course_id):
     # Retrieve the specific course request
     course_request = Courses.query.get(course_id)
@@ -528,7 +858,7 @@ def approve_course_request(course_id):
     return redirect("/admin_dashboard")
 
 
-@app.route("/course_detail/<int:course_id>")
+@bp.route("/course_detail/<int:course_id>")
 def course_detail(course_id):
     # Use .first() to get the first result or None
     course = Courses.query.filter_by(id=course_id).first()
@@ -543,7 +873,7 @@ def course_detail(course_id):
         # Handle the case where the course with the given ID is not found
         return render_template("course_not_found.html")
 
-@app.route("/create_video/<int:course_id>", methods=["GET", "POST"])
+@bp.route("/create_video/<int:course_id>", methods=["GET", "POST"])
 def create_video(course_id):
     if request.method == "POST":
         course = Courses.query.get(course_id)
@@ -562,12 +892,16 @@ def create_video(course_id):
                 teacher_name=teacher_name,
                 teacher_phone=teacher_phone,
                 course_name=course_name,
+                course_id=course.id,
+                teacher_id=course.teacher_id,
                 video_url=video_url,
                 video_status=subscription_type
             )
 
             db.session.add(new_video)
             db.session.commit()
+            if request.form.get("upload_id"):
+                attach_upload(request.form["upload_id"], 'video', new_video.id)
             return redirect("/teacher_profile")
         else:
             return 'no'
@@ -575,21 +909,74 @@ def create_video(course_id):
     return render_template("create_video.html")
 
 
+# Uploaded files, see uploads.py. kind -> (model, column that gets the media
+# path, column for the content hash, column for the poster frame)
+UPLOAD_KINDS = {
+    'video': (Videos, 'video_url', 'content_hash', 'poster'),
+    'teacher_sample': (Teacher, 'teacher_sample', 'sample_hash', 'sample_poster'),
+    'course_sample': (Courses, 'course_sample', None, None),
+}
+
+
+def apply_upload(upload):
+    # copy a processed upload onto the row it belongs to, safe to repeat
+    if upload.status != 'done' or not upload.target_id:
+        return
+    model, path_column, hash_column, poster_column = UPLOAD_KINDS[upload.kind]
+    row = db.session.get(model, upload.target_id)
+    if row is None:
+        return
+    setattr(row, path_column, upload.path)
+    if hash_column:
+        setattr(row, hash_column, upload.content_hash)
+    if poster_column:
+        setattr(row, poster_column, upload.poster)
+    db.session.commit()
+
+
+def attach_upload(upload_id, kind, target_id):
+    # the form was sent, possibly before processing finished; whichever of
+    # this and record_upload commits last sees the other's write and applies it
+    identity = current_identity()
+    upload = db.session.get(Upload, upload_id)
+    if upload is None or identity is None or upload.user_id != identity.id or upload.kind != kind:
+        return
+    upload.target_id = target_id
+    db.session.commit()
+    apply_upload(upload)
+
+
+def record_upload(upload_id, result):
+    # called by uploads.py when the process pool is done with a file
+    upload = db.session.get(Upload, upload_id)
+    if upload is None:
+        return
+    if result is None:
+        upload.status = 'failed'
+    else:
+        upload.status = 'done'
+        upload.content_hash = result['content_hash']
+        upload.path = MEDIA_PREFIX + result['path']
+        upload.poster = MEDIA_PREFIX + result['poster'] if result['poster'] else None
+    db.session.commit()
+    apply_upload(upload)
+
+
 
-@app.route("/contact")
+@bp.route("/contact")
 def contact():
     return render_template("contact.html")
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
 
     session.clear()
     return 'Logged out successfully'
 
-@app.route("/add", methods=["GET","POST"])
+@bp.route("/add", methods=["GET","POST"])
 def add():
     user_id = session.get('user_id')
-    user_role = session.get('user_role')
+    user_role = current_role()
 
     # Assuming 'teacher' is the role for teachers
     if user_id and user_role == 'user':
@@ -599,11 +986,12 @@ def add():
             child_name = request.form.get("child_name")
             phone = request.form.get("phone")
             password = request.form.get("password")
-            parent = User.query.filter_by(phone=parent_phone).first()
-            parent_name = parent.name
+            if User.query.filter_by(phone=phone).first():
+                return "This phone number is already registered"
+            parent = db.session.get(User, user_id)
 
             new_student = Students(
-                parent_name=parent_name,
+                parent_name=parent.name,
                 parent_phone=parent_phone,
                 name=child_name
             )
@@ -613,10 +1001,13 @@ def add():
             new_user = User(
                 name=child_name,
                 phone=phone,
-                password=password,
+                password=generate_password_hash(password),
                 role='student'
             )
             db.session.add(new_user)
+            # link both accounts to the child, the parent's cached identity
+            # is dropped on commit since its students changed
+            new_student.users.extend([parent, new_user])
             db.session.commit()
             return redirect("/login")
         return render_template("add_child.html")
@@ -625,91 +1016,191 @@ def add():
 
 
 
-@app.route("/child_profile/<int:id>")
+@bp.route("/child_profile/<int:id>")
 def child_profile(id):
     child = Students.query.filter_by(id=id).first()
+    if not child:
+        return render_template('error.html', message='Student not found.')
 
-    # Assume you have some way of identifying the current user (parent or child)
-    current_user_phone = session.get('parent_name')  # Replace with your actual session key
-
-    if child.parent_name == current_user_phone:
+    identity = current_identity()
+    if identity and identity.role == 'student' and id in identity.student_ids:
         # This is the child's own profile
         return render_template("child_profile.html", user_name=child.name, is_child=True)
     else:
         # This is the parent viewing the child's profile
         return render_template("child_profile.html", user_name=child.name, is_child=False)
 
-@app.route("/admin_dashboard")
+@bp.route("/admin_dashboard")
 def admin_dashboard():
-    user_phone = session.get('user_phone')
-    user = User.query.filter_by(phone=user_phone).first()
+    user = current_identity()
 
     if user and user.role == 'admin':
         pending_requests = Teacher.query.filter_by(status='pending').all()
         pending_courses = Courses.query.filter_by(status='pending').all()
+        top_courses = (db.session.query(Courses, CourseStats)
+                       .join(CourseStats, CourseStats.course_id == Courses.id)
+                       .order_by(CourseStats.revenue.desc()).limit(10).all())
+        totals = db.session.query(func.coalesce(func.sum(TeacherStats.enrollments), 0),
+                                  func.coalesce(func.sum(TeacherStats.revenue), 0)).one()
     else:
         return ("Method not allowed")
 
-    return render_template("admin_dashboard.html", pending_requests=pending_requests, pending_courses=pending_courses)
+    if wants_json():
+        return {
+            'enrollments': totals[0],
+            'revenue': totals[1],
+            'top_courses': [dict(course_dict(course), enrollments=stats.enrollments, revenue=stats.revenue)
+                            for course, stats in top_courses],
+        }
+    return render_template("admin_dashboard.html", pending_requests=pending_requests, pending_courses=pending_courses,
+                           top_courses=top_courses, totals=totals)
+
+def questions_from_form(form):
+    items = []
+    num_questions = int(form.get('num_questions') or 0)
+    for i in range(1, num_questions + 1):
+        correct = (form.get(f'correct_answer_{i}') or '').strip()
+        items.append({
+            'course_name': form.get(f'course_name_{i}'),
+            'question': form.get(f'question_{i}'),
+            'answers': [form.get(f'answer_{i}_{j}') for j in range(1, 5)],
+            'correct': correct,
+        })
+    return items
+
+
+def questions_from_json(data):
+    # either a list of questions or {"course_name": ..., "questions": [...]}
+    # where the top level course name is used for questions without one
+    if isinstance(data, dict):
+        default_course = data.get('course_name')
+        data = data.get('questions', [])
+        for item in data:
+            if isinstance(item, dict):
+                item.setdefault('course_name', default_course)
+    if not isinstance(data, list):
+        raise ValueError('Expected a list of questions')
+    return data
+
+
+def questions_from_csv(text):
+    # header: course_name,question,answer_1,...,answer_n,correct
+    items = []
+    for row in csv.DictReader(io.StringIO(text)):
+        answer_columns = sorted((k for k in row if k and k.startswith('answer_')), key=lambda k: int(k[7:]))
+        items.append({
+            'course_name': row.get('course_name'),
+            'question': row.get('question'),
+            'answers': [row[k] for k in answer_columns],
+            'correct': row.get('correct'),
+        })
+    return items
+
+
+def validate_questions(items):
+    # check every question before anything is written, so a bad row can't
+    # leave half a quiz behind
+    questions = []
+    for number, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            raise ValueError(f'Question {number}: expected an object')
+        course_name = (item.get('course_name') or '').strip()
+        text = (item.get('question') or '').strip()
+        # correct counts every answer slot, blank ones (the form always has
+        # four) included, and is renumbered once the blanks are dropped
+        slots = ['' if a is None else str(a).strip() for a in item.get('answers') or []]
+        answers = [a for a in slots if a]
+        if not course_name:
+            raise ValueError(f'Question {number}: course name is missing')
+        if not text:
+            raise ValueError(f'Question {number}: question text is missing')
+        if len(answers) < 2:
+            raise ValueError(f'Question {number}: at least two answers are needed')
+        try:
+            correct = int(item.get('correct'))
+        except (TypeError, ValueError):
+            raise ValueError(f'Question {number}: correct answer must be the answer number')
+        if not 1 <= correct <= len(slots):
+            raise ValueError(f'Question {number}: correct answer {correct} is out of range')
+        if not slots[correct - 1]:
+            raise ValueError(f'Question {number}: correct answer {correct} is blank')
+        correct = sum(1 for a in slots[:correct] if a)
+        questions.append((course_name, text, answers, correct))
+    if not questions:
+        raise ValueError('No questions to add')
+    return questions
+
+
+def save_questions(questions):
+    # one transaction for the whole quiz: one batched INSERT for the questions
+    # (RETURNING gives back their ids in order) and one for all the answers
+    try:
+        question_ids = db.session.execute(
+            insert(Question).returning(Question.id, sort_by_parameter_order=True),
+            [{'course_name': course_name, 'question_text': text} for course_name, text, answers, correct in questions],
+        ).scalars().all()
+        db.session.execute(insert(Answer), [
+            {'question_id': question_id, 'answer_text': answer_text, 'is_correct': j == correct}
+            for question_id, (course_name, text, answers, correct) in zip(question_ids, questions)
+            for j, answer_text in enumerate(answers, start=1)
+        ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # bulk inserts skip the ORM flush events, drop the answer keys by hand
+    cache.invalidate('quiz')
+    return len(question_ids)
+
 
-@app.route('/add_question', methods=['GET', 'POST'])
+@bp.route('/add_question', methods=['GET', 'POST'])
 def add_question():
     # Check if the user has the role 'teacher'
-    if session.get('user_role') != 'teacher':
+    if current_role() != 'teacher':
         # Redirect to a different page or display an error message
         return render_template('error.html', message='Access denied. You must be a teacher.')
 
     if request.method == 'POST':
         try:
-            # Extract data from the form
-            num_questions = int(request.form.get('num_questions'))
-
-            for i in range(1, num_questions + 1):
-                course_name = request.form.get(f'course_name_{i}')
-                question_text = request.form.get(f'question_{i}')
-                answer_texts = [request.form.get(f'answer_{i}_{j}') for j in range(1, 5)]
-                correct_answer_index_str = request.form.get(f'correct_answer_{i}')
-                correct_answer_index = int(correct_answer_index_str) if correct_answer_index_str.strip() else None
-
-                # Create a new question
-                # Create a new question
-                question = Question(course_name=course_name, question_text=question_text)
-                db.session.add(question)
-                db.session.commit()
-
-                # Create answers for the question
-                for j, answer_text in enumerate(answer_texts):
-                    is_correct = (j + 1 == correct_answer_index)  # Adjusted to 1-based index
-                    answer = Answer(answer_text=answer_text, is_correct=is_correct, question=question)
-                    db.session.add(answer)
-
-                    # Save the correct answer for the question
-                    if is_correct:
-                        question.correct_answer = answer
-
-                db.session.commit()
-
-            return redirect(url_for('add_question'))
-
-        except Exception as e:
+            upload = request.files.get('quiz_file')
+            if request.is_json:
+                items = questions_from_json(request.get_json())
+            elif upload and upload.filename:
+                text = upload.read().decode('utf-8-sig')
+                if upload.filename.lower().endswith('.json'):
+                    items = questions_from_json(json.loads(text))
+                else:
+                    items = questions_from_csv(text)
+            else:
+                items = questions_from_form(request.form)
+
+            count = save_questions(validate_questions(items))
+
+            if request.is_json:
+                return {'added': count}
+            return redirect(url_for('main.add_question'))
+
+        except (ValueError, UnicodeDecodeError) as e:
             # Handle exceptions (e.g., validation errors)
+            if request.is_json:
+                return {'error': str(e)}, 400
             return render_template('error.html', message=str(e))
 
     return render_template('add_question.html')
 
 
-@app.route('/submit_quiz', methods=['POST'])
+@bp.route('/submit_quiz', methods=['POST'])
 def submit_quiz():
     # Redirect to the profile page or another page after submitting the entire quiz
-    return redirect(url_for('profile_page'))
+    return redirect(url_for('main.profile'))
 
 
 
 
 
-@app.route('/quiz/<course_name>', methods=['GET', 'POST'])
+@bp.route('/quiz/<course_name>', methods=['GET', 'POST'])
 def quiz(course_name):
-    if session.get('user_role') != 'student':
+    if current_role() != 'student':
         # Redirect to a different page or display an error message
         return render_template('error.html', message='Access denied. You must be a student.')
 
@@ -723,143 +1214,742 @@ def quiz(course_name):
         return render_template('error.html', message='You have already taken the quiz for this course.')
 
     if request.method == 'GET':
-        # Retrieve questions for the specified course
-        questions = Question.query.filter_by(course_name=course_name).all()
-
-        return render_template('quiz.html', course_name=course_name, questions=questions)
+        quiz = quiz_payload(course_name)
+        questions = quiz.questions
+        etag = quiz.etag
+        if current_app.config['QUIZ_SHUFFLE']:
+            questions = shuffled_quiz(questions, f'{user_id}:{course_name}')
+            etag = f'{etag}-{user_id}'
+
+        response = make_response(render_template('quiz.html', course_name=course_name, questions=questions))
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
 
     elif request.method == 'POST':
-        # Retrieve the student record based on the user_name
-        student = Students.query.filter_by(name=user_name).first()
-
-        if student:
-            parent_name = student.parent_name
-
-            # Assuming the form is submitted with answer choices
-            student_answers = request.form.to_dict()
-
-            # Evaluate the student's answers
-            score = evaluate_quiz(course_name, student_answers)
+        # Assuming the form is submitted with answer choices
+        submitted = submit_answers(user_id, user_name, course_name, request.form.to_dict())
+        if submitted is None:
+            return render_template('error.html', message='Student record not found.')
+        score, token = submitted
+        return render_template('quiz_result.html', score=score, token=token)
+
+
+def submit_answers(user_id, user_name, course_name, student_answers):
+    # returns (score, None) when graded right away, (None, token) when the
+    # background worker grades it, None when the student record is missing
+    student = student_record(user_id)
+    if not student:
+        return None
+    parent_name = student.parent_name
+
+    if current_app.config['QUIZ_QUEUE']:
+        # graded and saved by the background worker, the page polls quiz_status
+        token = quiz_queue.submit(user_id, course_name, {
+            'name': user_name,
+            'parent_name': parent_name,
+            'answers': student_answers,
+        })
+        return None, token
+
+    # Evaluate the student's answers
+    score = evaluate_quiz(course_name, student_answers)
+
+    # Save the quiz result to the database
+    record_quiz_results([{
+        'user_id': user_id,
+        'course_name': course_name,
+        'name': user_name,
+        'parent_name': parent_name,
+        'score': score,
+    }])
+    return score, None
+
+
+def add_to_stats(model, key, **amounts):
+    # INSERT ... ON CONFLICT DO UPDATE SET n = n + amount, so concurrent
+    # writers never lose an update and the first one creates the row;
+    # configure_database() only lets these two dialects through
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    statement = dialect.insert(model).values(**key, **amounts)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(key),
+        set_={name: getattr(model, name) + statement.excluded[name] for name in amounts},
+    )
+    db.session.execute(statement)
+
+
+def count_enrollment(course):
+    price = course.course_price or 0
+    add_to_stats(CourseStats, {'course_id': course.id}, enrollments=1, revenue=price)
+    # courses added through the admin may have no teacher
+    if course.teacher_phone is not None:
+        add_to_stats(TeacherStats, {'teacher_phone': course.teacher_phone}, enrollments=1, revenue=price)
+
+
+def count_quiz_results(rows):
+    totals = {}
+    for row in rows:
+        attempts, score = totals.get(row['course_name'], (0, 0))
+        totals[row['course_name']] = (attempts + 1, score + row['score'])
+    for course_name, (attempts, score) in totals.items():
+        add_to_stats(QuizStats, {'course_name': course_name}, attempts=attempts, total_score=score)
+
+
+def rebuild_stats():
+    # recomputes every summary table from Paid_courses and QuizResult, revenue
+    # is counted at today's course prices
+    db.session.execute(delete(CourseStats))
+    db.session.execute(delete(TeacherStats))
+    db.session.execute(delete(QuizStats))
+
+    enrollments = func.count(Paid_courses.id)
+    revenue = func.sum(func.coalesce(Courses.course_price, 0))
+    db.session.execute(insert(CourseStats).from_select(
+        ['course_id', 'enrollments', 'revenue'],
+        select(Courses.id, enrollments, revenue)
+        .join(Paid_courses, Paid_courses.course_id == Courses.id)
+        .group_by(Courses.id)))
+    db.session.execute(insert(TeacherStats).from_select(
+        ['teacher_phone', 'enrollments', 'revenue'],
+        select(Courses.teacher_phone, enrollments, revenue)
+        .join(Paid_courses, Paid_courses.course_id == Courses.id)
+        .filter(Courses.teacher_phone.is_not(None))
+        .group_by(Courses.teacher_phone)))
+    db.session.execute(insert(QuizStats).from_select(
+        ['course_name', 'attempts', 'total_score'],
+        select(QuizResult.course_name, func.count(QuizResult.id), func.sum(QuizResult.score))
+        .group_by(QuizResult.course_name)))
+    db.session.commit()
+
+
+# Teacher workspace: a page of a teacher's courses with their numbers in
+# one grouped query keyed on the Teacher row, and the videos of those courses
+# in one more through selectinload
+def latest_sale():
+    # the newest purchase of the course, read backwards through its course_id index
+    return (select(Paid_courses.created_at)
+            .where(Paid_courses.course_id == Courses.id)
+            .order_by(Paid_courses.id.desc())
+            .limit(1)
+            .scalar_subquery())
+
+
+def workspace_query(teacher_id):
+    # grouping by the primary key covers the courses columns; the stats rows
+    # are joined one per course, but the database doesn't know that, so
+    # their columns go through max() to keep PostgreSQL happy
+    return (db.session.query(
+                Courses,
+                Courses.id.label('id'),
+                func.count(Videos.id).label('videos'),
+                func.max(Videos.created_at).label('last_video'),
+                latest_sale().label('last_sale'),
+                func.max(CourseStats.enrollments).label('enrollments'),
+                func.max(CourseStats.revenue).label('revenue'),
+                func.max(QuizStats.attempts).label('attempts'),
+                func.max(QuizStats.total_score).label('total_score'))
+            .outerjoin(Videos, Videos.course_id == Courses.id)
+            .outerjoin(CourseStats, CourseStats.course_id == Courses.id)
+            .outerjoin(QuizStats, QuizStats.course_name == Courses.course_name)
+            .filter(Courses.teacher_id == teacher_id)
+            .group_by(Courses.id)
+            .options(selectinload(Courses.videos)))
+
+
+def teacher_workspace(teacher_id):
+    # (page of Courses, {course id: numbers})
+    page = keyset_page(workspace_query(teacher_id), Courses.id)
+    stats = {}
+    for row in page.items:
+        activity = [moment for moment in (row.last_video, row.last_sale) if moment]
+        stats[row.id] = {
+            'videos': row.videos,
+            'enrollments': row.enrollments or 0,
+            'revenue': row.revenue or 0,
+            'quiz_attempts': row.attempts or 0,
+            'average_score': round(row.total_score / row.attempts, 2) if row.attempts else None,
+            'latest_activity': max(activity).isoformat(timespec='seconds') if activity else None,
+        }
+    page.items = [row.Courses for row in page.items]
+    return page, stats
+
+
+def teacher_stats(teacher_phone):
+    stats = db.session.get(TeacherStats, teacher_phone)
+    return {
+        'enrollments': stats.enrollments if stats else 0,
+        'revenue': stats.revenue if stats else 0,
+    }
+
+
+def student_record(user_id):
+    # the Students row linked to a student account
+    identity = load_identity(user_id)
+    if not identity or not identity.student_ids:
+        return None
+    return db.session.get(Students, identity.student_ids[0])
+
+
+def record_quiz_results(submissions):
+    # grades spooled submissions (those without a score yet) and inserts all
+    # of them in one transaction, skipping any student/course pair that is
+    # already stored so a retried batch never records a result twice
+    rows = {}
+    for submission in submissions:
+        key = (submission['user_id'], submission['course_name'])
+        if key in rows:
+            continue
+        score = submission.get('score')
+        if score is None:
+            score = evaluate_quiz(submission['course_name'], submission['answers'])
+        rows[key] = {
+            'user_id': submission['user_id'],
+            'course_name': submission['course_name'],
+            'name': submission['name'],
+            'parent_name': submission['parent_name'],
+            'score': score,
+        }
+
+    existing = db.session.query(QuizResult.user_id, QuizResult.course_name).filter(
+        tuple_(QuizResult.user_id, QuizResult.course_name).in_(list(rows))).all()
+    for key in existing:
+        rows.pop(tuple(key), None)
+
+    if rows:
+        db.session.execute(insert(QuizResult), list(rows.values()))
+        count_quiz_results(rows.values())
+    db.session.commit()
+    if rows:
+        leaderboards.refresh()
+    return list(rows.values())
+
+
+def load_quiz_results(after_id):
+    # (id, course_name, user_id, name, score) of the results stored after
+    # after_id, read through the primary key in batches
+    return db.session.execute(
+        select(QuizResult.id, QuizResult.course_name, QuizResult.user_id, QuizResult.name, QuizResult.score)
+        .filter(QuizResult.id > after_id)
+        .order_by(QuizResult.id)
+        .execution_options(yield_per=5000)
+    ).tuples()
+
+
+def with_standing(result):
+    # a result with its rank among everyone who took the same quiz
+    rank, total, percentile = leaderboards.standing(result.course_name, result.score)
+    return {
+        'id': result.id,
+        'name': result.name,
+        'course_name': result.course_name,
+        'score': result.score,
+        'rank': rank,
+        'results': total,
+        'percentile': percentile,
+    }
+
+
+@bp.route('/quiz_status/<token>')
+def quiz_status(token):
+    submission = quiz_queue.read_token(token)
+    if not submission or submission[0] != session.get('user_id'):
+        return {'status': 'unknown'}, 404
+    if quiz_queue.is_pending(token):
+        return {'status': 'pending'}
+    if quiz_queue.is_dead(token):
+        return {'status': 'failed'}
+    user_id, course_name = submission
+    result = QuizResult.query.filter_by(user_id=user_id, course_name=course_name).first()
+    if not result:
+        return {'status': 'unknown'}, 404
+    standing = with_standing(result)
+    return {'status': 'done', 'score': result.score, 'rank': standing['rank'],
+            'results': standing['results'], 'percentile': standing['percentile']}
+
+
+@bp.route('/leaderboard/<course_name>')
+def leaderboard(course_name):
+    # the best results of a course, and the logged in student's own standing
+    limit = min(request.args.get('limit', 10, type=int), current_app.config['LEADERBOARD_SIZE'])
+    leaders = leaderboards.leaders(course_name, max(limit, 1))
+    mine = None
+    if current_role() == 'student':
+        result = QuizResult.query.filter_by(user_id=session.get('user_id'), course_name=course_name).first()
+        mine = with_standing(result) if result else None
+    if wants_json():
+        return {'course_name': course_name, 'leaders': leaders, 'you': mine}
+    return render_template('leaderboard.html', course_name=course_name, leaders=leaders, mine=mine)
+
+
+
+
+QuizQuestion = namedtuple('QuizQuestion', 'id question_text answers')
+QuizAnswer = namedtuple('QuizAnswer', 'id answer_text')
+Quiz = namedtuple('Quiz', 'questions etag')
+
+
+def quiz_payload(course_name):
+    # questions and answers in two queries (the answers come in through
+    # selectinload), kept as immutable tuples until a question or answer changes
+    def build():
+        rows = (Question.query
+                .filter_by(course_name=course_name)
+                .options(selectinload(Question.answers))
+                .order_by(Question.id)
+                .all())
+        questions = tuple(
+            QuizQuestion(q.id, q.question_text, tuple(
+                QuizAnswer(a.id, a.answer_text) for a in sorted(q.answers, key=lambda a: a.id)))
+            for q in rows
+        )
+        etag = hashlib.sha1(repr((course_name, questions)).encode()).hexdigest()[:20]
+        return Quiz(questions, etag)
+    return cache.get_or_set('quiz', f'payload:{course_name}', build)
 
-            # Save the quiz result to the database
-            mark = QuizResult(
-                course_name=course_name,
-                user_id=user_id,
-                name=user_name,
-                score=score,
-                parent_name=parent_name
-            )
-            db.session.add(mark)
-            db.session.commit()
 
-            return render_template('quiz_result.html', score=score)
+def shuffled_quiz(questions, seed):
+    # the same student always gets the same order back
+    rng = random.Random(seed)
+    questions = [q._replace(answers=tuple(rng.sample(q.answers, len(q.answers)))) for q in questions]
+    rng.shuffle(questions)
+    return questions
 
 
+def answer_key(course_name):
+    # form field -> id of the correct answer, built with a single query and
+    # kept until a question or answer is written again
+    def build():
+        rows = (db.session.query(Answer.question_id, Answer.id)
+                .join(Question, Answer.question_id == Question.id)
+                .filter(Question.course_name == course_name, Answer.is_correct.is_(True))
+                .all())
+        return {f'question_{question_id}': str(answer_id) for question_id, answer_id in rows}
+    return cache.get_or_set('quiz', f'answer_key:{course_name}', build)
 
 
 def evaluate_quiz(course_name, student_answers):
-    # Retrieve questions for the specified course
-    questions = Question.query.filter_by(course_name=course_name).all()
-
-    # Initialize the score
-    score = 0
-
-    for question in questions:
-        # Get the correct answer for the question
-        correct_answer = next((answer.answer_text for answer in question.answers if answer.is_correct), None)
+    # one point for every question whose chosen answer id is the correct one
+    key = answer_key(course_name)
+    return sum(1 for field, answer_id in key.items() if student_answers.get(field) == answer_id)
 
-        # Check if the student's answer matches the correct answer
-        student_answer = student_answers.get(f'question_{question.id}')
-        if student_answer and student_answer == correct_answer:
-            score += 1
 
-    return score
-
-
-@app.route("/children_score", methods=["POST", "GET"])
+@bp.route("/children_score", methods=["POST", "GET"])
 def children_score():
-    user_id = session.get('user_id')
-    user_name = session.get('user_name')
-
-    # Assuming Students model has a 'parent_name' property
-    student = Students.query.filter_by(parent_name=user_name).first()
-    parent_name = user_name
-
-    children_score = []
-
-    if parent_name:
-        # Assuming QuizResult model has 'parent_name', 'child_name', and 'score' properties
-        quiz_results = QuizResult.query.filter_by(parent_name=parent_name).all()
-
-        for result in quiz_results:
-            children_score.append({
-                'child_name': result.name,
-                'course_name':result.course_name,
-                'score': result.score
-            })
+    identity = current_identity()
+    child_user_ids = identity.child_user_ids if identity else ()
+
+    # results of the children's own accounts, found through the family links
+    children_score = keyset_page(QuizResult.query.filter(QuizResult.user_id.in_(child_user_ids)), QuizResult.id, lambda result: {
+        'child_name': result.name,
+        'course_name': result.course_name,
+        'score': result.score
+    })
+    if wants_json():
+        return page_json(children_score, ('child_name', 'course_name', 'score'))
 
     return render_template("children_result.html", children_score=children_score)
 
 
-@app.route("/result", methods=["POST", "GET"])
+@bp.route("/result", methods=["POST", "GET"])
 def result():
     user_id = session.get('user_id')
     user_name = session.get('user_name')
-    user_role = session.get('user_role')
+    user_role = current_role()
     if user_id and user_role == 'student':
-        result = QuizResult.query.all()
-        children_score = []
-        for mark in result:
-            if mark.name==user_name:
-                children_score.append(mark)
+        children_score = keyset_page(QuizResult.query.filter_by(user_id=user_id), QuizResult.id, with_standing)
+        if wants_json():
+            return page_json(children_score, ('id', 'course_name', 'score', 'rank', 'results', 'percentile'))
         return render_template("result.html", children_score=children_score)
     return "Only for children"
-@app.route("/my_courses")
+@bp.route("/my_courses")
 def my_courses():
-    user_name = session.get('user_name')
-    user_phone = session.get('user_phone')
-    user_id = session.get('user_id')
-    user_role = session.get('user_role')
-    courses = Courses.query.all()
-    my_courses = []
-    for course in courses:
-        if course.teacher_name == user_name and course.teacher_phone == user_phone:
-            my_courses.append(course)
-    return render_template("my_courses.html", user_id=user_id, user_name=user_name, user_phone=user_phone, my_courses=my_courses)
-
-@app.route('/my_course_detail/<int:id>')
+    identity = current_identity()
+    if not identity or not identity.teacher_id:
+        return render_template('error.html', message='Access denied. You must be a teacher.')
+    my_courses, stats = teacher_workspace(identity.teacher_id)
+    if wants_json():
+        data = page_json(my_courses, COURSE_FIELDS)
+        for item in data['items']:
+            item.update(stats[item['id']])
+        return data
+    return render_template("my_courses.html", user_id=identity.id, user_name=identity.name, user_phone=identity.phone, my_courses=my_courses, stats=stats)
+
+@bp.route('/my_course_detail/<int:id>')
 def my_course_detail(id):
-    course = Courses.query.filter_by(id=id).first()
-    course_id = course.id
-    course_name = course.course_name
-
-    user_id = session.get('user_id')
-    user_name = session.get('user_name')
-    user_phone = session.get('user_phone')
-    all_videos = Videos.query.all()
-    videos = []
-
-    if course:
-        course_name = course.course_name
-        teacher_name = course.teacher_name
-        teacher_phone = course.teacher_phone
-        price = course.course_price
-        for video in all_videos:
-            if video.course_name == course_name and video.teacher_name == teacher_name:
-                videos.append(video)
+    identity = current_identity()
+    if not identity or not identity.teacher_id:
+        return render_template('error.html', message='Access denied. You must be a teacher.')
+    course = db.session.get(Courses, id, options=[selectinload(Courses.videos)])
+    if not course or course.teacher_id != identity.teacher_id:
+        return render_template('error.html', message='Course not found.')
 
-    return render_template("my_course_detail.html", videos=videos, current_name=course.course_name, user_id=user_id, user_name=user_name, user_phone=user_phone, course=course)
+    if wants_json():
+        return {'course': api.pick(course, COURSE_FIELDS), 'videos': [api.pick(video, VIDEO_FIELDS) for video in course.videos]}
+    return render_template("my_course_detail.html", videos=course.videos, current_name=course.course_name, user_id=identity.id, user_name=identity.name, user_phone=identity.phone, course=course)
 
-@app.route("/my_students")
+@bp.route("/my_students")
 def my_students():
-    user_name = session.get('user_name')
-    user_phone = session.get('user_phone')
-    courses = Paid_courses.query.all()
-    my_students = []
-    for student in courses:
-        if student.teacher_name==user_name and student.teacher_phone==user_phone:
-            my_students.append(student)
+    identity = current_identity()
+    if not identity or not identity.teacher_id:
+        return render_template('error.html', message='Access denied. You must be a teacher.')
+    my_students = keyset_page(Paid_courses.query
+                              .join(Courses, Paid_courses.course_id == Courses.id)
+                              .filter(Courses.teacher_id == identity.teacher_id), Paid_courses.id)
+    if wants_json():
+        return page_json(my_students, ('id', 'user_name', 'course_id', 'course_name'))
     return render_template("my_students.html", my_students=my_students)
 
+# JSON API for the mobile app, see api.py. It uses the session cookie from
+# POST /api/v1/login and the same queries and caches as the pages.
+VIDEO_FIELDS = ('id', 'name', 'description', 'video_url')
+ENROLLMENT_FIELDS = ('id', 'course_id', 'course_name', 'teacher_name')
+RESULT_FIELDS = ('id', 'name', 'course_name', 'score', 'rank', 'results', 'percentile')
+
+
+def api_identity(role=None):
+    identity = current_identity()
+    if identity is None:
+        abort(401, 'log in first')
+    if role and identity.role != role:
+        abort(403, f'only for {role}s')
+    return identity
+
+
+@api_bp.route('/login', methods=['POST'])
+def api_login():
+    data = api.json_body()
+    phone, password = data.get('phone'), data.get('password')
+    if not isinstance(phone, str) or not isinstance(password, str):
+        abort(400, 'phone and password must be strings')
+    user = authenticate(phone, password)
+    if user is None:
+        abort(401, 'wrong phone or password')
+    session['user_id'] = user.id
+    session['user_name'] = user.name
+    session['user_phone'] = user.phone
+    session['user_role'] = user.role
+    return api.respond({'data': {'id': user.id, 'name': user.name, 'role': user.role}})
+
+
+@api_bp.route('/courses')
+def api_courses():
+    fields = api.selected_fields(COURSE_FIELDS)
+    page = cache.get_or_set('catalog', f'approved_courses:{cursor_args()}', approved_courses)
+    return api.respond(api.collection(page, fields))
+
+
+@api_bp.route('/courses/<int:id>')
+def api_course(id):
+    fields = api.selected_fields(COURSE_FIELDS + ('purchased', 'videos'))
+    course = Courses.query.filter_by(id=id, status='approved').first()
+    if not course:
+        abort(404, 'no such course')
+    user_id = session.get('user_id')
+    purchased = bool(user_id and Paid_courses.query.filter_by(user_id=user_id, course_id=course.id).first())
+    item = dict(course_dict(course), purchased=purchased, videos=[])
+    if purchased and 'videos' in fields:
+        videos = Videos.query.filter_by(course_id=course.id).order_by(Videos.id).all()
+        item['videos'] = [api.pick(video, VIDEO_FIELDS) for video in videos]
+    return api.respond({'data': api.pick(item, fields)})
+
+
+@api_bp.route('/enrollments')
+def api_enrollments():
+    user = api_identity()
+    fields = api.selected_fields(ENROLLMENT_FIELDS)
+    page = keyset_page(Paid_courses.query.filter_by(user_id=user.id), Paid_courses.id)
+    return api.respond(api.collection(page, fields))
+
+
+@api_bp.route('/enrollments', methods=['POST'])
+def api_enroll():
+    user = api_identity()
+    data = api.json_body()
+    course_id = data.get('course_id')
+    if not isinstance(course_id, int) or isinstance(course_id, bool):
+        abort(400, 'course_id must be a number')
+    course = Courses.query.filter_by(id=course_id, status='approved').first()
+    if not course:
+        abort(404, 'no such course')
+    enrollment = enroll(user.id, course, data.get('user_name') or user.name, data.get('user_phone') or user.phone)
+    if enrollment is None:
+        abort(409, 'already enrolled')
+    return api.respond({'data': api.pick(enrollment, ENROLLMENT_FIELDS)}, 201)
+
+
+@api_bp.route('/quizzes/<course_name>')
+def api_quiz(course_name):
+    user = api_identity('student')
+    if QuizResult.query.filter_by(course_name=course_name, user_id=user.id).first():
+        abort(409, 'quiz already taken')
+    quiz = quiz_payload(course_name)
+    questions = quiz.questions
+    etag = quiz.etag
+    if current_app.config['QUIZ_SHUFFLE']:
+        questions = shuffled_quiz(questions, f'{user.id}:{course_name}')
+        etag = f'{etag}-{user.id}'
+    data = [{'id': question.id, 'question_text': question.question_text,
+             'answers': [answer._asdict() for answer in question.answers]} for question in questions]
+    return api.respond({'data': data}, etag=etag)
+
+
+@api_bp.route('/quizzes/<course_name>', methods=['POST'])
+def api_submit_quiz(course_name):
+    # body: {"answers": {"<question id>": <answer id>, ...}}
+    user = api_identity('student')
+    if QuizResult.query.filter_by(course_name=course_name, user_id=user.id).first():
+        abort(409, 'quiz already taken')
+    answers = api.json_body().get('answers') or {}
+    if not isinstance(answers, dict):
+        abort(400, 'answers must map question ids to answer ids')
+    form = {f'question_{question}': str(answer) for question, answer in answers.items()}
+    submitted = submit_answers(user.id, user.name, course_name, form)
+    if submitted is None:
+        abort(404, 'student record not found')
+    score, token = submitted
+    if token:
+        return api.respond({'status': 'pending', 'status_url': url_for('main.quiz_status', token=token)}, 202)
+    return api.respond({'status': 'done', 'score': score}, 201)
+
+
+@api_bp.route('/results')
+def api_results():
+    # students get their own results, parents the results of their children
+    user = api_identity()
+    fields = api.selected_fields(RESULT_FIELDS)
+    if user.role == 'student':
+        query = QuizResult.query.filter_by(user_id=user.id)
+    else:
+        query = QuizResult.query.filter(QuizResult.user_id.in_(user.child_user_ids))
+    page = keyset_page(query, QuizResult.id, with_standing)
+    return api.respond(api.collection(page, fields))
+
+
+@api_bp.route('/leaderboards/<course_name>')
+def api_leaderboard(course_name):
+    api_identity()
+    limit = min(request.args.get('limit', 10, type=int), current_app.config['LEADERBOARD_SIZE'])
+    return api.respond({'data': leaderboards.leaders(course_name, max(limit, 1))})
+
+
+def user_upload(user, upload_id):
+    upload = db.session.get(Upload, upload_id)
+    if upload is None or upload.user_id != user.id:
+        abort(404, 'upload not found')
+    return upload
+
+
+def upload_json(upload):
+    offset = uploads.offset(upload.id) if upload.status == 'uploading' else upload.size
+    return {
+        'id': upload.id,
+        'kind': upload.kind,
+        'filename': upload.filename,
+        'size': upload.size,
+        'offset': offset,
+        'chunk_size': uploads.chunk_size,
+        'status': upload.status,
+        'path': upload.path,
+        'poster': upload.poster,
+    }
+
+
+def upload_response(upload, status=200):
+    data = upload_json(upload)
+    response = api.respond(data, status)
+    response.headers['Upload-Offset'] = str(data['offset'] or 0)
+    return response
+
+
+@api_bp.route('/uploads', methods=['POST'])
+def api_start_upload():
+    # body: {"filename": "lesson.mp4", "size": <bytes>, "kind": "video"}
+    user = api_identity()
+    data = api.json_body()
+    kind = data.get('kind')
+    if not isinstance(kind, str) or kind not in UPLOAD_KINDS:
+        abort(400, f'kind must be one of {", ".join(UPLOAD_KINDS)}')
+    if kind != 'teacher_sample' and user.role != 'teacher':
+        abort(403, 'only for teachers')
+    if not isinstance(data.get('filename'), str):
+        abort(400, 'filename must be a string')
+    filename = os.path.basename(data['filename'])[:255]
+    uploads.check(filename, data.get('size'))
+    upload = Upload(id=new_upload_id(), user_id=user.id, kind=kind, filename=filename, size=data['size'])
+    db.session.add(upload)
+    db.session.commit()
+    uploads.start(upload.id)
+    return upload_response(upload, 201)
+
+
+@api_bp.route('/uploads/<upload_id>', methods=['GET', 'HEAD'])
+def api_upload(upload_id):
+    # where to carry on after a broken connection, and the result once processed
+    return upload_response(user_upload(api_identity(), upload_id))
+
+
+@api_bp.route('/uploads/<upload_id>', methods=['PATCH'])
+def api_upload_piece(upload_id):
+    upload = user_upload(api_identity(), upload_id)
+    if upload.status != 'uploading':
+        abort(409, 'upload already complete')
+    offset = request.headers.get('Upload-Offset', type=int)
+    if offset is None:
+        abort(400, 'send Upload-Offset')
+    # nothing has to stay open while the piece streams in
+    upload_id, size, extension = upload.id, upload.size, os.path.splitext(upload.filename)[1].lower()
+    db.session.rollback()
+    received = uploads.write(upload_id, size, offset, request.stream, request.content_length,
+                             request.headers.get('Upload-Checksum'))
+    upload = db.session.get(Upload, upload_id)
+    if received == size:
+        upload.status = 'processing'
+        db.session.commit()
+        uploads.process(upload_id, extension)
+    return upload_response(upload)
+
+
+def query_plans():
+    # the lookups the views run, every one of them has to be served by an index
+    return {
+        'login': select(User).filter_by(phone='0'),
+        'index courses': select(Courses).filter_by(status='approved').order_by(Courses.id),
+        'pending teachers': select(Teacher).filter_by(status='pending'),
+        'paid courses': select(Paid_courses).filter_by(user_id=1).order_by(Paid_courses.id),
+        'purchase check': select(Paid_courses).filter_by(user_id=1, course_id=1),
+        'course videos': select(Videos).filter_by(course_id=1).order_by(Videos.id),
+        'my courses': select(Courses).filter_by(teacher_id=1).order_by(Courses.id),
+        'my students': (select(Paid_courses)
+                        .join(Courses, Paid_courses.course_id == Courses.id)
+                        .filter(Courses.teacher_id == 1)),
+        'teacher videos': select(Videos).filter_by(teacher_id=1),
+        'quiz questions': select(Question).filter_by(course_name='x'),
+        'quiz answers': select(Answer).filter_by(question_id=1),
+        'answer key': (select(Answer.question_id, Answer.id)
+                       .join(Question, Answer.question_id == Question.id)
+                       .filter(Question.course_name == 'x', Answer.is_correct.is_(True))),
+        'quiz taken': select(QuizResult).filter_by(course_name='x', user_id=1),
+        'student results': select(QuizResult).filter_by(user_id=1).order_by(QuizResult.id),
+        'children scores': select(QuizResult).filter(QuizResult.user_id.in_([1, 2])).order_by(QuizResult.id),
+        'new results': select(QuizResult).filter(QuizResult.id > 1).order_by(QuizResult.id),
+        'family links': select(user_student_association).filter_by(user_id=1),
+        'student by name': select(Students).filter_by(name='x'),
+        'children': select(Students).filter(Students.id.in_([1, 2])),
+        'course stats': select(CourseStats).filter(CourseStats.course_id.in_([1, 2])),
+        'top courses': select(CourseStats).order_by(CourseStats.revenue.desc()).limit(10),
+    }
+
+
+def full_scans():
+    # EXPLAIN QUERY PLAN prints "SCAN <table>" for a full table scan and
+    # "SEARCH ... USING INDEX" / "SCAN ... USING COVERING INDEX" otherwise
+    scans = {}
+    for name, statement in query_plans().items():
+        sql = str(statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql)).all()
+        details = [row[-1] for row in plan]
+        bad = [d for d in details if d.startswith('SCAN') and 'USING' not in d]
+        if bad:
+            scans[name] = bad
+    return scans
+
+
+@bp.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+    try:
+        applied = migrations.upgrade(db.engine, db.metadata)
+    except migrations.MigrationError as e:
+        print(f'upgrade failed: {e}')
+        raise SystemExit(1)
+    print(f'applied {applied}' if applied else 'database is up to date')
+
+
+@bp.cli.command('rebuild-stats')
+def rebuild_stats_command():
+    """Recompute the course, teacher and quiz summary tables."""
+    rebuild_stats()
+    print(f'{CourseStats.query.count()} courses, {TeacherStats.query.count()} teachers, '
+          f'{QuizStats.query.count()} quizzes')
+
+
+@bp.cli.command('rebuild-search')
+def rebuild_search_command():
+    """Rebuild the full-text indexes of courses and videos."""
+    conn = db.session.connection()
+    if not search.available(conn):
+        print('full-text search needs SQLite, other databases search with LIKE')
+        return
+    for index in search.INDEXES:
+        search.rebuild(conn, index)
+    db.session.commit()
+    print(f'rebuilt {", ".join(search.INDEXES)}')
+
+
+@bp.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint, minify and compress static/ into static/dist."""
+    manifest = build_assets(current_app.static_folder, assets.dist)
+    assets.load()
+    print(f'built {len(manifest["files"])} files and {len(manifest["variants"])} image sets into {assets.dist}')
+
+
+@bp.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if any view query falls back to a full table scan."""
+    scans = full_scans()
+    for name, details in scans.items():
+        print(f'{name}: {"; ".join(details)}')
+    if scans:
+        raise SystemExit(1)
+    print('every view query uses an index')
+
+
+# only ever used by the debug server and the tests
+DEV_SECRET_KEY = 'dev'
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.from_mapping(DEFAULT_CONFIG)
+    app.config.from_prefixed_env()
+    if config:
+        app.config.from_mapping(config)
+    if not app.config['SECRET_KEY']:
+        # anyone who knows the key can forge a session with any role
+        if not (app.debug or app.testing):
+            raise ValueError('SECRET_KEY is not set, export FLASK_SECRET_KEY with a long random value')
+        app.config['SECRET_KEY'] = DEV_SECRET_KEY
+
+    configure_templates(app, cache)
+    configure_database(app)
+    db.init_app(app)
+    with app.app_context():
+        tune_sqlite(db.engine, app.config)
+    login_manager.init_app(app)
+    cache.init_app(app)
+    identities.init_app(app)
+    metrics.init_app(app)
+    quiz_queue.init_app(app, record_quiz_results)
+    leaderboards.init_app(app, load_quiz_results)
+    assets.init_app(app)
+    media.init_app(app)
+    uploads.init_app(app, media.folder, record_upload)
+    init_admin(app)
+    app.register_blueprint(bp)
+    app.register_blueprint(api_bp)
+
+    if app.config['UPGRADE_DB_ON_START']:
+        with app.app_context():
+            upgrade_database()
+    if app.config['QUIZ_QUEUE'] and app.config['START_BACKGROUND_WORKERS']:
+        quiz_queue.start()
+    if app.config['START_BACKGROUND_WORKERS']:
+        leaderboards.start()
+    return app
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    create_app({'DEBUG': True}).run(debug=True)
\ No newline at end of file
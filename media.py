@@ -0,0 +1,162 @@
+# Serving locally stored lesson videos and samples.
+#
+# A Videos.video_url, Teacher.teacher_sample or Courses.course_sample of the
+# form media/<path> names a file under MEDIA_FOLDER (instance/media by
+# default); anything else is still taken to be a YouTube id. Templates embed
+# either with media_player(value).
+#
+# /media/<path> answers Range requests with 206 so players can seek, sends a
+# strong ETag and Last-Modified and answers If-None-Match / If-Modified-Since
+# with 304 and If-Range with the full file when it changed. A range that runs
+# to the end of the file (every seek, "bytes=N-") goes out through the
+# server's wsgi.file_wrapper, which gunicorn turns into sendfile(); a range
+# with an end is read out of a memory map. Every worker serves at most
+# MEDIA_MAX_STREAMS bodies at once and answers 503 with Retry-After above
+# that, so a burst of slow video clients can't take every thread.
+import mimetypes
+import mmap
+import os
+import threading
+from datetime import datetime, timezone
+
+from flask import current_app, request, url_for
+from markupsafe import Markup, escape
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import NotFound, RequestedRangeNotSatisfiable, ServiceUnavailable
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+PREFIX = 'media/'
+CHUNK = 256 * 1024
+
+
+class Stream:
+    # the open file of one response, closing it frees its stream slot
+    def __init__(self, path, release):
+        self.file = open(path, 'rb')
+        self.release = release
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            self.release()
+
+
+class MappedRange:
+    # start..stop of a file in CHUNK sized pieces sliced out of a memory map
+    def __init__(self, stream, start, stop):
+        self.stream = stream
+        self.chunks = self.read(start, stop)
+
+    def read(self, start, stop):
+        with mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset in range(start, stop, CHUNK):
+                yield data[offset:min(offset + CHUNK, stop)]
+
+    def __iter__(self):
+        return self.chunks
+
+    def close(self):
+        self.chunks.close()
+        self.stream.close()
+
+
+def range_allowed(if_range, etag, last_modified):
+    # If-Range: only send part of the file when it is still the version the
+    # client has the rest of
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return if_range.date == last_modified
+    return True
+
+
+class Media:
+    def __init__(self):
+        self.folder = None
+        self.max_age = 3600
+        self.streams = None
+
+    def init_app(self, app):
+        self.folder = app.config.get('MEDIA_FOLDER') or os.path.join(app.instance_path, 'media')
+        self.max_age = app.config.get('MEDIA_MAX_AGE', 3600)
+        self.streams = threading.BoundedSemaphore(app.config.get('MEDIA_MAX_STREAMS', 32))
+        app.add_url_rule('/media/<path:filename>', 'media', self.send_media)
+        app.jinja_env.globals['media_player'] = self.player
+        app.extensions['media'] = self
+
+    def is_local(self, value):
+        return bool(value) and value.startswith(PREFIX)
+
+    def url(self, value):
+        return url_for('media', filename=value[len(PREFIX):])
+
+    def player(self, value, poster=None):
+        if self.is_local(value):
+            poster = f' poster="{escape(self.url(poster))}"' if self.is_local(poster) else ''
+            return Markup(f'<video class="embed-responsive-item" controls preload="metadata"{poster} '
+                          f'src="{escape(self.url(value))}"></video>')
+        return Markup(f'<iframe class="embed-responsive-item" width="560" height="315" '
+                      f'src="https://www.youtube.com/embed/{escape(value or "")}" frameborder="0" allowfullscreen></iframe>')
+
+    def send_media(self, filename):
+        path = safe_join(self.folder, filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        stat = os.stat(path)
+        size = stat.st_size
+        last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+        # changes whenever the file is replaced or rewritten
+        etag = f'{stat.st_ino:x}-{stat.st_mtime_ns:x}-{size:x}'
+
+        response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.accept_ranges = 'bytes'
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+            response.status_code = 304
+            return response
+
+        start, stop = 0, size
+        ranges = request.range
+        if ranges and ranges.units == 'bytes' and len(ranges.ranges) == 1 \
+                and range_allowed(request.if_range, etag, last_modified):
+            found = ranges.range_for_length(size)
+            if found is None:
+                raise RequestedRangeNotSatisfiable(length=size)
+            start, stop = found
+            response.status_code = 206
+            response.content_range = ContentRange('bytes', start, stop, size)
+        response.content_length = stop - start
+        if request.method == 'HEAD' or start == stop:
+            return response
+
+        if not self.streams.acquire(blocking=False):
+            raise ServiceUnavailable('too many media streams, try again', retry_after=1)
+        try:
+            stream = Stream(path, self.streams.release)
+        except OSError:
+            self.streams.release()
+            raise NotFound()
+        if stop == size:
+            stream.seek(start)
+            response.response = wrap_file(request.environ, stream, CHUNK)
+        else:
+            response.response = MappedRange(stream, start, stop)
+        response.direct_passthrough = True
+        return response
@@ -0,0 +1,135 @@
+# Request instrumentation: per-route latency histograms, SQL statement count
+# and SQL time per request (from SQLAlchemy engine events), and a warning
+# in the log with the statements of any request slower than
+# SLOW_REQUEST_SECONDS. Everything is served as Prometheus text on /metrics.
+#
+# The numbers are per process, with several workers let Prometheus scrape
+# each one or sum them up on its side.
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# how many statements of one request are kept for the slow request log
+MAX_LOGGED_STATEMENTS = 50
+
+
+class Route:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.seconds = 0.0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.statuses = {}
+
+
+class Metrics:
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+        self.slow_seconds = 0.5
+
+    def init_app(self, app):
+        self.slow_seconds = app.config.get('SLOW_REQUEST_SECONDS', 0.5)
+        app.before_request(self.start_request)
+        app.after_request(self.record_status)
+        app.teardown_request(self.finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        app.extensions['metrics'] = self
+
+    def start_request(self):
+        g.request_started = time.perf_counter()
+        g.sql_statements = 0
+        g.sql_seconds = 0.0
+        g.sql_log = []
+
+    def record_status(self, response):
+        g.response_status = response.status_code
+        return response
+
+    def finish_request(self, exc=None):
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unknown'
+        key = (endpoint, request.method)
+        status = g.get('response_status', 500)
+
+        with self.lock:
+            route = self.routes.get(key)
+            if route is None:
+                route = self.routes[key] = Route()
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    route.buckets[i] += 1
+            route.count += 1
+            route.seconds += elapsed
+            route.sql_statements += g.sql_statements
+            route.sql_seconds += g.sql_seconds
+            route.statuses[status] = route.statuses.get(status, 0) + 1
+
+        if elapsed >= self.slow_seconds:
+            lines = [f'  {seconds * 1000:.1f} ms  {statement}' for statement, seconds in g.sql_log]
+            current_app.logger.warning(
+                'slow request %s %s: %.0f ms, %d SQL statements (%.0f ms)\n%s',
+                request.method, request.path, elapsed * 1000, g.sql_statements, g.sql_seconds * 1000,
+                '\n'.join(lines),
+            )
+
+    def metrics_view(self):
+        lines = [
+            '# HELP argon_request_seconds Request latency by route.',
+            '# TYPE argon_request_seconds histogram',
+        ]
+        with self.lock:
+            routes = sorted(self.routes.items())
+            for (endpoint, method), route in routes:
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                for bound, count in zip(BUCKETS, route.buckets):
+                    lines.append(f'argon_request_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'argon_request_seconds_bucket{{{labels},le="+Inf"}} {route.count}')
+                lines.append(f'argon_request_seconds_sum{{{labels}}} {route.seconds:.6f}')
+                lines.append(f'argon_request_seconds_count{{{labels}}} {route.count}')
+
+            lines.append('# HELP argon_requests_total Requests by route and status code.')
+            lines.append('# TYPE argon_requests_total counter')
+            for (endpoint, method), route in routes:
+                for status, count in sorted(route.statuses.items()):
+                    lines.append(f'argon_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+
+            lines.append('# HELP argon_sql_statements_total SQL statements run while serving a route.')
+            lines.append('# TYPE argon_sql_statements_total counter')
+            for (endpoint, method), route in routes:
+                lines.append(f'argon_sql_statements_total{{endpoint="{endpoint}",method="{method}"}} {route.sql_statements}')
+
+            lines.append('# HELP argon_sql_seconds_total Time spent in SQL while serving a route.')
+            lines.append('# TYPE argon_sql_seconds_total counter')
+            for (endpoint, method), route in routes:
+                lines.append(f'argon_sql_seconds_total{{endpoint="{endpoint}",method="{method}"}} {route.sql_seconds:.6f}')
+
+        return '\n'.join(lines) + '\n', 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('statement_started')
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    if not has_request_context() or 'sql_statements' not in g:
+        return
+    g.sql_statements += 1
+    g.sql_seconds += seconds
+    if len(g.sql_log) < MAX_LOGGED_STATEMENTS:
+        g.sql_log.append((statement, seconds))
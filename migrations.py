@@ -0,0 +1,301 @@
+# Versioned schema migrations.
+#
+# A new database is created straight from the models and stamped with the
+# latest version. An existing one gets any missing tables from the models and
+# then every migration newer than the version stored in schema_version, each
+# in its own transaction. To change an existing table add a function below
+# with the next version number; never edit one that has already shipped.
+#
+# The SQL has to run on SQLite and PostgreSQL alike: quote "user", use
+# ON CONFLICT DO NOTHING rather than INSERT OR IGNORE (the SELECT in front of
+# it needs a WHERE so SQLite can parse it), take column types from the
+# models, and check conn.dialect.name around anything that only one of them
+# has.
+from sqlalchemy import inspect, text
+
+MIGRATIONS = []
+
+
+class MigrationError(Exception):
+    # the data has to be fixed by hand before the migration can run
+    pass
+
+
+def migration(version):
+    def register(func):
+        MIGRATIONS.append((version, func))
+        return func
+    return register
+
+
+def column_names(conn, table):
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+
+def add_column(conn, table, name, ddl):
+    if name not in column_names(conn, table):
+        conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+
+
+def column_type(conn, metadata, table, name):
+    # the type of a model column as this database spells it
+    return metadata.tables[table].c[name].type.compile(dialect=conn.dialect)
+
+
+def create_index(conn, name, table, columns, unique=False):
+    unique = 'UNIQUE ' if unique else ''
+    conn.execute(text(f'CREATE {unique}INDEX IF NOT EXISTS {name} ON "{table}" ({columns})'))
+
+
+def reset_id_sequence(conn, table):
+    # rows copied with their ids leave a PostgreSQL serial behind
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                          f"COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false)"))
+
+
+@migration(1)
+def user_phone_index(conn, metadata):
+    # nothing used to stop two accounts from sharing a phone, and login can't
+    # tell them apart; they are not merged automatically since either may own
+    # purchases, children or results
+    duplicates = conn.execute(text(
+        'SELECT phone, id, name FROM "user" WHERE phone IN '
+        '(SELECT phone FROM "user" GROUP BY phone HAVING COUNT(*) > 1) ORDER BY phone, id'
+    )).all()
+    if duplicates:
+        users = {}
+        for phone, id, name in duplicates:
+            users.setdefault(phone, []).append(f'{id} ({name})')
+        report = '; '.join(f'phone {phone!r}: users {", ".join(ids)}' for phone, ids in users.items())
+        raise MigrationError(f'several users share a phone number, give each a unique phone or '
+                             f'delete the extra accounts before upgrading: {report}')
+    create_index(conn, 'ix_user_phone', 'user', 'phone', unique=True)
+
+
+@migration(2)
+def paid_courses_foreign_keys(conn, metadata):
+    # paid_courses used to store user_id/course_id as strings, rebuild the
+    # table with integer foreign keys and fill in ids that were never saved
+    columns = {column['name']: str(column['type']) for column in inspect(conn).get_columns('paid_courses')}
+    if columns.get('user_id', '').upper() == 'INTEGER':
+        return
+
+    # copy and drop rather than rename, so the new table's indexes and
+    # constraints don't clash with the old ones' names on PostgreSQL
+    conn.execute(text('CREATE TABLE paid_courses_old AS SELECT * FROM paid_courses'))
+    conn.execute(text('DROP TABLE paid_courses'))
+    metadata.tables['paid_courses'].create(conn)
+    # ON CONFLICT DO NOTHING drops the duplicate purchases the old code
+    # allowed, keeping the oldest row for every (user, course) pair
+    conn.execute(text('''
+        INSERT INTO paid_courses
+            (id, course_name, teacher_name, teacher_phone, user_name, user_phone, user_id, course_id)
+        SELECT p.id, p.course_name, p.teacher_name, p.teacher_phone, p.user_name, p.user_phone,
+               COALESCE(CAST(NULLIF(p.user_id, '') AS INTEGER),
+                        (SELECT u.id FROM "user" u WHERE u.phone = p.user_phone)),
+               COALESCE(CAST(NULLIF(p.course_id, '') AS INTEGER),
+                        (SELECT c.id FROM courses c
+                          WHERE c.course_name = p.course_name AND c.teacher_phone = p.teacher_phone
+                          ORDER BY c.id LIMIT 1))
+        FROM paid_courses_old p
+        WHERE true
+        ORDER BY p.id
+        ON CONFLICT DO NOTHING
+    '''))
+    conn.execute(text('DROP TABLE paid_courses_old'))
+    reset_id_sequence(conn, 'paid_courses')
+
+
+@migration(3)
+def videos_course_id(conn, metadata):
+    # videos were only linked to their course by name, give them a real course_id
+    add_column(conn, 'videos', 'course_id', 'INTEGER REFERENCES courses (id)')
+    conn.execute(text('''
+        UPDATE videos SET course_id = (
+            SELECT c.id FROM courses c
+             WHERE c.course_name = videos.course_name AND c.teacher_name = videos.teacher_name
+             ORDER BY c.id LIMIT 1)
+        WHERE course_id IS NULL
+    '''))
+    create_index(conn, 'ix_videos_course_id', 'videos', 'course_id')
+
+
+@migration(4)
+def lookup_indexes(conn, metadata):
+    # one index for every column the views filter on, see QUERY_PLANS in main.py
+    create_index(conn, 'ix_courses_status', 'courses', 'status')
+    create_index(conn, 'ix_courses_teacher_phone', 'courses', 'teacher_phone')
+    create_index(conn, 'ix_teacher_status', 'teacher', 'status')
+    create_index(conn, 'ix_students_name', 'students', 'name')
+    create_index(conn, 'ix_students_parent_name', 'students', 'parent_name')
+    create_index(conn, 'ix_question_course_name', 'question', 'course_name')
+    create_index(conn, 'ix_answer_question_id', 'answer', 'question_id')
+    create_index(conn, 'ix_quiz_result_user_course', 'quiz_result', 'user_id, course_name')
+    create_index(conn, 'ix_quiz_result_course_name', 'quiz_result', 'course_name')
+    create_index(conn, 'ix_quiz_result_parent_name', 'quiz_result', 'parent_name')
+    create_index(conn, 'ix_user_student_association_user_id', 'user_student_association', 'user_id')
+    create_index(conn, 'ix_user_student_association_student_id', 'user_student_association', 'student_id')
+
+
+@migration(5)
+def unique_quiz_results(conn, metadata):
+    # one result per student and course, so a retried submission can't be
+    # stored twice; keep the first of any duplicates recorded before this
+    conn.execute(text('''
+        DELETE FROM quiz_result WHERE id NOT IN (
+            SELECT MIN(id) FROM quiz_result GROUP BY user_id, course_name)
+    '''))
+    conn.execute(text('DROP INDEX IF EXISTS ix_quiz_result_user_course'))
+    create_index(conn, 'uq_quiz_result_user_course', 'quiz_result', 'user_id, course_name', unique=True)
+
+
+@migration(6)
+def fill_stats_tables(conn, metadata):
+    # the summary tables are new, count what is already in the database;
+    # later changes are kept up by the views and `flask rebuild-stats`
+    conn.execute(text('''
+        INSERT INTO course_stats (course_id, enrollments, revenue)
+        SELECT c.id, COUNT(p.id), SUM(COALESCE(c.course_price, 0))
+          FROM courses c JOIN paid_courses p ON p.course_id = c.id
+         GROUP BY c.id
+    '''))
+    conn.execute(text('''
+        INSERT INTO teacher_stats (teacher_phone, enrollments, revenue)
+        SELECT c.teacher_phone, COUNT(p.id), SUM(COALESCE(c.course_price, 0))
+          FROM courses c JOIN paid_courses p ON p.course_id = c.id
+         WHERE c.teacher_phone IS NOT NULL
+         GROUP BY c.teacher_phone
+    '''))
+    conn.execute(text('''
+        INSERT INTO quiz_stats (course_name, attempts, total_score)
+        SELECT course_name, COUNT(id), SUM(score) FROM quiz_result GROUP BY course_name
+    '''))
+
+
+@migration(7)
+def search_indexes(conn, metadata):
+    # FTS5 tables for /search, see search.py
+    if conn.dialect.name != 'sqlite':
+        return
+    conn.execute(text('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS course_search USING fts5(
+            course_name, teacher_name, tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+    '''))
+    conn.execute(text('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS video_search USING fts5(
+            name, description, course_name, teacher_name,
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3')
+    '''))
+    conn.execute(text('''
+        INSERT INTO course_search (rowid, course_name, teacher_name)
+        SELECT id, course_name, teacher_name FROM courses
+    '''))
+    conn.execute(text('''
+        INSERT INTO video_search (rowid, name, description, course_name, teacher_name)
+        SELECT id, name, description, course_name, teacher_name FROM videos
+    '''))
+
+
+@migration(8)
+def family_links(conn, metadata):
+    # parents and children used to be matched by display name, link them
+    # through user_student_association instead
+    # the table has no key to tell duplicates apart, keep one copy of each pair
+    conn.execute(text('''
+        CREATE TABLE user_student_links AS
+        SELECT DISTINCT user_id, student_id FROM user_student_association
+    '''))
+    conn.execute(text('DELETE FROM user_student_association'))
+    conn.execute(text('''
+        INSERT INTO user_student_association (user_id, student_id)
+        SELECT user_id, student_id FROM user_student_links
+    '''))
+    conn.execute(text('DROP TABLE user_student_links'))
+    create_index(conn, 'uq_user_student', 'user_student_association', 'user_id, student_id', unique=True)
+    # a parent by the phone saved with the child, or by name when that name is
+    # unique among parents
+    conn.execute(text('''
+        INSERT INTO user_student_association (user_id, student_id)
+        SELECT u.id, s.id FROM students s JOIN "user" u ON u.role = 'user' AND (
+            (COALESCE(s.parent_phone, '') != '' AND u.phone = s.parent_phone)
+            OR (COALESCE(s.parent_phone, '') = '' AND u.name = s.parent_name
+                AND (SELECT COUNT(*) FROM "user" p WHERE p.role = 'user' AND p.name = s.parent_name) = 1))
+        WHERE true
+        ON CONFLICT DO NOTHING
+    '''))
+    # a student account by name, only where the name is unique on both sides
+    conn.execute(text('''
+        INSERT INTO user_student_association (user_id, student_id)
+        SELECT u.id, s.id FROM students s JOIN "user" u ON u.role = 'student' AND u.name = s.name
+        WHERE (SELECT COUNT(*) FROM students o WHERE o.name = s.name) = 1
+          AND (SELECT COUNT(*) FROM "user" o WHERE o.role = 'student' AND o.name = s.name) = 1
+        ON CONFLICT DO NOTHING
+    '''))
+
+
+@migration(9)
+def teacher_ids(conn, metadata):
+    # courses and videos were only linked to their teacher by phone, give
+    # them the teacher's id, and record when videos and purchases were made
+    add_column(conn, 'courses', 'teacher_id', 'INTEGER REFERENCES teacher (id)')
+    conn.execute(text('''
+        UPDATE courses SET teacher_id = (SELECT t.id FROM teacher t WHERE t.phone = courses.teacher_phone)
+        WHERE teacher_id IS NULL
+    '''))
+    conn.execute(text('''
+        UPDATE videos SET teacher_id = COALESCE(
+            (SELECT c.teacher_id FROM courses c WHERE c.id = videos.course_id),
+            (SELECT t.id FROM teacher t WHERE t.phone = videos.teacher_phone))
+        WHERE teacher_id IS NULL
+    '''))
+    create_index(conn, 'ix_courses_teacher_id', 'courses', 'teacher_id')
+    create_index(conn, 'ix_videos_teacher_id', 'videos', 'teacher_id')
+    add_column(conn, 'videos', 'created_at', column_type(conn, metadata, 'videos', 'created_at'))
+    add_column(conn, 'paid_courses', 'created_at', column_type(conn, metadata, 'paid_courses', 'created_at'))
+
+
+@migration(10)
+def upload_hashes(conn, metadata):
+    # uploaded videos and samples keep their content hash and poster frame
+    add_column(conn, 'videos', 'content_hash', 'VARCHAR(64)')
+    add_column(conn, 'videos', 'poster', 'VARCHAR(200)')
+    add_column(conn, 'teacher', 'sample_hash', 'VARCHAR(64)')
+    add_column(conn, 'teacher', 'sample_poster', 'VARCHAR(100)')
+    create_index(conn, 'ix_videos_content_hash', 'videos', 'content_hash')
+    create_index(conn, 'ix_teacher_sample_hash', 'teacher', 'sample_hash')
+
+
+def latest_version():
+    return max(version for version, func in MIGRATIONS)
+
+
+def current_version(conn):
+    if not inspect(conn).has_table('schema_version'):
+        conn.execute(text('CREATE TABLE schema_version (version INTEGER NOT NULL)'))
+        conn.execute(text('INSERT INTO schema_version (version) VALUES (0)'))
+        return 0
+    return conn.execute(text('SELECT version FROM schema_version')).scalar()
+
+
+def upgrade(engine, metadata):
+    # returns the versions that were applied
+    with engine.begin() as conn:
+        fresh = not inspect(conn).has_table('user')
+        # new tables are always safe to create, changes to existing ones are
+        # left to the migrations
+        metadata.create_all(conn)
+        version = current_version(conn)
+        if fresh:
+            conn.execute(text('UPDATE schema_version SET version = :v'), {'v': latest_version()})
+            return []
+
+    applied = []
+    for number, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if number <= version:
+            continue
+        with engine.begin() as conn:
+            func(conn, metadata)
+            conn.execute(text('UPDATE schema_version SET version = :v'), {'v': number})
+        applied.append(number)
+    return applied
@@ -0,0 +1,94 @@
+# Keyset (seek) pagination: a page is "the next N rows after id X" instead of
+# OFFSET, so every page costs an index seek no matter how deep it is.
+# Links carry ?after=<id> or ?before=<id>, plus ?per_page=<n> capped at
+# MAX_PAGE_SIZE. Add ?format=json (or Accept: application/json) for JSON.
+# ?since=<id> is the same as ?after=<id>, the API uses it for syncing.
+from flask import request, url_for
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class Page:
+    def __init__(self, items, next_cursor=None, prev_cursor=None, per_page=DEFAULT_PAGE_SIZE):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def url(self, **cursor):
+        args = dict(request.view_args or {})
+        if self.per_page != DEFAULT_PAGE_SIZE:
+            args['per_page'] = self.per_page
+        if request.args.get('format'):
+            args['format'] = request.args['format']
+        return url_for(request.endpoint, **args, **cursor)
+
+    @property
+    def next_url(self):
+        return self.url(after=self.next_cursor) if self.next_cursor is not None else None
+
+    @property
+    def prev_url(self):
+        return self.url(before=self.prev_cursor) if self.prev_cursor is not None else None
+
+
+def page_size():
+    per_page = request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int)
+    return max(1, min(per_page, MAX_PAGE_SIZE))
+
+
+def cursor_args():
+    # (after, before, per_page) of the current request, handy as a cache key
+    after = request.args.get('after', type=int)
+    if after is None:
+        after = request.args.get('since', type=int)
+    return after, request.args.get('before', type=int), page_size()
+
+
+def keyset_page(query, column, convert=None):
+    # column must be unique and indexed together with the query's filters,
+    # the primary key works for every list in the app
+    after, before, per_page = cursor_args()
+    query = query.order_by(None)
+
+    if before is not None:
+        rows = query.filter(column < before).order_by(column.desc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after is not None:
+            query = query.filter(column > after)
+        rows = query.order_by(column).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev = after is not None
+
+    key = column.key
+    next_cursor = getattr(rows[-1], key) if has_next and rows else None
+    prev_cursor = getattr(rows[0], key) if has_prev and rows else None
+    items = [convert(row) for row in rows] if convert else rows
+    return Page(items, next_cursor, prev_cursor, per_page)
+
+
+def wants_json():
+    if request.args.get('format') == 'json':
+        return True
+    return request.accept_mimetypes.best == 'application/json'
+
+
+def page_json(page, fields):
+    def value(item, field):
+        return item[field] if isinstance(item, dict) else getattr(item, field)
+    return {
+        'items': [{field: value(item, field) for field in fields} for item in page.items],
+        'next': page.next_url,
+        'prev': page.prev_url,
+    }
@@ -0,0 +1,243 @@
+# Write-behind queue for quiz submissions.
+#
+# The quiz view only writes the answers to a spool file and returns a token;
+# a background thread in every worker claims spooled submissions in batches,
+# grades them and inserts their QuizResult rows in one transaction. The spool
+# lives on disk, so submissions survive a restart and are picked up again.
+#
+# A token is the signed (user_id, course_name) pair, so submitting the same
+# quiz twice gives the same token and the same spool file, and a retry can
+# never be recorded twice.
+#
+# The spool is QUIZ_SPOOL_DIR, or by default a directory under
+# instance/quiz_spool named after the database url, so apps that point at
+# different databases from the same instance folder (a benchmark, tests,
+# a second site) never store each other's submissions.
+#
+# When a batch fails its submissions are graded one at a time, so a single
+# bad one can't hold up the others. A submission that fails
+# QUIZ_QUEUE_MAX_ATTEMPTS times on its own is moved to the dead/ directory
+# of the spool and logged. Database outages don't count as attempts, the
+# batch is just tried again later.
+import hashlib
+import json
+import os
+import threading
+import time
+
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError
+
+# errors that say nothing about the submission itself
+TRANSIENT_ERRORS = (InterfaceError, OperationalError, TimeoutError)
+
+# claimed files that are older than this belong to a worker that died
+STALE_CLAIM_SECONDS = 300
+
+
+class QuizQueue:
+    def __init__(self):
+        self.app = None
+        self.process = None
+        self.spool_dir = None
+        self.dead_dir = None
+        self.batch_size = 100
+        self.max_attempts = 3
+        self.interval = 0.5
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def init_app(self, app, process):
+        # process(submissions) grades and stores a list of spooled dicts
+        self.app = app
+        self.process = process
+        self.spool_dir = app.config.get('QUIZ_SPOOL_DIR') or self.default_spool_dir(app)
+        self.batch_size = app.config.get('QUIZ_QUEUE_BATCH', 100)
+        self.interval = app.config.get('QUIZ_QUEUE_INTERVAL', 0.5)
+        self.max_attempts = app.config.get('QUIZ_QUEUE_MAX_ATTEMPTS', 3)
+        self.dead_dir = os.path.join(self.spool_dir, 'dead')
+        os.makedirs(self.dead_dir, exist_ok=True)
+        app.extensions['quiz_queue'] = self
+
+    def default_spool_dir(self, app):
+        root = os.path.join(app.instance_path, 'quiz_spool')
+        database = hashlib.sha1(app.config['SQLALCHEMY_DATABASE_URI'].encode()).hexdigest()[:12]
+        spool_dir = os.path.join(root, database)
+        os.makedirs(spool_dir, exist_ok=True)
+        # submissions spooled before the directory was per database
+        if os.path.isdir(root):
+            for name in os.listdir(root):
+                if name.endswith(('.json', '.work')):
+                    try:
+                        os.replace(os.path.join(root, name), os.path.join(spool_dir, name))
+                    except OSError:
+                        pass
+        return spool_dir
+
+    def serializer(self):
+        return URLSafeSerializer(self.app.secret_key, salt='quiz-submission')
+
+    def token(self, user_id, course_name):
+        return self.serializer().dumps([user_id, course_name])
+
+    def read_token(self, token):
+        try:
+            user_id, course_name = self.serializer().loads(token)
+        except (BadSignature, ValueError):
+            return None
+        return user_id, course_name
+
+    def path(self, token, suffix='.json'):
+        name = hashlib.sha1(token.encode()).hexdigest()
+        return os.path.join(self.spool_dir, name + suffix)
+
+    def is_pending(self, token):
+        return os.path.exists(self.path(token)) or os.path.exists(self.path(token, '.work'))
+
+    def is_dead(self, token):
+        return os.path.exists(os.path.join(self.dead_dir, os.path.basename(self.path(token))))
+
+    def write(self, path, submission):
+        # write then rename, a half-written file is never visible to a worker
+        temp = path[:path.rindex('.')] + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(submission, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, path)
+
+    def submit(self, user_id, course_name, payload):
+        token = self.token(user_id, course_name)
+        if not self.is_pending(token):
+            self.write(self.path(token), dict(payload, user_id=user_id, course_name=course_name, token=token))
+            # a new submission replaces one that was given up on
+            try:
+                os.remove(os.path.join(self.dead_dir, os.path.basename(self.path(token))))
+            except FileNotFoundError:
+                pass
+        self.wakeup.set()
+        return token
+
+    def claim(self):
+        # renaming is atomic, so when several workers race for a file only one wins
+        claimed = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if len(claimed) >= self.batch_size:
+                break
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            work = path[:-len('.json')] + '.work'
+            try:
+                os.rename(path, work)
+            except OSError:
+                continue
+            # the claim's age is what recover() looks at, not the submission's
+            os.utime(work)
+            claimed.append(work)
+        return claimed
+
+    def release(self, claimed):
+        for work in claimed:
+            try:
+                os.rename(work, work[:-len('.work')] + '.json')
+            except OSError:
+                pass
+
+    def recover(self):
+        now = time.time()
+        stale = []
+        for name in os.listdir(self.spool_dir):
+            if not name.endswith('.work'):
+                continue
+            path = os.path.join(self.spool_dir, name)
+            try:
+                if now - os.path.getmtime(path) > STALE_CLAIM_SECONDS:
+                    stale.append(path)
+            except OSError:
+                # finished by another worker in the meantime
+                continue
+        self.release(stale)
+
+    def bury(self, work, reason):
+        dead = os.path.join(self.dead_dir, os.path.basename(work)[:-len('.work')] + '.json')
+        os.replace(work, dead)
+        self.app.logger.error('gave up on quiz submission %s: %s', dead, reason)
+
+    def failed(self, work, submission, error):
+        # counts a failure of this submission on its own, it is retried with
+        # a later batch until it runs out of attempts
+        attempts = submission.get('attempts', 0) + 1
+        if attempts >= self.max_attempts:
+            self.bury(work, f'failed {attempts} times, last with {error!r}')
+            return
+        self.app.logger.warning('quiz submission %s failed (attempt %s of %s): %r',
+                                work, attempts, self.max_attempts, error)
+        self.write(work[:-len('.work')] + '.json', dict(submission, attempts=attempts))
+        os.remove(work)
+
+    def load(self, claimed):
+        loaded = []
+        for work in claimed:
+            try:
+                with open(work) as f:
+                    loaded.append((work, json.load(f)))
+            except ValueError as e:
+                self.bury(work, f'unreadable: {e}')
+        return loaded
+
+    def store(self, loaded):
+        with self.app.app_context():
+            self.process([submission for work, submission in loaded])
+        for work, submission in loaded:
+            os.remove(work)
+
+    def drain(self):
+        while True:
+            claimed = self.claim()
+            if not claimed:
+                return
+            loaded = self.load(claimed)
+            try:
+                self.store(loaded)
+                continue
+            except TRANSIENT_ERRORS:
+                self.release(claimed)
+                raise
+            except Exception as e:
+                if len(loaded) == 1:
+                    self.failed(*loaded[0], e)
+                    return
+                self.app.logger.warning('grading a batch of %s quiz submissions failed, trying them one by one',
+                                        len(loaded), exc_info=True)
+            for i, (work, submission) in enumerate(loaded):
+                try:
+                    self.store([(work, submission)])
+                except TRANSIENT_ERRORS:
+                    self.release([work for work, submission in loaded[i:]])
+                    raise
+                except Exception as e:
+                    self.failed(work, submission, e)
+            # anything that failed is back in the spool, leave it for the next round
+            return
+
+    def run(self):
+        # a worker that dies holding a claim leaves it behind while this one
+        # keeps running, so look for stale claims again every now and then
+        recovered = 0.0
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            try:
+                if time.monotonic() - recovered > STALE_CLAIM_SECONDS / 2:
+                    self.recover()
+                    recovered = time.monotonic()
+                self.drain()
+            except Exception:
+                self.app.logger.exception('grading quiz submissions failed, will retry')
+                time.sleep(self.interval)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='quiz-queue', daemon=True)
+            self.thread.start()
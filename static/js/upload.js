@@ -0,0 +1,87 @@
+// Resumable uploads for forms with an <input type="file" data-upload-kind="...">
+// and a hidden upload_id field, see uploads.py. The file is sent in pieces
+// before the form; an interrupted upload of the same file carries on from
+// the last piece the server acknowledged, even after a reload.
+(function () {
+    var API = '/api/v1/uploads';
+    var RETRIES = 5;
+
+    function wait(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    async function checksum(blob) {
+        // crypto.subtle is only there on https and localhost, the server
+        // accepts pieces without a checksum
+        if (!(window.crypto && crypto.subtle)) return null;
+        var digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+        return 'sha256 ' + Array.from(new Uint8Array(digest)).map(function (b) {
+            return b.toString(16).padStart(2, '0');
+        }).join('');
+    }
+
+    async function json(response) {
+        var data = await response.json();
+        if (!response.ok) throw new Error(data.error || response.statusText);
+        return data;
+    }
+
+    async function start(file, kind, key) {
+        var id = localStorage.getItem(key);
+        if (id) {
+            var response = await fetch(API + '/' + id);
+            if (response.ok) return response.json();
+            localStorage.removeItem(key);
+        }
+        var upload = await json(await fetch(API, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({filename: file.name, size: file.size, kind: kind})
+        }));
+        localStorage.setItem(key, upload.id);
+        return upload;
+    }
+
+    async function upload(file, kind, progress) {
+        var key = ['upload', kind, file.name, file.size, file.lastModified].join(':');
+        var state = await start(file, kind, key);
+        var failures = 0;
+        while (state.status === 'uploading' && state.offset < file.size) {
+            var piece = file.slice(state.offset, state.offset + state.chunk_size);
+            var headers = {'Upload-Offset': String(state.offset), 'Content-Type': 'application/offset+octet-stream'};
+            var sum = await checksum(piece);
+            if (sum) headers['Upload-Checksum'] = sum;
+            try {
+                state = await json(await fetch(API + '/' + state.id, {method: 'PATCH', headers: headers, body: piece}));
+                failures = 0;
+            } catch (error) {
+                if (++failures > RETRIES) throw error;
+                await wait(1000 * failures);
+                // ask where the server got to before sending the piece again
+                state = await json(await fetch(API + '/' + state.id));
+            }
+            progress(state.offset / file.size);
+        }
+        localStorage.removeItem(key);
+        return state.id;
+    }
+
+    document.querySelectorAll('input[type=file][data-upload-kind]').forEach(function (input) {
+        var form = input.form;
+        var status = document.createElement('p');
+        input.after(status);
+        form.addEventListener('submit', async function (event) {
+            if (!input.files.length || form.elements.upload_id.value) return;
+            event.preventDefault();
+            try {
+                form.elements.upload_id.value = await upload(input.files[0], input.dataset.uploadKind, function (done) {
+                    status.textContent = 'Uploading... ' + Math.floor(done * 100) + '%';
+                });
+                status.textContent = 'Uploaded';
+                form.submit();
+            } catch (error) {
+                status.textContent = 'Upload failed: ' + error.message;
+            }
+        });
+    });
+})();
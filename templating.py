@@ -0,0 +1,62 @@
+# Template compilation and fragment caching.
+#
+# Compiled templates are kept on disk with Jinja's bytecode cache, so a new
+# worker loads them instead of parsing every template again.
+#
+# {% cache namespace, key... %}...{% endcache %} renders its body once and
+# keeps the HTML in the app cache (cache.py) under that namespace; the body
+# must not use anything that isn't in the key. Fragment keys always include
+# the template name, a hash of its source, the line of the tag and
+# environment.fragment_cache_version (the asset build), so an edited template
+# or a new asset build never serves an old fragment, even from a shared cache.
+import hashlib
+import os
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class FragmentCache(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None, fragment_cache_version='')
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        prefix = f'{parser.name}:{self.source_hash(parser.name)}:{lineno}'
+        call = self.call_method('_render', [nodes.Const(prefix), nodes.List(args)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def source_hash(self, name):
+        if not name or self.environment.loader is None:
+            return ''
+        source = self.environment.loader.get_source(self.environment, name)[0]
+        return hashlib.sha1(source.encode('utf-8')).hexdigest()[:8]
+
+    def _render(self, prefix, args, caller):
+        store = self.environment.fragment_cache
+        if store is None:
+            return caller()
+        namespace, *parts = args
+        key = ':'.join([prefix, self.environment.fragment_cache_version, *(str(part) for part in parts)])
+        return Markup(store.get_or_set(namespace, key, lambda: str(caller())))
+
+
+def configure_templates(app, cache):
+    # has to run before anything touches app.jinja_env, the options are only
+    # read when the environment is created
+    options = dict(app.jinja_options)
+    options['extensions'] = list(options.get('extensions', ())) + [FragmentCache]
+    directory = app.config.get('TEMPLATE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja_cache')
+    os.makedirs(directory, exist_ok=True)
+    options['bytecode_cache'] = FileSystemBytecodeCache(directory)
+    app.jinja_options = options
+    if app.config.get('TEMPLATE_FRAGMENT_CACHE', True):
+        app.jinja_env.fragment_cache = cache
@@ -0,0 +1,49 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_app, db, User  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+PASSWORD = 'secret'
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "test.db"}',
+        'START_BACKGROUND_WORKERS': False,
+        'QUIZ_SPOOL_DIR': str(tmp_path / 'quiz_spool'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'MEDIA_FOLDER': str(tmp_path / 'media'),
+        'TEMPLATE_CACHE_DIR': str(tmp_path / 'jinja_cache'),
+        # no build, the templates link the files in static/
+        'ASSETS_DIST': str(tmp_path / 'dist'),
+    })
+    with app.app_context():
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def make_user(phone, name='user', role='user'):
+    user = User(phone=phone, name=name, role=role, password=generate_password_hash(PASSWORD))
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def login(client, phone):
+    response = client.post('/api/v1/login', json={'phone': phone, 'password': PASSWORD})
+    assert response.status_code == 200
+    return response
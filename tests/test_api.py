@@ -0,0 +1,41 @@
+import pytest
+
+from conftest import login, make_user
+
+
+@pytest.mark.parametrize('body', [[], ['100', 'secret'], 'secret', 7])
+def test_login_refuses_a_body_that_is_not_an_object(client, body):
+    response = client.post('/api/v1/login', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'the body must be a JSON object'}
+
+
+def test_login_refuses_credentials_that_are_not_strings(client):
+    make_user('100')
+    response = client.post('/api/v1/login', json={'phone': ['100'], 'password': {'$ne': ''}})
+    assert response.status_code == 400
+    assert 'strings' in response.get_json()['error']
+    # no body at all is missing credentials too
+    assert client.post('/api/v1/login').status_code == 400
+
+
+def test_enroll_refuses_a_list_body(client):
+    make_user('100')
+    login(client, '100')
+    response = client.post('/api/v1/enrollments', json=[{'course_id': 1}])
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'the body must be a JSON object'}
+    for course_id in ([1], '1', True, None):
+        response = client.post('/api/v1/enrollments', json={'course_id': course_id})
+        assert response.status_code == 400
+        assert response.get_json() == {'error': 'course_id must be a number'}
+
+
+def test_submit_quiz_refuses_a_list_body(client):
+    make_user('100', role='student')
+    login(client, '100')
+    response = client.post('/api/v1/quizzes/algebra', json=[{'1': 2}])
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'the body must be a JSON object'}
+    response = client.post('/api/v1/quizzes/algebra', json={'answers': [1, 2]})
+    assert response.status_code == 400
@@ -0,0 +1,67 @@
+import os
+import re
+import shutil
+
+from flask import Flask
+
+import assets
+from conftest import login, make_user
+
+
+def test_builds_keep_the_files_running_workers_use(tmp_path):
+    static = tmp_path / 'static'
+    (static / 'css').mkdir(parents=True)
+    dist = str(static / 'dist')
+    app = Flask(__name__, static_folder=str(static))
+    app.config['ASSETS_RELOAD_INTERVAL'] = 0
+    site = assets.Assets()
+
+    def build(css):
+        (static / 'css' / 'style.css').write_text(css)
+        built = assets.build(str(static), dist)['files']['css/style.css']
+        return os.path.join(dist, *built.split('/'))
+
+    first = build('body { color: red; }')
+    site.init_app(app)
+    version = site.version
+    second = build('body { color: blue; }')
+    # the worker still on the first manifest can send its file
+    assert os.path.exists(first) and os.path.exists(second)
+
+    with app.test_request_context():
+        app.preprocess_request()
+        assert site.url('css/style.css').endswith(os.path.basename(second))
+    assert site.version != version
+    assert app.jinja_env.fragment_cache_version == site.version
+
+    third = build('body { color: green; }')
+    assert not os.path.exists(first) and not os.path.exists(first + '.gz')
+    assert os.path.exists(second) and os.path.exists(third)
+
+
+def test_pages_link_existing_files_without_a_build(client):
+    make_user('100')
+    login(client, '100')
+    page = client.get('/profile').get_data(as_text=True)
+    stylesheet = re.search(r'id="pagestyle" href="([^"]+)"', page).group(1)
+    assert stylesheet == '/static/css/dashboard.css'
+    response = client.get(stylesheet)
+    assert response.status_code == 200
+    # and everything the development stand-in imports
+    imports = re.findall(r'@import url\("([^"]+)"\)', response.get_data(as_text=True))
+    response.close()
+    assert imports == [part.split('/')[-1] for part in assets.BUNDLES['css/dashboard.css']]
+    for name in imports:
+        response = client.get(f'/static/css/{name}')
+        assert response.status_code == 200
+        response.close()
+
+
+def test_the_bundle_replaces_its_stand_in(tmp_path):
+    css = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'css')
+    shutil.copytree(css, tmp_path / 'static' / 'css')
+    dist = tmp_path / 'static' / 'dist'
+    manifest = assets.build(str(tmp_path / 'static'), str(dist))
+    with open(dist / manifest['files']['css/dashboard.css']) as f:
+        built = f.read()
+    assert '@import' not in built and '.ni-' in built
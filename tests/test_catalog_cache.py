@@ -0,0 +1,55 @@
+from main import Courses, Teacher, cache, db
+
+
+def add_course(name):
+    course = Courses(course_name=name, teacher_name='t', teacher_phone='900', course_price=10, status='approved')
+    db.session.add(course)
+    db.session.commit()
+    return course
+
+
+def catalog(client):
+    return [course['course_name'] for course in client.get('/?format=json').get_json()['items']]
+
+
+def test_the_catalog_is_served_from_the_cache(client):
+    add_course('algebra')
+    assert catalog(client) == ['algebra']
+    misses = cache.stats['catalog']['misses']
+    assert catalog(client) == ['algebra']
+    assert client.get('/').status_code == 200
+    assert client.get('/').status_code == 200
+    # the page was built once, the JSON list once
+    assert cache.stats['catalog']['misses'] == misses + 1
+    assert cache.stats['catalog']['hits'] >= 2
+
+
+def test_a_committed_change_invalidates_the_catalog(client):
+    course = add_course('algebra')
+    assert catalog(client) == ['algebra']
+    assert b'algebra' in client.get('/').data
+
+    course.course_name = 'geometry'
+    db.session.commit()
+    assert catalog(client) == ['geometry']
+    assert b'geometry' in client.get('/').data
+
+    add_course('poetry')
+    assert catalog(client) == ['geometry', 'poetry']
+    db.session.add(Teacher(name='bob', phone='901', teacher_sample='', status='approved'))
+    db.session.commit()
+    assert b'bob' in client.get('/').data
+
+
+def test_a_rolled_back_change_keeps_the_catalog(client):
+    course = add_course('algebra')
+    assert catalog(client) == ['algebra']
+    invalidations = cache.stats['catalog']['invalidations']
+
+    course.course_name = 'geometry'
+    db.session.flush()
+    db.session.rollback()
+    # the next, unrelated commit must not carry the rolled back change along
+    db.session.commit()
+    assert cache.stats['catalog']['invalidations'] == invalidations
+    assert catalog(client) == ['algebra']
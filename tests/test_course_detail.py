@@ -0,0 +1,55 @@
+import re
+
+from conftest import login, make_user
+from main import Courses, Paid_courses, Videos, db
+
+
+def listed(response):
+    page = response.get_data(as_text=True)
+    names = re.findall(r'<h4 class="text-center text-green mx-auto">([^<]+)</h4>', page)
+    next_url = re.search(r'href="([^"]+)">Next', page)
+    prev_url = re.search(r'href="([^"]+)">&laquo; Previous', page)
+    return names, next_url and next_url.group(1).replace('&amp;', '&'), prev_url and prev_url.group(1)
+
+
+def test_videos_are_listed_a_page_at_a_time(client):
+    user = make_user('100')
+    course = Courses(course_name='algebra', status='approved')
+    other = Courses(course_name='history', status='approved')
+    db.session.add_all([course, other])
+    db.session.flush()
+    # interleaved with another course's videos, like a growing catalog
+    for i in range(45):
+        db.session.add(Videos(name=f'lesson {i}', course_id=course.id))
+        db.session.add(Videos(name=f'other {i}', course_id=other.id))
+    db.session.add(Paid_courses(user_id=user.id, course_id=course.id, course_name='algebra'))
+    db.session.commit()
+
+    names, after, before = listed(client.get(f'/detail/{course.id}'))
+    assert names == []
+    login(client, '100')
+
+    pages = []
+    url = f'/detail/{course.id}'
+    while url:
+        names, url, before = listed(client.get(url))
+        pages.append(names)
+    assert [len(names) for names in pages] == [20, 20, 5]
+    assert sum(pages, []) == [f'lesson {i}' for i in range(45)]
+
+    names, after, before = listed(client.get(before))
+    assert names == [f'lesson {i}' for i in range(20, 40)]
+
+
+def test_benchmark_catalog_size_is_set_on_its_own(tmp_path, monkeypatch):
+    import benchmark
+
+    # no queue or leaderboard threads outliving the test
+    monkeypatch.setenv('FLASK_START_BACKGROUND_WORKERS', 'false')
+    assert benchmark.run(['--scale', '40', '--videos', '500', '--requests', '2',
+                          '--database', str(tmp_path / 'benchmark.db')]) == 0
+    scale = benchmark.Scale(40, 500)
+    app = benchmark.create_app(str(tmp_path / 'benchmark.db'))
+    with app.app_context():
+        assert Videos.query.count() == 500
+        assert db.session.get(Videos, scale.video_id(2, 7)).course_id == 2
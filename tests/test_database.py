@@ -0,0 +1,108 @@
+import os
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+import migrations
+from conftest import login, make_user
+from database import configure_database, database_url
+from main import (CourseStats, Courses, QuizResult, QuizStats, TeacherStats, create_app, db,
+                  rebuild_stats, record_quiz_results)
+
+
+def test_explicit_url_wins_over_database_url(monkeypatch):
+    monkeypatch.setenv('DATABASE_URL', 'postgres://host/from_env')
+    assert database_url({'SQLALCHEMY_DATABASE_URI': 'sqlite:///explicit.db'}) == 'sqlite:///explicit.db'
+    assert database_url({'SQLALCHEMY_DATABASE_URI': None}) == 'postgresql://host/from_env'
+    monkeypatch.delenv('DATABASE_URL')
+    assert database_url({}) == 'sqlite:///users.db'
+
+
+def test_unsupported_database_is_refused():
+    with pytest.raises(ValueError, match='mysql'):
+        database_url({'SQLALCHEMY_DATABASE_URI': 'mysql://user@localhost/school'})
+
+
+def test_a_server_url_gets_a_sized_pool(monkeypatch, tmp_path):
+    monkeypatch.delenv('DATABASE_URL', raising=False)
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='postgres://user@db.internal/school', DB_POOL_SIZE=4,
+                      SQLALCHEMY_ENGINE_OPTIONS={'pool_recycle': 600})
+    configure_database(app)
+    options = app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    assert app.config['SQLALCHEMY_DATABASE_URI'] == 'postgresql://user@db.internal/school'
+    assert options == {'pool_size': 4, 'max_overflow': 20, 'pool_timeout': 30, 'pool_recycle': 600,
+                       'pool_pre_ping': True}
+
+    # no driver or server needed to see the options reach the pool: the same
+    # options on a SQLite file with the QueuePool a server url gets
+    engine = create_engine(f'sqlite:///{tmp_path / "pool.db"}', poolclass=QueuePool, **options)
+    pool = engine.pool
+    assert (pool.size(), pool._max_overflow, pool._timeout, pool._recycle, pool._pre_ping) == (4, 20, 30, 600, True)
+    with engine.connect():
+        assert pool.checkedout() == 1
+    engine.dispose()
+
+
+# the whole flow runs against a SQLite file, and against a real server as
+# well when TEST_DATABASE_URL points at one (its tables are dropped afterwards)
+@pytest.fixture(params=['sqlite', 'server'])
+def database(request, tmp_path):
+    if request.param == 'sqlite':
+        return f'sqlite:///{tmp_path / "integration.db"}'
+    url = os.environ.get('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip('set TEST_DATABASE_URL to run against a database server')
+    return url
+
+
+@pytest.fixture
+def server_app(database, tmp_path):
+    app = create_app({
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': database,
+        'START_BACKGROUND_WORKERS': False,
+        'QUIZ_SPOOL_DIR': str(tmp_path / 'quiz_spool'),
+        'UPLOAD_FOLDER': str(tmp_path / 'uploads'),
+        'MEDIA_FOLDER': str(tmp_path / 'media'),
+        'TEMPLATE_CACHE_DIR': str(tmp_path / 'jinja_cache'),
+    })
+    with app.app_context():
+        yield app
+        db.session.remove()
+        if not database.startswith('sqlite'):
+            db.drop_all()
+        db.engine.dispose()
+
+
+def test_enrollments_and_quiz_stats(server_app):
+    client = server_app.test_client()
+    assert migrations.upgrade(db.engine, db.metadata) == []
+    course = Courses(course_name='algebra', teacher_name='t', teacher_phone='900', course_price=25, status='approved')
+    db.session.add(course)
+    db.session.commit()
+
+    for phone in ('100', '101'):
+        make_user(phone)
+        login(client, phone)
+        assert client.post('/api/v1/enrollments', json={'course_id': course.id}).status_code == 201
+        assert client.post('/api/v1/enrollments', json={'course_id': course.id}).status_code == 409
+
+    record_quiz_results([
+        {'user_id': 1, 'course_name': 'algebra', 'name': 'a', 'parent_name': 'p', 'score': 6},
+        {'user_id': 2, 'course_name': 'algebra', 'name': 'b', 'parent_name': 'p', 'score': 9},
+    ])
+    # a retried batch is not counted twice
+    record_quiz_results([{'user_id': 1, 'course_name': 'algebra', 'name': 'a', 'parent_name': 'p', 'score': 6}])
+
+    def numbers():
+        db.session.expire_all()
+        return (db.session.get(CourseStats, course.id).enrollments, db.session.get(CourseStats, course.id).revenue,
+                db.session.get(TeacherStats, '900').revenue, db.session.get(QuizStats, 'algebra').total_score)
+
+    assert QuizResult.query.count() == 2
+    assert numbers() == (2, 50, 50, 15)
+    rebuild_stats()
+    assert numbers() == (2, 50, 50, 15)
@@ -0,0 +1,66 @@
+from sqlalchemy import event
+
+from conftest import login, make_user
+from main import CourseStats, Courses, Paid_courses, TeacherStats, db
+
+
+def make_course(teacher_phone=None, price=100):
+    course = Courses(course_name='algebra', teacher_name='t', teacher_phone=teacher_phone,
+                     course_price=price, status='approved')
+    db.session.add(course)
+    db.session.commit()
+    return course
+
+
+def test_buy_course_without_teacher(client):
+    user = make_user('100')
+    course = make_course()
+    login(client, user.phone)
+    response = client.post(f'/buy_course/{course.id}', data={'user_name': 'a', 'user_phone': '100'})
+    assert response.status_code == 200
+    assert Paid_courses.query.filter_by(user_id=user.id, course_id=course.id).count() == 1
+    assert db.session.get(CourseStats, course.id).enrollments == 1
+    assert TeacherStats.query.count() == 0
+
+
+def test_api_enroll_without_teacher(client):
+    user = make_user('100')
+    course = make_course()
+    login(client, user.phone)
+    response = client.post('/api/v1/enrollments', json={'course_id': course.id})
+    assert response.status_code == 201
+    assert client.post('/api/v1/enrollments', json={'course_id': course.id}).status_code == 409
+
+
+def test_enroll_counts_teacher(client):
+    user = make_user('100')
+    course = make_course(teacher_phone='900', price=40)
+    login(client, user.phone)
+    assert client.post('/api/v1/enrollments', json={'course_id': course.id}).status_code == 201
+    stats = db.session.get(TeacherStats, '900')
+    assert (stats.enrollments, stats.revenue) == (1, 40)
+
+
+def test_concurrent_purchase_is_already_purchased(client):
+    user = make_user('100')
+    api_course = make_course(teacher_phone='900')
+    form_course = make_course(teacher_phone='900')
+    login(client, user.phone)
+
+    def other_request(session, flush_context, instances):
+        # the same purchase commits from another request after this one checked
+        for obj in session.new:
+            if isinstance(obj, Paid_courses):
+                with db.engine.begin() as conn:
+                    conn.execute(Paid_courses.__table__.insert().values(user_id=obj.user_id, course_id=obj.course_id))
+
+    event.listen(db.session, 'before_flush', other_request)
+    try:
+        assert client.post('/api/v1/enrollments', json={'course_id': api_course.id}).status_code == 409
+        response = client.post(f'/buy_course/{form_course.id}', data={'user_name': 'a', 'user_phone': '100'})
+        assert response.get_data(as_text=True) == 'already purchased'
+    finally:
+        event.remove(db.session, 'before_flush', other_request)
+    assert Paid_courses.query.count() == 2
+    # the purchases that lost are not counted
+    assert CourseStats.query.count() == 0
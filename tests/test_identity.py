@@ -0,0 +1,68 @@
+import re
+
+from flask import g
+from sqlalchemy import event
+
+from conftest import login, make_user
+from main import User, db, identities
+
+
+def get(client, path):
+    # the test client's requests run in the fixture's app context, so they
+    # share its g and would share the identities memoized for one request
+    g.pop('identities', None)
+    db.session.remove()
+    return client.get(path)
+
+
+def user_selects(client, path):
+    # how many times a request read the user table
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if re.search(r'FROM user\b', statement):
+            statements.append(statement)
+
+    event.listen(db.engine, 'after_cursor_execute', count)
+    try:
+        response = get(client, path)
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', count)
+    return response, len(statements)
+
+
+def test_the_identity_is_cached_between_requests(client):
+    make_user('100')
+    login(client, '100')
+    get(client, '/add_question')
+    hits = identities.stats['identity']['hits']
+    response, selects = user_selects(client, '/add_question')
+    assert b'Access denied' in response.data
+    assert selects == 0
+    assert identities.stats['identity']['hits'] == hits + 1
+
+
+def test_a_role_change_is_seen_on_the_next_request(client):
+    make_user('100')
+    login(client, '100')
+    assert b'Access denied' in get(client, '/add_question').data
+
+    User.query.filter_by(phone='100').one().role = 'teacher'
+    db.session.commit()
+    response, selects = user_selects(client, '/add_question')
+    assert b'Access denied' not in response.data
+    assert selects == 1
+
+
+def test_a_rolled_back_change_keeps_the_cached_identity(client):
+    make_user('100')
+    login(client, '100')
+    get(client, '/add_question')
+
+    User.query.filter_by(phone='100').one().role = 'teacher'
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    response, selects = user_selects(client, '/add_question')
+    assert b'Access denied' in response.data
+    assert selects == 0
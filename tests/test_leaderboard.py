@@ -0,0 +1,72 @@
+from leaderboard import Leaderboards
+from main import QuizResult, db, leaderboards
+
+
+def committed_boards(rows):
+    # rows is the table as other transactions see it, (id, course, user id, name, score)
+    boards = Leaderboards()
+    boards.load = lambda after_id: sorted(row for row in rows if row[0] > after_id)
+    return boards
+
+
+def test_rank_and_top_results():
+    rows = [(1, 'algebra', 1, 'a', 4), (2, 'algebra', 2, 'b', 9), (3, 'algebra', 3, 'c', 4), (4, 'poetry', 4, 'd', 1)]
+    boards = committed_boards(rows)
+    assert [leader['name'] for leader in boards.leaders('algebra')] == ['b', 'a', 'c']
+    assert boards.standing('algebra', 4) == (2, 3, 66.7)
+    assert boards.standing('algebra', 10) == (1, 3, 100.0)
+    assert boards.standing('history', 4) == (None, 0, None)
+
+
+def test_a_result_that_commits_after_a_higher_id_is_counted():
+    rows = [(1, 'algebra', 1, 'a', 4)]
+    boards = committed_boards(rows)
+    boards.refresh()
+    # 2 is still in flight when 3 commits and is read
+    rows.append((3, 'algebra', 3, 'c', 6))
+    boards.refresh()
+    assert boards.gaps.keys() == {2}
+    rows.append((2, 'algebra', 2, 'b', 9))
+    boards.refresh()
+    assert boards.gaps == {}
+    assert [leader['name'] for leader in boards.leaders('algebra')] == ['b', 'c', 'a']
+    # and nothing is counted twice
+    boards.refresh()
+    assert boards.standing('algebra', 4) == (3, 3, 33.3)
+
+
+def test_a_gap_that_never_commits_is_forgotten():
+    rows = [(1, 'algebra', 1, 'a', 4)]
+    boards = committed_boards(rows)
+    boards.refresh()
+    rows.append((5, 'algebra', 5, 'e', 6))
+    boards.refresh()
+    assert boards.gaps.keys() == {2, 3, 4}
+    boards.late_seconds = 0
+    boards.refresh()
+    assert boards.gaps == {}
+    rows.append((3, 'algebra', 3, 'c', 9))
+    boards.refresh()
+    assert boards.standing('algebra', 0)[1] == 2
+
+
+def test_holes_in_the_table_at_startup_are_not_gaps():
+    boards = committed_boards([(10, 'algebra', 1, 'a', 4), (20, 'algebra', 2, 'b', 5)])
+    boards.refresh()
+    assert boards.gaps == {}
+
+
+def result(id, user_id, score):
+    return QuizResult(id=id, user_id=user_id, name=f'student{user_id}', course_name='algebra',
+                      parent_name='parent', score=score)
+
+
+def test_results_stored_out_of_order(app):
+    leaderboards.refresh()
+    db.session.add_all([result(1, 1, 3), result(3, 3, 5)])
+    db.session.commit()
+    leaderboards.refresh()
+    db.session.add(result(2, 2, 8))
+    db.session.commit()
+    leaderboards.refresh()
+    assert [leader['score'] for leader in leaderboards.leaders('algebra')] == [8, 5, 3]
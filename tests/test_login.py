@@ -0,0 +1,29 @@
+from main import User, authenticate, db, is_password_hash
+
+
+def make_plain_user(phone, password):
+    # an account from before passwords were hashed
+    db.session.add(User(phone=phone, name='old', role='user', password=password))
+    db.session.commit()
+
+
+def test_a_plain_password_is_upgraded_on_login(app):
+    make_plain_user('100', 'pässword')
+    assert authenticate('100', 'pässword').phone == '100'
+    stored = User.query.filter_by(phone='100').one().password
+    assert is_password_hash(stored)
+    assert authenticate('100', 'pässword') is not None
+
+
+def test_a_wrong_plain_password_is_refused(app):
+    make_plain_user('100', 'secret')
+    assert authenticate('100', 'secret2') is None
+    assert authenticate('100', 'Secret') is None
+    assert authenticate('100', '') is None
+    assert User.query.filter_by(phone='100').one().password == 'secret'
+
+
+def test_login_with_a_plain_password(client):
+    make_plain_user('100', 'secret')
+    assert client.post('/api/v1/login', json={'phone': '100', 'password': 'wrong'}).status_code == 401
+    assert client.post('/api/v1/login', json={'phone': '100', 'password': 'secret'}).status_code == 200
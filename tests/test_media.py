@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+import main
+
+DATA = bytes(range(256)) * 4096
+
+
+@pytest.fixture
+def video(app):
+    os.makedirs(main.media.folder, exist_ok=True)
+    with open(os.path.join(main.media.folder, 'lesson.mp4'), 'wb') as f:
+        f.write(DATA)
+    return '/media/lesson.mp4'
+
+
+def test_the_whole_file(client, video):
+    response = client.get(video)
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.mimetype == 'video/mp4'
+
+
+def test_a_range_with_an_end(client, video):
+    response = client.get(video, headers={'Range': 'bytes=1000-300999'})
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f'bytes 1000-300999/{len(DATA)}'
+    assert response.data == DATA[1000:301000]
+
+
+def test_a_range_to_the_end(client, video):
+    response = client.get(video, headers={'Range': 'bytes=-100'})
+    assert response.status_code == 206
+    assert response.data == DATA[-100:]
+    response = client.get(video, headers={'Range': f'bytes={len(DATA) - 10}-'})
+    assert response.data == DATA[-10:]
+
+
+def test_a_range_past_the_end_is_not_satisfiable(client, video):
+    response = client.get(video, headers={'Range': f'bytes={len(DATA)}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(DATA)}'
+
+
+def test_an_unchanged_file_is_not_sent_again(client, video):
+    etag = client.get(video).headers['ETag']
+    response = client.get(video, headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    # a range of a file that changed since comes back whole
+    response = client.get(video, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+    assert len(response.data) == len(DATA)
+    response = client.get(video, headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert response.status_code == 206
+
+
+def test_files_outside_the_media_folder_are_not_served(client, video):
+    assert client.get('/media/../app.db').status_code == 404
+    assert client.get('/media/missing.mp4').status_code == 404
@@ -0,0 +1,46 @@
+import logging
+import re
+
+from main import metrics
+
+
+def sample(client, name, **labels):
+    # the value of one series on /metrics, 0 when it isn't there yet
+    text = client.get('/metrics').get_data(as_text=True)
+    wanted = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    match = re.search(rf'^{name}\{{{re.escape(wanted)}\}} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else 0
+
+
+def test_requests_are_counted_by_route_and_status(client):
+    before = sample(client, 'argon_requests_total', endpoint='main.about', method='GET', status=200)
+    assert client.get('/about').status_code == 200
+    assert client.get('/about').status_code == 200
+    assert sample(client, 'argon_requests_total', endpoint='main.about', method='GET', status=200) == before + 2
+    assert sample(client, 'argon_request_seconds_count', endpoint='main.about', method='GET') >= 2
+    assert sample(client, 'argon_request_seconds_bucket', endpoint='main.about', method='GET', le='+Inf') >= 2
+
+    client.get('/no-such-page')
+    assert sample(client, 'argon_requests_total', endpoint='unknown', method='GET', status=404) >= 1
+
+
+def test_sql_statements_are_counted_per_route(client):
+    before = sample(client, 'argon_sql_statements_total', endpoint='main.index', method='GET')
+    client.get('/?format=json&per_page=7')
+    assert sample(client, 'argon_sql_statements_total', endpoint='main.index', method='GET') > before
+    assert sample(client, 'argon_sql_seconds_total', endpoint='main.index', method='GET') > 0
+
+
+def test_the_metrics_are_prometheus_text(client):
+    response = client.get('/metrics')
+    assert response.headers['Content-Type'].startswith('text/plain; version=0.0.4')
+    assert '# TYPE argon_request_seconds histogram' in response.get_data(as_text=True)
+
+
+def test_slow_requests_are_logged_with_their_sql(client, monkeypatch, caplog):
+    monkeypatch.setattr(metrics, 'slow_seconds', 0)
+    with caplog.at_level(logging.WARNING):
+        client.get('/?format=json&per_page=9')
+    logged = [record.getMessage() for record in caplog.records if 'slow request' in record.getMessage()]
+    assert logged and 'GET /' in logged[0]
+    assert 'SELECT' in logged[0]
@@ -0,0 +1,51 @@
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+import migrations
+
+
+def test_duplicate_phones_stop_the_phone_index(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE "user" (id INTEGER PRIMARY KEY, phone VARCHAR(100), name VARCHAR(1000))'))
+        conn.execute(text('''INSERT INTO "user" (id, phone, name) VALUES
+            (1, '555', 'alice'), (2, '777', 'bob'), (3, '555', 'carol')'''))
+
+    with pytest.raises(migrations.MigrationError) as error:
+        with engine.begin() as conn:
+            migrations.user_phone_index(conn, None)
+    assert "phone '555': users 1 (alice), 3 (carol)" in str(error.value)
+    assert '777' not in str(error.value)
+    assert not inspect(engine).get_indexes('user')
+
+    with engine.begin() as conn:
+        conn.execute(text('UPDATE "user" SET phone = \'556\' WHERE id = 3'))
+        migrations.user_phone_index(conn, None)
+    assert [index['name'] for index in inspect(engine).get_indexes('user')] == ['ix_user_phone']
+
+
+def test_upgrade_from_the_oldest_schema(app):
+    from main import Paid_courses, User, db, user_student_association
+
+    with db.engine.begin() as conn:
+        conn.execute(text('''INSERT INTO "user" (id, phone, name, role) VALUES
+            (1, '100', 'parent', 'user'), (2, '200', 'kid', 'student')'''))
+        conn.execute(text("INSERT INTO students (id, name, parent_name, parent_phone) VALUES (1, 'kid', 'parent', '100')"))
+        conn.execute(text("INSERT INTO courses (id, course_name, teacher_phone) VALUES (1, 'algebra', '900')"))
+        # purchases with string ids, some missing, and a duplicate
+        conn.execute(text('DROP TABLE paid_courses'))
+        conn.execute(text('''CREATE TABLE paid_courses (id INTEGER PRIMARY KEY, course_name VARCHAR, teacher_name VARCHAR,
+            teacher_phone VARCHAR, user_name VARCHAR, user_phone VARCHAR, user_id VARCHAR, course_id VARCHAR)'''))
+        conn.execute(text('''INSERT INTO paid_courses (id, course_name, teacher_phone, user_phone, user_id, course_id) VALUES
+            (1, 'algebra', '900', '100', '1', '1'), (2, 'algebra', '900', '100', '', ''),
+            (3, 'algebra', '900', '200', '', '')'''))
+        conn.execute(text('DROP INDEX uq_user_student'))
+        conn.execute(text('INSERT INTO user_student_association (user_id, student_id) VALUES (2, 1), (2, 1)'))
+        conn.execute(text('UPDATE schema_version SET version = 0'))
+
+    assert migrations.upgrade(db.engine, db.metadata) == list(range(1, migrations.latest_version() + 1))
+    purchases = db.session.query(Paid_courses.id, Paid_courses.user_id, Paid_courses.course_id).order_by(Paid_courses.id).all()
+    assert purchases == [(1, 1, 1), (3, 2, 1)]
+    links = db.session.execute(db.select(user_student_association).order_by('user_id')).all()
+    assert links == [(1, 1), (2, 1)]
+    assert db.session.get(User, 1).phone == '100'
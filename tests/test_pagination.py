@@ -0,0 +1,64 @@
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from main import Courses, db
+from pagination import MAX_PAGE_SIZE
+
+
+@pytest.fixture
+def courses(app):
+    def make(count):
+        db.session.add_all(Courses(course_name=f'course{i}', teacher_name='t', teacher_phone='900', course_price=10,
+                                   status='approved') for i in range(1, count + 1))
+        db.session.commit()
+    return make
+
+
+def page(client, **args):
+    data = client.get('/', query_string=dict(args, format='json')).get_json()
+    ids = [course['id'] for course in data['items']]
+    return ids, cursor(data['next']), cursor(data['prev'])
+
+
+def cursor(url):
+    # the after= or before= of a page link
+    if url is None:
+        return None
+    return {key: int(value[0]) for key, value in parse_qs(urlsplit(url).query).items() if key != 'format'}
+
+
+def test_walking_forward_and_back(client, courses):
+    courses(45)
+    ids, next, prev = page(client)
+    assert (ids, next, prev) == (list(range(1, 21)), {'after': 20}, None)
+    ids, next, prev = page(client, **next)
+    assert (ids, next, prev) == (list(range(21, 41)), {'after': 40}, {'before': 21})
+    ids, next, prev = page(client, **next)
+    assert (ids, next, prev) == (list(range(41, 46)), None, {'before': 41})
+
+    ids, next, prev = page(client, **prev)
+    assert (ids, next, prev) == (list(range(21, 41)), {'after': 40}, {'before': 21})
+    ids, next, prev = page(client, **prev)
+    assert (ids, next, prev) == (list(range(1, 21)), {'after': 20}, None)
+
+
+def test_a_last_page_that_is_exactly_full_has_no_next(client, courses):
+    courses(40)
+    ids, next, prev = page(client, after=20)
+    assert (ids[0], ids[-1], next) == (21, 40, None)
+    assert page(client, after=40) == ([], None, None)
+
+
+def test_the_page_size_is_kept_and_capped(client, courses):
+    courses(MAX_PAGE_SIZE + 5)
+    ids, next, prev = page(client, per_page=3)
+    assert (ids, next) == ([1, 2, 3], {'after': 3, 'per_page': 3})
+    assert len(page(client, per_page=10 ** 6)[0]) == MAX_PAGE_SIZE
+    assert len(page(client, per_page=0)[0]) == 1
+
+
+def test_a_page_before_the_first_row_is_empty(client, courses):
+    courses(5)
+    assert page(client, before=1)[0] == []
+    assert page(client, since=3)[0] == [4, 5]
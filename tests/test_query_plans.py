@@ -0,0 +1,15 @@
+from sqlalchemy import text
+
+import migrations
+from main import db, full_scans
+
+
+def test_view_queries_use_indexes(app):
+    assert migrations.upgrade(db.engine, db.metadata) == []
+    assert full_scans() == {}
+
+
+def test_a_missing_index_is_reported(app):
+    with db.engine.begin() as conn:
+        conn.execute(text('DROP INDEX ix_user_phone'))
+    assert list(full_scans()) == ['login']
@@ -0,0 +1,98 @@
+import io
+
+import pytest
+from sqlalchemy import event
+
+from conftest import login, make_user
+from main import Answer, Question, db
+
+
+@pytest.fixture
+def teacher(client):
+    make_user('900', 'teacher', role='teacher')
+    login(client, '900')
+    return client
+
+
+def correct_answers():
+    return [answer.answer_text for answer in Answer.query.filter_by(is_correct=True).order_by(Answer.id)]
+
+
+def upload_csv(client, text):
+    return client.post('/add_question', data={'quiz_file': (io.BytesIO(text.encode()), 'quiz.csv')},
+                       content_type='multipart/form-data')
+
+
+def test_blank_answers_keep_the_correct_one_in_json(teacher):
+    response = teacher.post('/add_question', json=[
+        {'course_name': 'algebra', 'question': 'q1', 'answers': ['A', '', 'C', 'D'], 'correct': 3},
+        {'course_name': 'algebra', 'question': 'q2', 'answers': ['A', None, 'C'], 'correct': 1},
+    ])
+    assert response.get_json() == {'added': 2}
+    assert correct_answers() == ['C', 'A']
+    assert Answer.query.count() == 5
+
+
+def test_blank_answers_keep_the_correct_one_in_csv(teacher):
+    upload_csv(teacher, 'course_name,question,answer_1,answer_2,answer_3,correct\nalgebra,q1,A,,C,3\n')
+    assert correct_answers() == ['C']
+
+
+def test_the_form_leaves_the_fourth_answer_blank(teacher):
+    teacher.post('/add_question', data={
+        'num_questions': '1', 'course_name_1': 'algebra', 'question_1': 'q1',
+        'answer_1_1': 'A', 'answer_1_2': 'B', 'answer_1_3': 'C', 'answer_1_4': '', 'correct_answer_1': '2',
+    })
+    assert correct_answers() == ['B']
+
+
+def test_a_blank_correct_answer_is_refused(teacher):
+    response = teacher.post('/add_question', json=[
+        {'course_name': 'algebra', 'question': 'q1', 'answers': ['A', '', 'C'], 'correct': 2},
+    ])
+    assert response.status_code == 400
+    assert 'blank' in response.get_json()['error']
+    assert db.session.query(Question).count() == 0
+
+
+QUIZ_CSV = ('course_name,question,answer_1,answer_2,answer_3,correct\n'
+            'algebra,q1,A,B,C,1\n'
+            'algebra,q2,A,B,C,2\n')
+
+
+def test_a_csv_quiz_is_imported(teacher):
+    response = upload_csv(teacher, QUIZ_CSV + 'algebra,q3,A,B,,2\n')
+    assert response.status_code == 302
+    assert [q.question_text for q in Question.query.order_by(Question.id)] == ['q1', 'q2', 'q3']
+    assert correct_answers() == ['A', 'B', 'B']
+    assert Answer.query.count() == 8
+
+
+def test_a_bad_csv_row_imports_nothing(teacher):
+    response = upload_csv(teacher, QUIZ_CSV + 'algebra,q3,A,B,C,7\n')
+    assert b'Question 3: correct answer 7 is out of range' in response.data
+    assert Question.query.count() == 0
+    assert Answer.query.count() == 0
+
+
+def test_a_failed_answer_insert_rolls_the_questions_back(teacher):
+    def fail(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('INSERT INTO answer'):
+            raise RuntimeError('disk full')
+
+    event.listen(db.engine, 'before_cursor_execute', fail)
+    try:
+        with pytest.raises(RuntimeError):
+            upload_csv(teacher, QUIZ_CSV)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', fail)
+    db.session.remove()
+    assert Question.query.count() == 0
+
+
+def test_import_benchmark(monkeypatch, capsys):
+    import benchmark
+
+    monkeypatch.setenv('FLASK_START_BACKGROUND_WORKERS', 'false')
+    assert benchmark.run(['--import', '50', '--requests', '2']) == 0
+    assert '2 imports of 50 questions' in capsys.readouterr().out
@@ -0,0 +1,82 @@
+from sqlalchemy import event
+
+from conftest import login, make_user
+from main import Answer, Question, db
+
+
+def make_quiz(course_name, count):
+    for q in range(1, count + 1):
+        question = Question(course_name=course_name, question_text=f'question {q}?')
+        question.answers = [Answer(answer_text=f'answer {q}.{a}', is_correct=a == 1) for a in range(1, 5)]
+        db.session.add(question)
+    db.session.commit()
+
+
+def student(app, phone):
+    make_user(phone, f'student{phone}', role='student')
+    client = app.test_client()
+    login(client, phone)
+    return client
+
+
+def order(client, course_name='algebra'):
+    return [(question['id'], [answer['id'] for answer in question['answers']])
+            for question in client.get(f'/api/v1/quizzes/{course_name}').get_json()['data']]
+
+
+def content(questions):
+    return sorted((q, sorted(answers)) for q, answers in questions)
+
+
+def test_each_student_keeps_their_own_order(app):
+    app.config['QUIZ_SHUFFLE'] = True
+    make_quiz('algebra', 10)
+    first, second = student(app, '100'), student(app, '101')
+
+    mine = order(first)
+    assert order(first) == mine
+    assert order(second) != mine
+    # the same questions and answers, only in another order
+    assert content(mine) == content(order(second))
+    assert [q for q, _ in mine] != sorted(q for q, _ in mine)
+
+
+def test_the_order_is_per_course(app):
+    app.config['QUIZ_SHUFFLE'] = True
+    make_quiz('algebra', 10)
+    make_quiz('poetry', 10)
+    client = student(app, '100')
+
+    def positions(course_name):
+        # question order relative to the course's first question
+        ids = [q for q, _ in order(client, course_name)]
+        return [id - min(ids) for id in ids]
+    assert positions('algebra') != positions('poetry')
+
+
+def test_without_shuffle_the_order_is_the_stored_one(app):
+    make_quiz('algebra', 5)
+    questions = order(student(app, '100'))
+    assert [q for q, _ in questions] == sorted(q for q, _ in questions)
+    assert all(answers == sorted(answers) for _, answers in questions)
+
+
+def statements(client, path):
+    count = []
+    db.session.remove()
+    listener = lambda *args: count.append(1)
+    event.listen(db.engine, 'after_cursor_execute', listener)
+    try:
+        assert client.get(path).status_code == 200
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', listener)
+    return len(count)
+
+
+def test_the_quiz_page_loads_every_answer_at_once(app):
+    make_quiz('algebra', 3)
+    make_quiz('poetry', 30)
+    client = student(app, '100')
+    statements(client, '/quiz/history')
+    # the first request for each course builds its quiz
+    assert statements(client, '/quiz/algebra') == statements(client, '/quiz/poetry')
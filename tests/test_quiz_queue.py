@@ -0,0 +1,88 @@
+import contextlib
+import logging
+import os
+import time
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import quiz_queue
+from quiz_queue import QuizQueue
+
+
+class App:
+    secret_key = 'test'
+    instance_path = ''
+    logger = logging.getLogger('test')
+
+    def __init__(self, spool_dir):
+        self.config = {'QUIZ_SPOOL_DIR': spool_dir}
+        self.extensions = {}
+
+    def app_context(self):
+        return contextlib.nullcontext()
+
+
+def make_queue(tmp_path, process=None):
+    queue = QuizQueue()
+    queue.init_app(App(str(tmp_path)), process or (lambda submissions: None))
+    return queue
+
+
+def test_recover_releases_only_stale_claims(tmp_path):
+    queue = make_queue(tmp_path)
+    old = queue.submit(1, 'a', {})
+    queue.submit(2, 'a', {})
+    # a submission that waited long in the spool is not stale once claimed
+    past = time.time() - 2 * quiz_queue.STALE_CLAIM_SECONDS
+    os.utime(queue.path(old), (past, past))
+    claimed = queue.claim()
+    assert len(claimed) == 2
+
+    queue.recover()
+    assert sorted(os.listdir(tmp_path)) == sorted(['dead'] + [os.path.basename(work) for work in claimed])
+
+    os.utime(claimed[0], (past, past))
+    queue.recover()
+    assert len(queue.claim()) == 1
+
+
+def test_bad_submission_does_not_block_the_batch(tmp_path):
+    stored = []
+
+    def process(submissions):
+        if any(submission['user_id'] == 2 for submission in submissions):
+            raise KeyError('answers')
+        stored.extend(submission['user_id'] for submission in submissions)
+
+    queue = make_queue(tmp_path, process)
+    for user_id in (1, 2, 3):
+        queue.submit(user_id, 'a', {})
+    bad = queue.token(2, 'a')
+
+    queue.drain()
+    assert sorted(stored) == [1, 3]
+    assert queue.is_pending(bad)
+
+    for attempt in range(queue.max_attempts - 1):
+        queue.drain()
+    assert not queue.is_pending(bad)
+    assert queue.is_dead(bad)
+    assert sorted(stored) == [1, 3]
+
+    # taking the quiz again replaces the dead submission
+    queue.submit(2, 'a', {})
+    assert queue.is_pending(bad) and not queue.is_dead(bad)
+
+
+def test_database_errors_keep_the_batch(tmp_path):
+    def process(submissions):
+        raise OperationalError('INSERT', {}, Exception('database is locked'))
+
+    queue = make_queue(tmp_path, process)
+    token = queue.submit(1, 'a', {})
+    for attempt in range(queue.max_attempts + 1):
+        with pytest.raises(OperationalError):
+            queue.drain()
+    assert queue.is_pending(token)
+    assert not os.listdir(queue.dead_dir)
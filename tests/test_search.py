@@ -0,0 +1,41 @@
+from sqlalchemy import create_engine, text
+
+import search
+
+
+def test_best_match_is_found_past_the_candidate_cap():
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text(search.create_sql('course_search')))
+        count = search.MAX_CANDIDATES + 500
+        # everything matches on the teacher, only the newest course on its name
+        rows = [(id, 'history', 'mathilda') for id in range(1, count)] + [(count, 'mathematics', 'bob')]
+        search.index_rows(conn, 'course_search', rows)
+
+        assert search.search(conn, 'course_search', 'math', limit=1) == [count]
+        assert len(search.search(conn, 'course_search', 'math', limit=10 ** 6)) == search.MAX_CANDIDATES
+        assert search.search(conn, 'course_search', '"') == []
+
+
+def test_only_the_newest_matches_are_scored(monkeypatch):
+    monkeypatch.setattr(search, 'MAX_SCORED', 100)
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        conn.execute(text(search.create_sql('course_search')))
+        # the oldest course is the best match but falls outside the scored window
+        rows = [(1, 'mathematics', 'bob')] + [(id, 'history', 'mathilda') for id in range(2, 301)]
+        rows[250] = (251, 'mathematics', 'bob')
+        search.index_rows(conn, 'course_search', rows)
+
+        assert search.search(conn, 'course_search', 'math', limit=1) == [251]
+        assert min(search.search(conn, 'course_search', 'math', limit=1000)) == 201
+
+
+def test_search_benchmark(tmp_path, monkeypatch, capsys):
+    import benchmark
+
+    monkeypatch.chdir(tmp_path)
+    assert benchmark.run(['--search', '3000', '--requests', '5']) == 0
+    out = capsys.readouterr().out
+    assert 'indexed 3000 videos' in out
+    assert 'two words' in out and 'target 20 ms' in out
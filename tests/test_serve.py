@@ -0,0 +1,39 @@
+import pytest
+
+import serve
+from main import DEV_SECRET_KEY, create_app
+
+OPTIONS = {'host': '127.0.0.1', 'port': 8000, 'workers': 3, 'threads': 4, 'timeout': 30}
+
+
+def test_in_process_caches_run_one_worker():
+    options = serve.shared_cache_options(OPTIONS, {'CACHE_URL': 'memory://', 'IDENTITY_CACHE_URL': 'redis://r'})
+    assert (options['workers'], options['threads']) == (1, 12)
+    options = serve.shared_cache_options(OPTIONS, {'CACHE_URL': 'redis://r', 'IDENTITY_CACHE_URL': 'local://'})
+    assert options['workers'] == 1
+
+
+def test_shared_caches_keep_the_workers():
+    config = {'CACHE_URL': 'redis://r/0', 'IDENTITY_CACHE_URL': 'redis://r/1'}
+    assert serve.shared_cache_options(OPTIONS, config) == OPTIONS
+
+
+def test_serve_needs_a_secret_key_from_the_environment(monkeypatch):
+    monkeypatch.delenv('FLASK_SECRET_KEY', raising=False)
+    with pytest.raises(SystemExit, match='FLASK_SECRET_KEY'):
+        serve.check_secret_key()
+    monkeypatch.setenv('FLASK_SECRET_KEY', 'f' * 64)
+    serve.check_secret_key()
+
+
+def test_the_app_refuses_to_start_without_a_secret_key(monkeypatch, tmp_path):
+    monkeypatch.delenv('FLASK_SECRET_KEY', raising=False)
+    config = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "app.db"}', 'START_BACKGROUND_WORKERS': False,
+              'QUIZ_SPOOL_DIR': str(tmp_path / 'quiz_spool'), 'TEMPLATE_CACHE_DIR': str(tmp_path / 'jinja_cache'),
+              'UPLOAD_FOLDER': str(tmp_path / 'uploads'), 'MEDIA_FOLDER': str(tmp_path / 'media')}
+    with pytest.raises(ValueError, match='FLASK_SECRET_KEY'):
+        create_app(config)
+    assert create_app(dict(config, TESTING=True)).secret_key == DEV_SECRET_KEY
+
+    monkeypatch.setenv('FLASK_SECRET_KEY', 'f' * 64)
+    assert create_app(config).secret_key == 'f' * 64
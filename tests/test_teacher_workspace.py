@@ -0,0 +1,97 @@
+import pytest
+from sqlalchemy import event
+
+from conftest import login, make_user
+from main import Courses, Paid_courses, QuizStats, Teacher, Videos, count_enrollment, db
+
+
+@pytest.fixture
+def teacher_client(client):
+    make_user('900', 'teacher', role='teacher')
+    teacher = Teacher(name='teacher', phone='900', status='approved')
+    db.session.add(teacher)
+    db.session.flush()
+    for i in range(3):
+        course = Courses(course_name=f'course {i}', teacher_name='teacher', teacher_phone='900',
+                         teacher_id=teacher.id, course_price=10, status='approved')
+        db.session.add(course)
+        db.session.flush()
+        db.session.add_all(Videos(name=f'video {j}', course_id=course.id, teacher_id=teacher.id)
+                           for j in range(2))
+        db.session.add(Paid_courses(course_id=course.id, course_name=course.course_name, user_id=100 + i))
+        count_enrollment(course)
+    db.session.add(QuizStats(course_name='course 0', attempts=4, total_score=30))
+    db.session.commit()
+    login(client, '900')
+    return client
+
+
+def count_statements(client, url):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    client.get(url)
+    # requests share the test's app context, start them from an empty session
+    db.session.remove()
+    event.listen(db.engine, 'after_cursor_execute', count)
+    try:
+        response = client.get(url, headers={'Accept': 'application/json'})
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', count)
+    assert response.status_code == 200
+    return response.get_json(), statements
+
+
+def test_my_courses(teacher_client):
+    data, statements = count_statements(teacher_client, '/my_courses')
+    # the grouped courses query and the videos of the page
+    assert len(statements) == 2
+    first = data['items'][0]
+    assert (first['videos'], first['enrollments'], first['revenue']) == (2, 1, 10)
+    assert (first['quiz_attempts'], first['average_score']) == (4, 7.5)
+    assert data['items'][1]['average_score'] is None
+
+
+def test_my_course_detail(teacher_client):
+    course = Courses.query.first()
+    data, statements = count_statements(teacher_client, f'/my_course_detail/{course.id}')
+    assert len(statements) == 2
+    assert len(data['videos']) == 2
+
+
+def test_my_students(teacher_client):
+    data, statements = count_statements(teacher_client, '/my_students')
+    assert len(statements) == 1
+    assert len(data['items']) == 3
+
+
+@pytest.fixture
+def orphan_course():
+    # a course added through the admin, without a teacher
+    course = Courses(course_name='orphan', status='approved')
+    db.session.add(course)
+    db.session.flush()
+    db.session.add(Videos(name='secret lesson', video_url='secret-id', course_id=course.id))
+    db.session.add(Paid_courses(course_id=course.id, course_name='orphan', user_id=1, user_name='buyer'))
+    db.session.commit()
+    return course
+
+
+@pytest.mark.parametrize('role', [None, 'user', 'student'])
+def test_teacher_pages_are_closed_to_non_teachers(client, orphan_course, role):
+    if role:
+        make_user('100', role=role)
+        login(client, '100')
+    for url in ('/my_courses', '/my_students', f'/my_course_detail/{orphan_course.id}'):
+        body = client.get(url).get_data(as_text=True)
+        assert 'Access denied' in body
+        assert 'secret' not in body and 'buyer' not in body
+
+
+def test_teacher_cannot_open_a_course_without_teacher(teacher_client, orphan_course):
+    body = teacher_client.get(f'/my_course_detail/{orphan_course.id}').get_data(as_text=True)
+    assert 'Course not found' in body and 'secret' not in body
+    data = teacher_client.get('/my_students', headers={'Accept': 'application/json'}).get_json()
+    assert 'buyer' not in {item['user_name'] for item in data['items']}
@@ -0,0 +1,124 @@
+import hashlib
+import io
+import os
+import threading
+
+import pytest
+from werkzeug.exceptions import BadRequest, Conflict
+
+import main
+from conftest import login, make_user
+from uploads import fcntl, process_upload
+
+VIDEO = os.urandom(10000)
+
+
+@pytest.fixture
+def teacher(client, monkeypatch):
+    make_user('900', 'teacher', role='teacher')
+    login(client, '900')
+    # process the last piece right away instead of in the process pool
+    monkeypatch.setattr(main.uploads, 'process', lambda upload_id, extension: main.record_upload(
+        upload_id, process_upload(main.uploads.part(upload_id), main.uploads.media_folder, extension)))
+    return client
+
+
+def start(client, size=len(VIDEO), **body):
+    return client.post('/api/v1/uploads', json=dict({'filename': 'lesson.mp4', 'size': size, 'kind': 'video'}, **body))
+
+
+def patch(client, upload_id, offset, piece, checksum=None):
+    headers = {'Upload-Offset': str(offset)}
+    if checksum:
+        headers['Upload-Checksum'] = checksum
+    return client.patch(f'/api/v1/uploads/{upload_id}', data=piece, headers=headers)
+
+
+def test_an_upload_arrives_in_pieces(teacher):
+    upload_id = start(teacher).get_json()['id']
+    assert patch(teacher, upload_id, 0, VIDEO[:4000]).headers['Upload-Offset'] == '4000'
+    # a client that lost its connection asks where to carry on
+    assert teacher.head(f'/api/v1/uploads/{upload_id}').headers['Upload-Offset'] == '4000'
+
+    piece = VIDEO[4000:]
+    response = patch(teacher, upload_id, 4000, piece, 'sha256 ' + hashlib.sha256(piece).hexdigest())
+    data = response.get_json()
+    content_hash = hashlib.sha256(VIDEO).hexdigest()
+    assert data['status'] == 'done'
+    assert data['path'] == f'media/{content_hash[:2]}/{content_hash}.mp4'
+    with open(os.path.join(main.media.folder, content_hash[:2], f'{content_hash}.mp4'), 'rb') as f:
+        assert f.read() == VIDEO
+    assert patch(teacher, upload_id, len(VIDEO), b'x').status_code == 409
+
+
+def test_a_piece_at_the_wrong_offset_or_with_a_bad_checksum_is_refused(teacher):
+    upload_id = start(teacher).get_json()['id']
+    response = patch(teacher, upload_id, 100, VIDEO[:100])
+    assert response.status_code == 409
+    assert response.get_json() == {'error': 'expected offset 0'}
+
+    response = patch(teacher, upload_id, 0, VIDEO[:100], 'sha256 ' + '0' * 64)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'checksum mismatch'}
+    # the bad piece was cut off again
+    assert teacher.head(f'/api/v1/uploads/{upload_id}').headers['Upload-Offset'] == '0'
+
+
+@pytest.mark.parametrize('body', [
+    {'size': True}, {'size': '10000'}, {'size': 0}, {'filename': ['lesson.mp4']}, {'filename': 'notes.txt'},
+    {'kind': ['video']}, {'kind': 'avatar'},
+])
+def test_a_bad_upload_is_refused(teacher, body):
+    assert start(teacher, **body).status_code == 400
+
+
+def test_a_list_body_is_refused(teacher):
+    response = teacher.post('/api/v1/uploads', json=[{'filename': 'lesson.mp4', 'size': 10, 'kind': 'video'}])
+    assert response.status_code == 400
+    assert response.get_json() == {'error': 'the body must be a JSON object'}
+
+
+class SlowStream:
+    # hands out the piece only once the test lets it
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+        self.reading = threading.Event()
+        self.go = threading.Event()
+
+    def read(self, size):
+        self.reading.set()
+        self.go.wait(5)
+        return self.data.read(size)
+
+
+def test_two_pieces_for_the_same_offset_are_not_both_written(teacher):
+    upload_id = start(teacher).get_json()['id']
+    stream = SlowStream(VIDEO[:100])
+    results = []
+    first = threading.Thread(target=lambda: results.append(
+        main.uploads.write(upload_id, len(VIDEO), 0, stream, 100)))
+    first.start()
+    stream.reading.wait(5)
+    with pytest.raises(Conflict, match='being written'):
+        main.uploads.write(upload_id, len(VIDEO), 0, io.BytesIO(VIDEO[:100]), 100)
+    stream.go.set()
+    first.join()
+    assert results == [100]
+    assert main.uploads.offset(upload_id) == 100
+
+
+@pytest.mark.skipif(fcntl is None, reason='flock is not available')
+def test_a_piece_being_written_by_another_worker_is_respected(teacher):
+    upload_id = start(teacher).get_json()['id']
+    with open(main.uploads.part(upload_id), 'r+b') as other:
+        fcntl.flock(other.fileno(), fcntl.LOCK_EX)
+        with pytest.raises(Conflict):
+            main.uploads.write(upload_id, len(VIDEO), 0, io.BytesIO(VIDEO[:100]), 100)
+    assert main.uploads.write(upload_id, len(VIDEO), 0, io.BytesIO(VIDEO[:100]), 100) == 100
+
+
+def test_a_short_piece_leaves_the_offset_alone(teacher):
+    upload_id = start(teacher).get_json()['id']
+    with pytest.raises(BadRequest, match='ended after 50'):
+        main.uploads.write(upload_id, len(VIDEO), 0, io.BytesIO(VIDEO[:50]), 100)
+    assert main.uploads.offset(upload_id) == 0
@@ -0,0 +1,222 @@
+# Resumable chunked uploads of lesson videos and samples.
+#
+# POST /uploads {"filename", "size", "kind"} starts an upload and returns its
+# id; the client then sends the file in pieces of at most UPLOAD_CHUNK_SIZE:
+#
+#   PATCH /uploads/<id>
+#   Upload-Offset: <where the piece starts>
+#   Upload-Checksum: sha256 <hex digest of the piece>
+#
+# A piece is streamed straight to UPLOAD_FOLDER/<id>.part and hashed on the
+# way, and it only counts once all of it arrived and the checksum matched;
+# otherwise the file is cut back to where the piece started. The size of the
+# .part file is the acknowledged offset, HEAD /uploads/<id> returns it in
+# Upload-Offset so a client that lost its connection knows where to carry
+# on. Every request carries one bounded piece, so a lecture never holds a
+# worker for the whole transfer and never sits in memory. One piece of an
+# upload is written at a time: a second PATCH while one is streaming in gets
+# 409, from this worker's threads and (with flock, so not on Windows, where
+# waitress runs a single process anyway) from the other workers.
+#
+# The last piece hands the file to a process pool that hashes it, moves it
+# into MEDIA_FOLDER under its hash (a file that is already there is reused,
+# the new copy dropped) and makes a poster frame with ffmpeg when it is
+# installed. The pool belongs to the worker that received the last piece; if
+# that worker dies first the upload stays 'processing' and has to be sent
+# again.
+import hashlib
+import multiprocessing
+import os
+import secrets
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from werkzeug.exceptions import BadRequest, Conflict, NotFound, RequestEntityTooLarge
+
+VIDEO_TYPES = ('.mp4', '.m4v', '.mov', '.webm', '.mkv')
+BUFFER = 64 * 1024
+POSTER_WIDTH = 480
+
+
+def new_id():
+    return secrets.token_hex(16)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def make_poster(video, poster):
+    # a frame from the first seconds of the video, False without ffmpeg
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return False
+    result = subprocess.run(
+        [ffmpeg, '-loglevel', 'error', '-y', '-ss', '1', '-i', video,
+         '-frames:v', '1', '-vf', f'scale={POSTER_WIDTH}:-2', poster],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120)
+    return result.returncode == 0 and os.path.exists(poster)
+
+
+def process_upload(part, media_folder, extension):
+    # runs in the process pool, returns paths relative to media_folder
+    content_hash = file_hash(part)
+    name = f'{content_hash[:2]}/{content_hash}{extension}'
+    target = os.path.join(media_folder, *name.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.remove(part)
+    else:
+        os.replace(part, target)
+
+    poster = f'{content_hash[:2]}/{content_hash}.jpg'
+    poster_path = os.path.join(media_folder, *poster.split('/'))
+    if not os.path.exists(poster_path) and not make_poster(target, poster_path):
+        poster = None
+    return {'content_hash': content_hash, 'path': name, 'poster': poster}
+
+
+class Uploads:
+    def __init__(self):
+        self.app = None
+        self.record = None
+        self.folder = None
+        self.media_folder = None
+        self.chunk_size = 8 * 1024 * 1024
+        self.max_size = 4 * 1024 ** 3
+        self.workers = 2
+        self.pool = None
+        self.lock = threading.Lock()
+        # ids of the uploads a piece is being written to in this process
+        self.writing = set()
+
+    def init_app(self, app, media_folder, record):
+        # record(upload_id, result) stores what process_upload returned, result
+        # is None when processing failed; it runs in an app context
+        self.app = app
+        self.record = record
+        self.media_folder = media_folder
+        self.folder = app.config.get('UPLOAD_FOLDER') or os.path.join(app.instance_path, 'uploads')
+        self.chunk_size = app.config.get('UPLOAD_CHUNK_SIZE', self.chunk_size)
+        self.max_size = app.config.get('UPLOAD_MAX_SIZE', self.max_size)
+        self.workers = app.config.get('UPLOAD_WORKERS', self.workers)
+        os.makedirs(self.folder, exist_ok=True)
+        app.extensions['uploads'] = self
+
+    def check(self, filename, size):
+        extension = os.path.splitext(filename or '')[1].lower()
+        if extension not in VIDEO_TYPES:
+            raise BadRequest(f'only {", ".join(VIDEO_TYPES)} files can be uploaded')
+        if not isinstance(size, int) or isinstance(size, bool) or size <= 0:
+            raise BadRequest('size must be a positive number of bytes')
+        if size > self.max_size:
+            raise RequestEntityTooLarge(f'files can be at most {self.max_size} bytes')
+        return extension
+
+    def part(self, upload_id):
+        return os.path.join(self.folder, f'{upload_id}.part')
+
+    def start(self, upload_id):
+        open(self.part(upload_id), 'wb').close()
+
+    def offset(self, upload_id):
+        try:
+            return os.path.getsize(self.part(upload_id))
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def exclusive(self, upload_id, f):
+        # holds the upload for one piece, 409 when another one is being written
+        with self.lock:
+            if upload_id in self.writing:
+                raise Conflict('another piece of this upload is being written')
+            self.writing.add(upload_id)
+        try:
+            if fcntl:
+                # released when f is closed, even if the worker dies
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise Conflict('another piece of this upload is being written')
+            yield
+        finally:
+            with self.lock:
+                self.writing.discard(upload_id)
+
+    def write(self, upload_id, size, offset, stream, length, checksum=None):
+        # appends one piece and returns the new offset
+        if length is None:
+            raise BadRequest('send Content-Length with every piece')
+        if length > self.chunk_size or offset + length > size:
+            raise RequestEntityTooLarge(f'pieces can be at most {self.chunk_size} bytes and must not run past the file')
+        expected = None
+        if checksum:
+            algorithm, _, expected = checksum.partition(' ')
+            if algorithm.lower() != 'sha256' or not expected:
+                raise BadRequest('Upload-Checksum must be "sha256 <hex digest>"')
+
+        try:
+            f = open(self.part(upload_id), 'r+b')
+        except FileNotFoundError:
+            raise NotFound('upload not found')
+        digest = hashlib.sha256()
+        received = 0
+        with f, self.exclusive(upload_id, f):
+            # checked under the lock, so two pieces for the same offset can't both land
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                raise Conflict(f'expected offset {current}')
+            f.seek(offset)
+            try:
+                while received < length:
+                    block = stream.read(min(BUFFER, length - received))
+                    if not block:
+                        break
+                    f.write(block)
+                    digest.update(block)
+                    received += len(block)
+            finally:
+                if received != length or (expected and digest.hexdigest() != expected.lower()):
+                    f.truncate(offset)
+                    f.flush()
+                    ok = False
+                else:
+                    # on disk before the next piece looks at the size
+                    f.flush()
+                    ok = True
+        if not ok:
+            if received != length:
+                raise BadRequest(f'piece ended after {received} of {length} bytes')
+            raise BadRequest('checksum mismatch')
+        return offset + length
+
+    def process(self, upload_id, extension):
+        with self.lock:
+            if self.pool is None:
+                # spawn, not fork, the web worker has threads and open connections
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        future = self.pool.submit(process_upload, self.part(upload_id), self.media_folder, extension)
+        future.add_done_callback(lambda done: self.finished(upload_id, done))
+        return future
+
+    def finished(self, upload_id, future):
+        try:
+            result = future.result()
+        except Exception:
+            self.app.logger.exception('processing upload %s failed', upload_id)
+            result = None
+        with self.app.app_context():
+            self.record(upload_id, result)